@@ -1,17 +1,104 @@
 # apps/discourse/admin.py
+import datetime
+
 from django.contrib import admin
-from .models import DiscourseProfile, SsoEventLog
+from django.utils import timezone
+
+from .models import (
+    DiscourseProfile,
+    PendingUserSync,
+    PendingWebhookEvent,
+    SsoEventLog,
+    SsoEventRollup,
+)
+from .rollups import rollup_summary
 
 
 @admin.register(DiscourseProfile)
 class DiscourseProfileAdmin(admin.ModelAdmin):
-    list_display = ("user", "external_id", "username", "last_sync")
+    list_display = (
+        "user",
+        "external_id",
+        "username",
+        "last_sync",
+        "last_sync_status",
+        "suspended_till",
+    )
     search_fields = ("user__username", "external_id", "username")
-    list_filter = ("last_sync",)
+    list_filter = ("last_sync", "last_sync_status")
 
 
 @admin.register(SsoEventLog)
 class SsoEventLogAdmin(admin.ModelAdmin):
-    list_display = ("user", "event_type", "created_at")
+    list_display = ("user", "event_type", "return_host", "created_at")
     list_filter = ("event_type", "created_at")
+    search_fields = ("user__username", "nonce", "external_id")
+    readonly_fields = ("details",)
+
+    @admin.display(description="Payload details")
+    def details(self, obj):
+        # Decompressed on display; the blob itself is never edited.
+        return obj.details
+
+
+@admin.register(PendingWebhookEvent)
+class PendingWebhookEventAdmin(admin.ModelAdmin):
+    """Webhook events not applied yet; those with attempts left over failed."""
+
+    list_display = ("event", "event_id", "external_id", "attempts", "received_at")
+    list_filter = ("event", "attempts")
+    search_fields = ("external_id", "event_id")
+
+
+@admin.register(PendingUserSync)
+class PendingUserSyncAdmin(admin.ModelAdmin):
+    """Users queued for a Discourse sync; claimed ones are being synced."""
+
+    list_display = ("user", "queued_at", "claimed_at")
     search_fields = ("user__username",)
+
+
+@admin.register(SsoEventRollup)
+class SsoEventRollupAdmin(admin.ModelAdmin):
+    """
+    Read-only analytics dashboard backed by the rollup table only, so its cost
+    does not depend on the size of SsoEventLog.
+    """
+
+    change_list_template = "admin/discourse/ssoeventrollup/change_list.html"
+    list_display = ("bucket", "period", "event_type", "count")
+    list_filter = ("period", "event_type")
+    date_hierarchy = "bucket"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        now = timezone.now()
+        event_types = [key for key, _ in SsoEventLog.EVENT_TYPE_CHOICES]
+        extra_context = {
+            **(extra_context or {}),
+            "event_types": event_types,
+            "hourly": self._table(
+                rollup_summary("hour", now - datetime.timedelta(hours=48)),
+                event_types,
+            ),
+            "daily": self._table(
+                rollup_summary("day", now - datetime.timedelta(days=30)),
+                event_types,
+            ),
+        }
+        return super().changelist_view(request, extra_context=extra_context)
+
+    @staticmethod
+    def _table(summary, event_types):
+        """Rows of (bucket, [counts per event type], error rate in percent)."""
+        rows = []
+        for bucket, counts in summary:
+            total = sum(counts.values())
+            error_rate = 100.0 * counts.get("error", 0) / total if total else 0.0
+            rows.append((bucket, [counts.get(t, 0) for t in event_types], error_rate))
+        return rows
@@ -2,15 +2,18 @@
 import hmac
 import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # import base64
 import requests
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from .sso import generate_sso_payload
+from .attributes import get_payload_serializer
+from .governor import BACKGROUND, INTERACTIVE, DiscourseRateLimited, governor
+from .profiles import sync_status
+from . import tracing
+from .sso import decode_sso_payload, generate_sso_params
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 DISCOURSE_API_URL = f"{settings.DISCOURSE_INSTANCE_URL}/users"
 DISCOURSE_API_KEY = settings.DISCOURSE_API_KEY
@@ -36,40 +39,89 @@ def generate_signature(sso_payload):
 #    return encoded_payload, sig
 
 
-def sync_user_with_discourse(user):
+def post_sync_sso(sso_payload, sig, priority=INTERACTIVE):
+    """POST a signed payload to /admin/users/sync_sso through the governor."""
+    headers = {
+        "Api-Key": DISCOURSE_API_KEY,
+        "Api-Username": DISCOURSE_ADMIN_USERNAME,
+        "Content-Type": "application/json",
+    }
+    sync_url = f"{settings.DISCOURSE_INSTANCE_URL}/admin/users/sync_sso"
+    with tracing.span("discourse.sync_sso", priority=priority) as span:
+        response = governor.call(
+            requests.post,
+            sync_url,
+            json={"sso": sso_payload, "sig": sig},
+            headers=tracing.inject_headers(headers),
+            verify=False,
+            timeout=10,
+            priority=priority,
+        )
+        span.set("http.status_code", response.status_code)
+    return response
+
+
+def sync_user_with_discourse(user, priority=INTERACTIVE):
     """Sync a Django user with Discourse (Create or Update)."""
 
     # Step 1: Skip superuser accounts
     if user.is_superuser:
-        logger.info(f"Skipping sync for Django superuser: %s", user.username)
+        logger.info("Skipping sync for Django superuser: %s", user.username)
         return
 
     nonce = "sync_nonce"
     return_url = settings.DISCOURSE_SSO_RETURN_URL
 
-    sso_payload, sig = generate_sso_payload(user, nonce, return_url)
-
-    data = {"sso": sso_payload, "sig": sig}
-
-    headers = {
-        "Api-Key": DISCOURSE_API_KEY,
-        "Api-Username": DISCOURSE_ADMIN_USERNAME,
-        "Content-Type": "application/json",
-    }
-
-    sync_url = f"{settings.DISCOURSE_INSTANCE_URL}/admin/users/sync_sso"
+    sso_payload, sig = generate_sso_params(user, nonce, return_url)
 
     try:
-        response = requests.post(
-            sync_url, json=data, headers=headers, verify=False, timeout=10
-        )
+        response = post_sync_sso(sso_payload, sig, priority=priority)
         response.raise_for_status()
-        logger.info(f"User %s synchronized with Discourse successfully.", user.username)
-    except requests.RequestException as e:
-        logger.error(f"Failed to sync user %s with Discourse: %s", user.username, e)
-
-
-def fetch_discourse_data(endpoint, params=None):
+        logger.info("User %s synchronized with Discourse successfully.", user.username)
+        result = response.json()
+    except (requests.RequestException, DiscourseRateLimited, ValueError) as e:
+        logger.error("Failed to sync user %s with Discourse: %s", user.username, e)
+        sync_status.record(user.id, ok=False)
+        return None
+    removed = decode_sso_payload(sso_payload).get("remove_groups")
+    sync_status.record(
+        user.id, ok=True, removed_groups=removed.split(",") if removed else ()
+    )
+    return result
+
+
+def sync_users_with_discourse(user_ids, workers=1, chunk_size=1000):
+    """
+    Re-sync a set of users, e.g. after a group they belong to changed or after
+    a bulk import. Users are loaded ``chunk_size`` at a time and, with
+    ``workers`` > 1, pushed from a thread pool; the governor still caps how
+    many requests are in flight. Returns the number of successful syncs.
+    """
+    user_ids = list(user_ids)
+    synced = 0
+    with tracing.span("discourse.sync_users", users=len(user_ids)), ThreadPoolExecutor(
+        max_workers=max(1, workers)
+    ) as pool:
+        for start in range(0, len(user_ids), chunk_size):
+            users = (
+                get_payload_serializer()
+                .queryset()
+                .filter(id__in=user_ids[start : start + chunk_size])
+            )
+            # The payloads only need the preloaded rows, so the worker
+            # threads never touch the database.
+            results = pool.map(
+                tracing.propagate(
+                    lambda user: sync_user_with_discourse(user, priority=BACKGROUND)
+                ),
+                list(users),
+            )
+            synced += sum(result is not None for result in results)
+    sync_status.flush()
+    return synced
+
+
+def fetch_discourse_data(endpoint, params=None, priority=INTERACTIVE):
     """
     Generic function to fetch data from a specified Discourse API endpoint.
     """
@@ -79,9 +131,81 @@ def fetch_discourse_data(endpoint, params=None):
             "Api-Key": settings.DISCOURSE_API_KEY,
             "Api-Username": "system",
         }
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        with tracing.span("discourse.fetch", endpoint=endpoint) as span:
+            response = governor.call(
+                requests.get,
+                url,
+                params=params,
+                headers=tracing.inject_headers(headers),
+                timeout=10,
+                priority=priority,
+            )
+            span.set("http.status_code", response.status_code)
         response.raise_for_status()
         return response.json()
-    except requests.RequestException as e:
+    except (requests.RequestException, DiscourseRateLimited) as e:
         logger.error("Error fetching data from Discourse endpoint %s: %s", endpoint, e)
         raise Exception("Error fetching data from Discourse") from e
+
+
+def _page_items(data, items_key):
+    """Pick the list of items out of one page, following a dotted key."""
+    if items_key:
+        for key in items_key.split("."):
+            data = data.get(key) or {}
+    return data or []
+
+
+def iter_discourse_pages(
+    endpoint,
+    params=None,
+    items_key=None,
+    page_size=None,
+    first_page=0,
+    priority=BACKGROUND,
+):
+    """
+    Lazily yield every item of a paginated Discourse list endpoint, e.g.
+    ``iter_discourse_pages("groups.json", items_key="groups")`` or
+    ``iter_discourse_pages("latest.json", items_key="topic_list.topics")``.
+
+    While the caller works through one page the next one is already being
+    fetched on a background thread, so only two pages are ever held in
+    memory. ``page_size`` is sent as ``per_page`` (endpoints that ignore it
+    keep their own size) and a shorter page ends the listing; otherwise the
+    listing ends at the first empty page. Breaking out of the loop stops the
+    prefetching.
+    """
+    params = dict(params or {})
+    if page_size:
+        params["per_page"] = page_size
+
+    def fetch(page):
+        return _page_items(
+            fetch_discourse_data(
+                endpoint, params={**params, "page": page}, priority=priority
+            ),
+            items_key,
+        )
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    try:
+        page = first_page
+        # Prefetches run on the pool thread but belong to the caller's trace.
+        fetch = tracing.propagate(fetch)
+        pending = pool.submit(fetch, page)
+        while True:
+            items = pending.result()
+            last = not items or (page_size and len(items) < page_size)
+            if not last:
+                page += 1
+                pending = pool.submit(fetch, page)
+            yield from items
+            if last:
+                return
+    finally:
+        # An abandoned prefetch is simply discarded (cancel_futures needs 3.9).
+        if pending is not None:
+            pending.cancel()
+        pool.shutdown(wait=False)
@@ -6,5 +6,17 @@ class DiscourseConfig(AppConfig):
     name = "apps.discourse"
 
     def ready(self):
-        # Import signals so that the receivers are registered.
+        # Import signals and checks so that they are registered.
+        import apps.discourse.checks  # pylint: disable=import-outside-toplevel,unused-import
         import apps.discourse.signals  # pylint: disable=import-outside-toplevel,unused-import
+        from apps.discourse.attributes import (  # pylint: disable=import-outside-toplevel
+            get_payload_serializer,
+        )
+        from apps.discourse.sso import (  # pylint: disable=import-outside-toplevel
+            get_return_url_matcher,
+        )
+
+        # Compile the return_sso_url allowlist and the SSO attribute mapping at
+        # startup, not on the first login; a bad mapping fails right here.
+        get_return_url_matcher()
+        get_payload_serializer()
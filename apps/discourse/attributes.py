@@ -0,0 +1,149 @@
+# apps/discourse/attributes.py
+"""
+DISCOURSE_SSO_ATTRIBUTES compiled into a payload serializer.
+
+The setting maps DiscourseConnect parameters to user attributes::
+
+    DISCOURSE_SSO_ATTRIBUTES = {
+        "external_id": "id",
+        "name": ["first_name", "last_name"],  # joined with spaces
+        "admin": "is_superuser",  # booleans become "true"/"false"
+        "add_groups": "discourse_profile.group_names",  # lists are comma-joined
+        "custom.department": "discourse_profile.external_id",
+    }
+
+Paths are checked against the models once, at startup, and tell the
+serializer which relations to select_related() and which columns to load
+with only(). A user from SSOPayloadSerializer.queryset() then serializes
+without further queries. Empty lists and None are left out of the payload.
+"""
+
+import functools
+
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.exceptions import (
+    FieldDoesNotExist,
+    ImproperlyConfigured,
+    ObjectDoesNotExist,
+)
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# What login() and the session need besides the payload columns.
+AUTH_FIELDS = ("id", "password", "last_login", "is_active")
+
+
+def _compile_path(model, path):
+    """
+    Validate ``path`` ("field" or "relation.field") against ``model``.
+    Returns (getter, relation to select_related or None, only() column).
+    """
+    *relations, attname = path.split(".")
+    current = model
+    for relation in relations:
+        try:
+            field = current._meta.get_field(relation)
+        except FieldDoesNotExist as e:
+            raise ImproperlyConfigured(f"DISCOURSE_SSO_ATTRIBUTES: {path}: {e}") from e
+        if not (field.one_to_one or field.many_to_one):
+            raise ImproperlyConfigured(
+                f"DISCOURSE_SSO_ATTRIBUTES: {path}: {relation} is not a "
+                "single-valued relation"
+            )
+        current = field.related_model
+    try:
+        field = current._meta.get_field(attname)
+    except FieldDoesNotExist as e:
+        raise ImproperlyConfigured(f"DISCOURSE_SSO_ATTRIBUTES: {path}: {e}") from e
+    if not field.concrete or field.many_to_many:
+        raise ImproperlyConfigured(
+            f"DISCOURSE_SSO_ATTRIBUTES: {path}: {attname} is not a column"
+        )
+
+    def getter(user):
+        obj = user
+        try:
+            for relation in relations:
+                obj = getattr(obj, relation)
+                if obj is None:
+                    return None
+        except ObjectDoesNotExist:
+            # No DiscourseProfile (yet).
+            return None
+        return getattr(obj, field.attname)
+
+    relation = "__".join(relations) or None
+    return getter, relation, "__".join(relations + [field.attname])
+
+
+def _format(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(item) for item in value) or None
+    return str(value)
+
+
+class SSOPayloadSerializer:
+    """Builds the DiscourseConnect parameters of a user from a compiled mapping."""
+
+    def __init__(self, mapping, model=None):
+        model = model or get_user_model()
+        self.model = model
+        self.fields = []
+        relations = set()
+        columns = set(AUTH_FIELDS)
+        for param, source in mapping.items():
+            paths = [source] if isinstance(source, str) else list(source)
+            getters = []
+            for path in paths:
+                getter, relation, column = _compile_path(model, path)
+                getters.append(getter)
+                columns.add(column)
+                if relation:
+                    relations.add(relation)
+            if isinstance(source, str):
+                self.fields.append((param, getters[0]))
+            else:
+                self.fields.append((param, self._joined(getters)))
+        self.select_related = tuple(sorted(relations))
+        self.only = tuple(sorted(columns))
+
+    @staticmethod
+    def _joined(getters):
+        def getter(user):
+            return " ".join(
+                str(value) for value in (get(user) for get in getters) if value
+            )
+
+        return getter
+
+    def queryset(self):
+        """Users with exactly the columns the payload and login() need."""
+        return self.model._default_manager.select_related(*self.select_related).only(
+            *self.only
+        )
+
+    def serialize(self, user):
+        """The mapped parameters of ``user``, in mapping order (nonce not included)."""
+        params = {}
+        for param, getter in self.fields:
+            value = _format(getter(user))
+            if value is not None:
+                params[param] = value
+        return params
+
+
+@functools.lru_cache(maxsize=None)
+def get_payload_serializer():
+    """Compile DISCOURSE_SSO_ATTRIBUTES once per process."""
+    return SSOPayloadSerializer(settings.DISCOURSE_SSO_ATTRIBUTES)
+
+
+@receiver(setting_changed)
+def _reset_payload_serializer(setting, **kwargs):
+    if setting in ("DISCOURSE_SSO_ATTRIBUTES", "AUTH_USER_MODEL"):
+        get_payload_serializer.cache_clear()
@@ -0,0 +1,113 @@
+# apps/discourse/audit.py
+
+import base64
+import collections
+import concurrent.futures
+import hmac
+
+from .eventlog import unpack_details
+from .models import SsoEventLog
+from .sso import sign_payload
+
+AUDIT_FIELDS = (
+    "id",
+    "payload_details",
+    "nonce",
+    "external_id",
+    "return_host",
+    "payload_blob",
+    "signature",
+)
+
+# Outcome of one event: signed with the current secret, with one of
+# DISCOURSE_CONNECT_PREVIOUS_SECRETS, with none of them, or not signed at all.
+CURRENT, PREVIOUS, MISMATCH, UNSIGNED = "current", "previous", "mismatch", "unsigned"
+
+
+def _signed_forms(details):
+    """
+    The payload as stored, and Base64-encoded if it is a decoded query string.
+    Compact rows (eventlog.py) give back the text exactly as it was stored.
+    """
+    yield details.encode()
+    if "=" in details and "&" in details or details.startswith("nonce="):
+        yield base64.b64encode(details.encode())
+
+
+def audit_rows(rows, secrets):
+    """
+    Check the signatures of ``rows`` (tuples of AUDIT_FIELDS) against
+    ``secrets``, current secret first, the way sso.verify_signature() does.
+    Returns the count per outcome and the ``(id, outcome)`` of every event
+    that was not signed with the current secret. Runs in pool workers.
+    """
+    counts = collections.Counter()
+    flagged = []
+    for event_id, details, nonce, external_id, return_host, blob, sig in rows:
+        details = details or unpack_details(nonce, external_id, return_host, blob)
+        if not sig or not details:
+            counts[UNSIGNED] += 1
+            continue
+        outcome = MISMATCH
+        for data in _signed_forms(details):
+            matched = next(
+                (
+                    index
+                    for index, secret in enumerate(secrets)
+                    if hmac.compare_digest(sign_payload(data, secret), sig.lower())
+                ),
+                None,
+            )
+            if matched is not None:
+                outcome = CURRENT if matched == 0 else PREVIOUS
+                break
+        counts[outcome] += 1
+        if outcome != CURRENT:
+            flagged.append((event_id, outcome))
+    return counts, flagged
+
+
+def iter_event_chunks(queryset, chunk_size):
+    """Yield lists of AUDIT_FIELDS tuples in id order, one query per chunk."""
+    last_id = 0
+    queryset = queryset.order_by("id").values_list(*AUDIT_FIELDS)
+    while True:
+        rows = [
+            # Blobs come back as memoryview, which cannot be pickled.
+            row[:5] + (bytes(row[5]) if row[5] is not None else None, row[6])
+            for row in queryset.filter(id__gt=last_id)[:chunk_size]
+        ]
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def audit_signatures(secrets, queryset=None, workers=1, chunk_size=10000):
+    """
+    Audit every event of ``queryset`` (all SsoEventLog rows by default),
+    spreading the chunks over ``workers`` processes. Yields the result of
+    audit_rows() per chunk; at most two chunks per worker are in flight, so
+    memory stays flat however many rows there are.
+    """
+    if queryset is None:
+        queryset = SsoEventLog.objects.all()
+    secrets = [secret for secret in secrets if secret]
+    chunks = iter_event_chunks(queryset, chunk_size)
+    if workers <= 1:
+        for rows in chunks:
+            yield audit_rows(rows, secrets)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for rows in chunks:
+            in_flight.add(pool.submit(audit_rows, rows, secrets))
+            if len(in_flight) >= workers * 2:
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(in_flight):
+            yield future.result()
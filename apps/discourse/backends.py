@@ -0,0 +1,85 @@
+# apps/discourse/backends.py
+import copy
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from . import hashing, invalidation, tracing
+from .attributes import get_payload_serializer
+
+logger = logging.getLogger(__name__)
+
+
+class DiscourseModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the DiscourseProfile together with the session
+    user, so building an SSO payload for request.user needs no extra query.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        # Same as ModelBackend.authenticate, but the profile comes with the
+        # user, so the login view can answer a pending SSO handshake without
+        # another query. Password hashing dominates; it is bounded by
+        # hashing.pool, and a login it sheds fails (see _check_password).
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        with tracing.span("auth.authenticate"):
+            try:
+                user = UserModel._default_manager.select_related(
+                    *get_payload_serializer().select_related
+                ).get(**{UserModel.USERNAME_FIELD: username})
+            except UserModel.DoesNotExist:
+                # Run the hasher once to reduce the timing difference between
+                # existing and nonexistent users (see ModelBackend).
+                self._check_password(request, password, None)
+                return None
+            correct, must_update = self._check_password(
+                request, password, user.password
+            )
+            if correct and must_update:
+                # What AbstractBaseUser.check_password's setter does.
+                user.set_password(password)
+                user.save(update_fields=["password"])
+            if correct and self.user_can_authenticate(user):
+                return user
+        return None
+
+    @staticmethod
+    def _check_password(request, password, encoded):
+        try:
+            return hashing.pool.check(password, encoded)
+        except hashing.PasswordHashPoolSaturated as e:
+            # Fail this login for every caller of authenticate() (admin,
+            # API, ...); views that can answer 503 look for the attribute.
+            logger.warning("Login shed: %s", e)
+            if request is not None:
+                request.password_hash_retry_after = e.retry_after
+            raise PermissionDenied(str(e)) from e
+
+    def get_user(self, user_id):
+        # Runs for every authenticated request. The user and profile come
+        # from the per-process cache, which User and DiscourseProfile saves
+        # invalidate in every worker (invalidation.py). Requests get their
+        # own copy, as login() and views modify request.user.
+        user = invalidation.user_cache.get_or_set(
+            user_id, lambda: self._load_user(user_id)
+        )
+        if user is None:
+            return None
+        user = copy.deepcopy(user)
+        return user if self.user_can_authenticate(user) else None
+
+    @staticmethod
+    def _load_user(user_id):
+        UserModel = get_user_model()
+        try:
+            return UserModel._default_manager.select_related(
+                *get_payload_serializer().select_related
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
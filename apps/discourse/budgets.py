@@ -0,0 +1,133 @@
+# apps/discourse/budgets.py
+
+import contextlib
+import contextvars
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# name -> (max queries, max milliseconds), filled by within_budget().
+BUDGETS = {}
+
+_enforcing = contextvars.ContextVar("discourse_budgets_enforced", default=False)
+
+
+class BudgetExceeded(AssertionError):
+    """A block ran more queries than its declared budget."""
+
+
+class BudgetUsage:
+    """Queries and wall time recorded for one run of a budgeted block."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = []
+        self.ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook: works with DEBUG off, too.
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def violations(self, queries=None, ms=None):
+        """``(query count problems, wall time problems)`` as messages."""
+        query_problems, time_problems = [], []
+        if queries is not None and len(self.queries) > queries:
+            query_problems.append(f"{len(self.queries)} queries (budget {queries})")
+        if ms is not None and self.ms > ms:
+            time_problems.append(f"{self.ms:.1f} ms (budget {ms} ms)")
+        return query_problems, time_problems
+
+
+@contextlib.contextmanager
+def enforce_budgets():
+    """Make query budget violations in this context raise BudgetExceeded."""
+    token = _enforcing.set(True)
+    try:
+        yield
+    finally:
+        _enforcing.reset(token)
+
+
+def budgets_enforced():
+    return _enforcing.get() or settings.DISCOURSE_BUDGET_ENFORCE
+
+
+@contextlib.contextmanager
+def budget(name, queries=None, ms=None):
+    """
+    Record the queries and wall time of the enclosed block. Going over the
+    query count raises BudgetExceeded while budgets are enforced (tests);
+    wall time depends on the machine, so going over ``ms`` only ever logs a
+    warning, as every violation does outside of enforcement. Outside of
+    enforcement only a DISCOURSE_BUDGET_SAMPLE_RATE share of the runs is
+    measured; the rest yield None and cost nothing.
+    """
+    enforced = budgets_enforced()
+    if not enforced and random.random() >= settings.DISCOURSE_BUDGET_SAMPLE_RATE:
+        yield None
+        return
+
+    usage = BudgetUsage(name)
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(usage))
+        started = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            usage.ms = (time.perf_counter() - started) * 1000
+
+    query_problems, time_problems = usage.violations(queries, ms)
+    if enforced and query_problems:
+        message = f"{name} exceeded its budget: {', '.join(query_problems)}"
+        raise BudgetExceeded(message + "\n" + "\n".join(usage.queries))
+    problems = query_problems + time_problems
+    if problems:
+        logger.warning(
+            "%s exceeded its budget: %s",
+            name,
+            ", ".join(problems),
+            extra={"sample": False},
+        )
+
+
+def within_budget(name, queries=None, ms=None):
+    """
+    Declare the budget of a view (or any function)::
+
+        @method_decorator(within_budget("sso.provider", queries=0, ms=50), name="get")
+    """
+    BUDGETS[name] = (queries, ms)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with budget(name, queries=queries, ms=ms):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class BudgetAssertionsMixin:
+    """TestCase helpers: enforce the declared view budgets or ad-hoc ones."""
+
+    def enforce_budgets(self):
+        return enforce_budgets()
+
+    @contextlib.contextmanager
+    def assertWithinBudget(self, queries=None, ms=None, name="block"):
+        with enforce_budgets():
+            try:
+                with budget(name, queries=queries, ms=ms) as usage:
+                    yield usage
+            except BudgetExceeded as e:
+                self.fail(str(e))
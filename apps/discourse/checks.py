@@ -0,0 +1,23 @@
+# apps/discourse/checks.py
+from django.conf import settings
+from django.core.checks import Error, register
+
+from .governor import PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_governor_cache(app_configs, **kwargs):
+    """The API governor's budget is only global in a cache all workers share."""
+    alias = settings.DISCOURSE_API_GOVERNOR_CACHE
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend in PROCESS_LOCAL_CACHES:
+        return [
+            Error(
+                f"DISCOURSE_API_GOVERNOR_CACHE ({alias!r}) uses {backend}, which "
+                "every worker process keeps to itself, so the Discourse API "
+                "budget would be multiplied by the number of workers.",
+                hint="Use a cache shared by all workers (e.g. MmapCache or Redis).",
+                id="discourse.E001",
+            )
+        ]
+    return []
@@ -0,0 +1,166 @@
+# apps/discourse/eventlog.py
+
+import base64
+import binascii
+import urllib.parse
+import zlib
+
+from django.conf import settings
+
+# Format byte in front of every blob, so the dictionary can change later.
+BLOB_VERSION = b"\x01"
+TRUNCATED = " [truncated]"
+# How the blob text is turned back into the stored details.
+_AS_TEXT, _AS_BASE64 = 0, 1
+# Stand in for the column values inside the blob text.
+_MARK = "\x00"
+_NONCE, _EXTERNAL_ID, _HOST = _MARK + "n", _MARK + "e", _MARK + "h"
+
+# Preset dictionary: the strings that recur in every SSO payload. Short
+# payloads barely compress on their own; with the dictionary they halve.
+_ZDICT = (
+    b"Invalid signature Invalid payload encoding Missing SSO parameters "
+    b"Invalid return_sso_url https%3A%2F%2F%2Fsession%2Fsso_login"
+    b"&admin=false&moderator=false&suppress_welcome_message=true"
+    b"&avatar_url=&name=&username=&email=&add_groups=&remove_groups="
+    b"&return_sso_url=https%3A%2F%2F%2F&sig=&sso=nonce=&external_id="
+)
+
+
+def _compress(data):
+    compressor = zlib.compressobj(
+        9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _ZDICT
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data):
+    decompressor = zlib.decompressobj(-15, zdict=_ZDICT)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _base64(text, line_length, trailing_newline):
+    """Base64 of ``text`` split into lines the way Discourse's Ruby does it."""
+    encoded = base64.b64encode(text.encode("utf-8")).decode("ascii")
+    if line_length:
+        encoded = "\n".join(
+            encoded[i : i + line_length] for i in range(0, len(encoded), line_length)
+        )
+    return encoded + "\n" if trailing_newline else encoded
+
+
+def _decoded(details):
+    """
+    ``(query, line_length, trailing_newline)`` if ``details`` is a Base64
+    payload that _base64() gives back byte for byte, else None.
+    """
+    lines = details.split("\n")
+    trailing_newline = len(lines) > 1 and lines[-1] == ""
+    if trailing_newline:
+        lines.pop()
+    line_length = len(lines[0]) if len(lines) > 1 else 0
+    if not 0 <= line_length <= 255:
+        return None
+    try:
+        query = binascii.a2b_base64("".join(lines)).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if "nonce=" not in query:
+        return None
+    if _base64(query, line_length, trailing_newline) != details:
+        return None
+    return query, line_length, trailing_newline
+
+
+def _mark(query):
+    """
+    Column values of a query string, and the string with the values that
+    are stored literally replaced by markers. Other bytes are left alone,
+    so the exact text comes back.
+    """
+    nonce = external_id = return_host = ""
+    segments = query.split("&")
+    for i, segment in enumerate(segments):
+        key, sep, raw = segment.partition("=")
+        if not sep:
+            continue
+        value = urllib.parse.unquote_plus(raw)
+        if key == "nonce" and not nonce:
+            nonce = value
+            if raw == value:
+                segments[i] = f"{key}={_NONCE}"
+        elif key == "external_id" and not external_id:
+            external_id = value
+            if raw == value:
+                segments[i] = f"{key}={_EXTERNAL_ID}"
+        elif key == "return_sso_url" and not return_host:
+            return_host = urllib.parse.urlsplit(value).netloc
+            if return_host and return_host in raw:
+                segments[i] = f"{key}={raw.replace(return_host, _HOST, 1)}"
+    return nonce, external_id, return_host, "&".join(segments)
+
+
+def _unmark(text, nonce, external_id, return_host):
+    return (
+        text.replace(_NONCE, nonce)
+        .replace(_EXTERNAL_ID, external_id)
+        .replace(_HOST, return_host)
+    )
+
+
+def pack_details(details):
+    """
+    Split payload details into ``(nonce, external_id, return_host, blob)``.
+
+    SSO payloads (query string, or Base64 that re-encodes identically) have
+    their nonce, external_id and return_sso_url host copied to the columns.
+    The blob holds the text with those values replaced by markers, plus how
+    to re-encode it, raw-deflated: unpack_details() gives back exactly the
+    signed text. Text over DISCOURSE_SSO_EVENT_DETAILS_MAX_BYTES is
+    truncated and then only kept for reading.
+    """
+    if not details:
+        return "", "", "", None
+    header = bytes([_AS_TEXT, 0, 0])
+    nonce = external_id = return_host = ""
+    decoded = _decoded(details)
+    if decoded is not None:
+        query, line_length, trailing_newline = decoded
+        header = bytes([_AS_BASE64, line_length, trailing_newline])
+    else:
+        query = details if "nonce=" in details else None
+    text = details
+    if query is not None and _MARK not in query:
+        nonce, external_id, return_host, text = _mark(query)
+        if len(nonce) > 64 or len(external_id) > 255 or len(return_host) > 255:
+            # Would not fit the columns: keep the values in the text.
+            nonce = external_id = return_host = ""
+            text = query
+
+    data = text.encode("utf-8")
+    limit = settings.DISCOURSE_SSO_EVENT_DETAILS_MAX_BYTES
+    if len(data) > limit:
+        # No longer verifiable; store readable text (Base64 decoded).
+        header = bytes([_AS_TEXT, 0, 0])
+        data = _unmark(text, nonce, external_id, return_host).encode("utf-8")
+        data = (
+            data[:limit].decode("utf-8", "ignore").encode("utf-8") + TRUNCATED.encode()
+        )
+        nonce = external_id = return_host = ""
+    return nonce, external_id, return_host, BLOB_VERSION + header + _compress(data)
+
+
+def unpack_details(nonce, external_id, return_host, blob):
+    """Give back the details stored by pack_details()."""
+    if not blob:
+        return ""
+    blob = bytes(blob)
+    if blob[:1] != BLOB_VERSION:
+        raise ValueError("Unknown SsoEventLog blob format")
+    mode, line_length, trailing_newline = blob[1:4]
+    text = _unmark(
+        _decompress(blob[4:]).decode("utf-8"), nonce, external_id, return_host
+    )
+    if mode == _AS_BASE64:
+        return _base64(text, line_length, bool(trailing_newline))
+    return text
@@ -0,0 +1,143 @@
+# apps/discourse/export.py
+
+import csv
+import json
+import zlib
+
+from django import forms
+
+from .eventlog import unpack_details
+from .models import SsoEventLog
+
+EXPORT_FIELDS = (
+    "id",
+    "created_at",
+    "event_type",
+    "user_id",
+    "user__username",
+    "payload_details",
+    "nonce",
+    "external_id",
+    "return_host",
+    "signature",
+)
+# payload_details is rebuilt from these when the row is stored compactly.
+_DETAILS = EXPORT_FIELDS.index("payload_details")
+_COMPACT = [EXPORT_FIELDS.index(f) for f in ("nonce", "external_id", "return_host")]
+EXPORT_FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Rows fetched per round trip from the server-side cursor.
+CURSOR_CHUNK_SIZE = 2000
+# Approximate size of each chunk handed to the response / output file.
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+class SsoEventExportForm(forms.Form):
+    """Filters shared by the export view and the export_sso_events command."""
+
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+    event_type = forms.ChoiceField(
+        required=False,
+        choices=[("", "All")] + SsoEventLog.EVENT_TYPE_CHOICES,
+    )
+    user = forms.CharField(required=False, help_text="Username or user id")
+    format = forms.ChoiceField(required=False, choices=[(f, f) for f in EXPORT_FORMATS])
+    gzip = forms.BooleanField(required=False)
+
+    def clean_format(self):
+        return self.cleaned_data.get("format") or "ndjson"
+
+
+def export_rows(start=None, end=None, event_type=None, user=None):
+    """
+    Return an iterator of row tuples (see EXPORT_FIELDS) for the given filters.
+    Rows are streamed through a server-side cursor in id order, so memory use
+    does not depend on the size of the result set.
+    """
+    queryset = SsoEventLog.objects.all()
+    if start:
+        queryset = queryset.filter(created_at__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__lt=end)
+    if event_type:
+        queryset = queryset.filter(event_type=event_type)
+    if user:
+        if str(user).isdigit():
+            queryset = queryset.filter(user_id=int(user))
+        else:
+            queryset = queryset.filter(user__username=user)
+    rows = (
+        queryset.order_by("id")
+        .values_list(*EXPORT_FIELDS, "payload_blob")
+        .iterator(chunk_size=CURSOR_CHUNK_SIZE)
+    )
+    return (_with_details(row) for row in rows)
+
+
+def _with_details(row):
+    *row, blob = row
+    if blob is not None and not row[_DETAILS]:
+        row[_DETAILS] = unpack_details(*(row[i] for i in _COMPACT), blob)
+    return tuple(row)
+
+
+def _buffered(lines):
+    """Group small encoded lines into chunks of roughly WRITE_BUFFER_SIZE bytes."""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= WRITE_BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_ndjson(rows):
+    keys = [field.replace("user__", "") for field in EXPORT_FIELDS]
+    for row in rows:
+        record = dict(zip(keys, row))
+        yield (json.dumps(record, default=str) + "\n").encode()
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(
+        [field.replace("user__", "") for field in EXPORT_FIELDS]
+    ).encode()
+    for row in rows:
+        yield writer.writerow(row).encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of byte chunks into a gzip stream.
+    Every chunk is sync-flushed so the client receives data as it is produced.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def render_export(rows, fmt="ndjson", compress=False):
+    """Serialize exported rows into an iterator of byte chunks."""
+    lines = iter_csv(rows) if fmt == "csv" else iter_ndjson(rows)
+    chunks = _buffered(lines)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(fmt, compress):
+    return f"sso_events.{fmt}" + (".gz" if compress else "")
@@ -0,0 +1,263 @@
+# apps/discourse/governor.py
+
+import email.utils
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Length in seconds of the shared request-budget window.
+BUDGET_WINDOW = 10
+
+
+class DiscourseRateLimited(Exception):
+    """Raised when an interactive call cannot be sent within its wait budget."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Discourse API rate limited; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default=5.0):
+    """Return the Retry-After header (seconds or HTTP date) as seconds."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return default
+
+
+class RateGovernor:
+    """
+    Shared throttle for outbound Discourse API calls.
+
+    Within a process, concurrency is limited by an AIMD window: every call
+    that completes quickly grows the window by 1/window, a 429 or a call slower
+    than ``latency_target`` halves it. Interactive callers always go first and
+    background callers may only use the window minus ``interactive_reserve``.
+
+    Across processes, the Django cache carries the cooldown set by the last
+    ``Retry-After`` and a requests-per-second budget (counted over
+    BUDGET_WINDOW seconds) that halves on 429s and recovers on success.
+    DISCOURSE_API_GOVERNOR_CACHE must be a cache shared by all workers; a
+    process-local one fails the discourse.E001 system check (checks.py).
+    """
+
+    def __init__(
+        self,
+        cache_alias="default",
+        requests_per_second=1.0,
+        min_window=1,
+        max_window=8,
+        latency_target=2.0,
+        interactive_reserve=1,
+        interactive_max_wait=5.0,
+        key_prefix="discourse:governor",
+    ):
+        self.cache_alias = cache_alias
+        self.max_rate = float(requests_per_second)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.latency_target = latency_target
+        self.interactive_reserve = interactive_reserve
+        self.interactive_max_wait = interactive_max_wait
+        self.key_prefix = key_prefix
+
+        self.window = float(max(min_window, max_window // 2))
+        self._in_flight = 0
+        self._interactive_waiting = 0
+        self._condition = threading.Condition()
+
+    # -- shared (cross-process) state ------------------------------------
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, name):
+        return f"{self.key_prefix}:{name}"
+
+    def cooldown_remaining(self):
+        until = self.cache.get(self._key("retry_until"), 0)
+        return max(0.0, until - time.time())
+
+    def shared_rate(self):
+        return self.cache.get(self._key("rate"), self.max_rate)
+
+    def _take_token(self, priority):
+        """
+        Count this call against the shared budget of the current window.
+        Background calls only get 80% of it, so interactive calls always find
+        room. Returns ``(seconds to wait before trying again, None)``, or
+        ``(0, key of the token taken)`` when the call is admitted.
+        """
+        now = time.time()
+        window = int(now // BUDGET_WINDOW)
+        key = self._key(f"window:{window}")
+        self.cache.add(key, 0, timeout=BUDGET_WINDOW * 2)
+        # incr() must be atomic across processes: it is on Redis, memcached
+        # and MmapCache (under the set's file lock), not on the database
+        # cache or FileBasedCache.
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # The key expired between add() and incr(); start a new window.
+            self.cache.set(key, 1, timeout=BUDGET_WINDOW * 2)
+            count = 1
+        budget = self.shared_rate() * BUDGET_WINDOW
+        if priority == BACKGROUND:
+            budget *= 0.8
+        if count <= max(1, int(budget)):
+            return 0.0, key
+        self._return_token(key)
+        return (window + 1) * BUDGET_WINDOW - now, None
+
+    def _return_token(self, key):
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            # The window expired meanwhile; nothing left to give back.
+            pass
+
+    def _on_rate_limited(self, retry_after):
+        until = time.time() + retry_after
+        if until > self.cache.get(self._key("retry_until"), 0):
+            self.cache.set(
+                self._key("retry_until"), until, timeout=int(retry_after) + 1
+            )
+        rate = max(self.max_rate / 16, self.shared_rate() / 2)
+        self.cache.set(self._key("rate"), rate, timeout=None)
+
+    def _on_success(self):
+        rate = self.shared_rate()
+        if rate < self.max_rate:
+            step = self.max_rate / 16
+            self.cache.set(
+                self._key("rate"), min(self.max_rate, rate + step), timeout=None
+            )
+
+    # -- local concurrency window ----------------------------------------
+
+    def _allowed(self, priority):
+        window = int(self.window)
+        if priority == BACKGROUND:
+            if self._interactive_waiting:
+                return 0
+            return max(1, window - self.interactive_reserve)
+        return window
+
+    def _acquire_slot(self, priority, deadline):
+        with self._condition:
+            if priority == INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                while self._in_flight >= self._allowed(priority):
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        raise DiscourseRateLimited(0.0)
+                    self._condition.wait(remaining)
+                self._in_flight += 1
+            finally:
+                if priority == INTERACTIVE:
+                    self._interactive_waiting -= 1
+
+    def _release_slot(self, status, latency):
+        with self._condition:
+            self._in_flight -= 1
+            if status == 429 or latency > self.latency_target:
+                self.window = max(self.min_window, self.window / 2)
+            elif status is not None and status < 500:
+                self.window = min(self.max_window, self.window + 1 / self.window)
+            self._condition.notify_all()
+
+    # -- public API -------------------------------------------------------
+
+    def call(self, func, *args, priority=INTERACTIVE, max_retries=None, **kwargs):
+        """
+        Send one request through the governor: ``func(*args, **kwargs)``
+        must return a ``requests.Response``. Background calls are retried
+        after ``Retry-After`` on 429; interactive calls fail fast with
+        DiscourseRateLimited when they would wait longer than
+        ``interactive_max_wait``.
+        """
+        if max_retries is None:
+            max_retries = 0 if priority == INTERACTIVE else 3
+        attempt = 0
+        while True:
+            token = self._wait_for_budget(priority)
+            deadline = (
+                time.monotonic() + self.interactive_max_wait
+                if priority == INTERACTIVE
+                else None
+            )
+            try:
+                self._acquire_slot(priority, deadline)
+            except DiscourseRateLimited:
+                # Never sent: give the budget back to other callers.
+                self._return_token(token)
+                raise
+            status, started = None, time.monotonic()
+            try:
+                response = func(*args, **kwargs)
+                status = response.status_code
+            finally:
+                self._release_slot(status, time.monotonic() - started)
+
+            if status != 429:
+                self._on_success()
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            self._on_rate_limited(retry_after)
+            logger.warning(
+                "Discourse API rate limited (%s); retry after %.1fs",
+                priority,
+                retry_after,
+            )
+            if attempt >= max_retries:
+                return response
+            attempt += 1
+
+    def _wait_for_budget(self, priority):
+        """Wait for a token of the shared budget; returns its key."""
+        waited = 0.0
+        while True:
+            delay = self.cooldown_remaining()
+            if not delay:
+                delay, token = self._take_token(priority)
+                if not delay:
+                    return token
+            if priority == INTERACTIVE and waited + delay > self.interactive_max_wait:
+                raise DiscourseRateLimited(delay)
+            time.sleep(delay)
+            waited += delay
+
+
+# Backends whose data lives in one process: useless for the shared budget.
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+governor = RateGovernor(
+    cache_alias=settings.DISCOURSE_API_GOVERNOR_CACHE,
+    requests_per_second=settings.DISCOURSE_API_REQUESTS_PER_SECOND,
+    max_window=settings.DISCOURSE_API_MAX_CONCURRENCY,
+)
@@ -0,0 +1,100 @@
+# apps/discourse/groups.py
+
+import logging
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from . import invalidation
+from .models import DiscourseProfile
+
+logger = logging.getLogger(__name__)
+
+
+def group_names_by_user(user_ids):
+    """
+    Return ``{user_id: sorted group names}`` using a single query. Names
+    containing a comma are left out: add_groups and remove_groups are
+    comma-separated, so Discourse would see them as several groups.
+    """
+    User = get_user_model()
+    names = {user_id: [] for user_id in user_ids}
+    rejected = set()
+    memberships = User.groups.through.objects.filter(user_id__in=user_ids).values_list(
+        "user_id", "group__name"
+    )
+    for user_id, name in memberships:
+        if "," in name:
+            rejected.add(name)
+            continue
+        names[user_id].append(name)
+    if rejected:
+        logger.warning(
+            "Not syncing groups with a comma in their name: %s", sorted(rejected)
+        )
+    return {user_id: sorted(group_names) for user_id, group_names in names.items()}
+
+
+def refresh_group_names(user_ids):
+    """
+    Recompute the denormalized group lists on DiscourseProfile for the given
+    users. Groups that disappeared from a user's list are kept in
+    removed_group_names, and so sent as remove_groups, until the user rejoins
+    them or a sync has told Discourse (prune_removed_group_names()).
+    Returns the ids of the users whose lists changed.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    current = group_names_by_user(user_ids)
+    changed = []
+    for profile in DiscourseProfile.objects.filter(user_id__in=user_ids).only(
+        "id", "user_id", "group_names", "removed_group_names"
+    ):
+        names = current[profile.user_id]
+        if names == profile.group_names:
+            continue
+        removed = set(profile.removed_group_names) | set(profile.group_names)
+        profile.removed_group_names = sorted(removed - set(names))
+        profile.group_names = names
+        changed.append(profile)
+    DiscourseProfile.objects.bulk_update(
+        changed, ["group_names", "removed_group_names"]
+    )
+    # bulk_update sends no post_save; drop the cached users ourselves.
+    invalidation.publish_many(
+        invalidation.USER_CACHE, [profile.user_id for profile in changed]
+    )
+    logger.debug("Refreshed Discourse group lists for %d users", len(changed))
+    return [profile.user_id for profile in changed]
+
+
+def prune_removed_group_names(synced):
+    """
+    Forget the removals Discourse has been told about. ``synced`` maps user
+    ids to the group names a successful sync sent as remove_groups; other
+    groups removed since then stay. Returns the number of profiles changed.
+    """
+    synced = {user_id: set(names) for user_id, names in synced.items() if names}
+    if not synced:
+        return 0
+    with transaction.atomic():
+        changed = []
+        for profile in (
+            DiscourseProfile.objects.select_for_update()
+            .filter(user_id__in=list(synced))
+            .only("id", "user_id", "removed_group_names")
+        ):
+            remaining = [
+                name
+                for name in profile.removed_group_names
+                if name not in synced[profile.user_id]
+            ]
+            if remaining != profile.removed_group_names:
+                profile.removed_group_names = remaining
+                changed.append(profile)
+        DiscourseProfile.objects.bulk_update(changed, ["removed_group_names"])
+        invalidation.publish_many(
+            invalidation.USER_CACHE, [profile.user_id for profile in changed]
+        )
+    return len(changed)
@@ -0,0 +1,121 @@
+# apps/discourse/handshake.py
+
+import binascii
+import hmac
+import logging
+import time
+import urllib.parse
+from typing import NamedTuple
+
+from django.conf import settings
+
+from . import tracing
+from .exceptions import SSOValidationError
+from .sso import sign_payload, validate_return_url
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = b" \t\r\n"
+
+# Session key holding a verified handshake while the user logs in.
+PENDING_HANDSHAKE_KEY = "discourse_pending_sso"
+
+
+class SSORequest(NamedTuple):
+    """A verified, decoded and validated DiscourseConnect request."""
+
+    nonce: str
+    return_sso_url: str
+    params: dict
+
+    def get(self, key, default=None):
+        return self.params.get(key, default)
+
+
+def _parse_query(query):
+    """
+    Parse a form-encoded query string into a dict (last value wins).
+    Equivalent to dict(parse_qsl(query, keep_blank_values=True)) but only
+    unquotes the fields that need it, which is the bulk of the handshake cost.
+    """
+    params = {}
+    for item in query.split("&"):
+        if not item:
+            continue
+        # Split on the first "=" only, so values may contain "=".
+        key, _, value = item.partition("=")
+        if "%" in key or "+" in key:
+            key = urllib.parse.unquote_plus(key)
+        if "%" in value or "+" in value:
+            value = urllib.parse.unquote_plus(value)
+        params[key] = value
+    return params
+
+
+@tracing.traced("sso.parse_request")
+def parse_sso_request(sso, sig, required=("nonce", "return_sso_url")):
+    """
+    Run the whole inbound handshake in one pass over the payload bytes:
+    constant-time signature check over the payload exactly as received, then
+    padding fix, Base64 decode, query-string parse and return URL validation.
+
+    Returns an SSORequest; raises SSOValidationError on any failure.
+    """
+    if not sso or not sig:
+        raise SSOValidationError("Missing SSO parameters")
+    try:
+        raw = sso.encode("ascii")
+        # Discourse signs the Base64 text it sent, newlines and padding
+        # included, so the MAC is computed before anything is normalised.
+        valid = hmac.compare_digest(sign_payload(raw), sig)
+    except (UnicodeEncodeError, TypeError) as e:
+        raise SSOValidationError("Invalid payload encoding") from e
+    if not valid:
+        logger.error("SSO signature mismatch")
+        raise SSOValidationError("Invalid signature")
+
+    raw = raw.translate(None, _WHITESPACE)
+    raw += b"=" * (-len(raw) % 4)
+    try:
+        decoded = binascii.a2b_base64(raw).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise SSOValidationError("Invalid payload encoding") from e
+
+    params = _parse_query(decoded)
+    for name in required:
+        if not params.get(name):
+            raise SSOValidationError(f"Missing {name} parameter in payload")
+
+    return_sso_url = params.get("return_sso_url", "")
+    if return_sso_url:
+        validate_return_url(return_sso_url)
+    return SSORequest(
+        nonce=params.get("nonce", ""), return_sso_url=return_sso_url, params=params
+    )
+
+
+def stash_handshake(session, handshake):
+    """
+    Keep a verified handshake in the (server-side) session while the user logs
+    in, so the login view can answer Discourse directly afterwards.
+    """
+    session[PENDING_HANDSHAKE_KEY] = {
+        "nonce": handshake.nonce,
+        "return_sso_url": handshake.return_sso_url,
+        "expires": time.time() + settings.DISCOURSE_SSO_HANDSHAKE_TTL,
+    }
+
+
+def pop_handshake(session):
+    """Return and forget the pending SSORequest, or None if absent or expired."""
+    pending = session.pop(PENDING_HANDSHAKE_KEY, None)
+    if not pending or pending.get("expires", 0) < time.time():
+        return None
+    return SSORequest(
+        nonce=pending["nonce"],
+        return_sso_url=pending["return_sso_url"],
+        params={
+            "nonce": pending["nonce"],
+            "return_sso_url": pending["return_sso_url"],
+        },
+    )
@@ -0,0 +1,221 @@
+# apps/discourse/hashing.py
+"""
+Password verification in a bounded process pool.
+
+PBKDF2 is deliberately slow. By default checks run inline, but at most
+``max_pending`` at a time per process; beyond that a login is shed at once
+instead of queueing, so a login spike cannot take every thread of a
+threaded gunicorn worker away from the cheap SSO redirects.
+
+With ``workers`` > 0, PasswordHashPool runs check_password() in that many
+processes instead. Each gunicorn worker gets its own pool, so size it per
+host: gunicorn workers * DISCOURSE_PASSWORD_HASH_WORKERS should not exceed
+the cores. The request thread still waits for the result, so a pool only
+frees CPU for the other threads of gthread workers, not for sync workers;
+that is why the pool is opt-in. Its processes come from a forkserver: the
+gunicorn worker runs several background threads, and a process forked from
+it could inherit a lock one of them holds (logging, the database driver)
+and deadlock.
+
+DiscourseModelBackend turns PasswordHashPoolSaturated into a failed login
+(see backends.py), so no caller of authenticate() sees it.
+"""
+
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHashPoolSaturated(Exception):
+    """Raised when a password check cannot be queued or did not finish in time."""
+
+    def __init__(self, retry_after=1):
+        super().__init__(f"Password hashing is saturated; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _init_worker(settings_module):
+    # Processes from the forkserver start without Django; set it up here.
+    from django.apps import apps
+
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+        import django
+
+        django.setup()
+
+
+def _verify(password, encoded, submitted):
+    """
+    Worker side: ``(correct, must_update, wait seconds, hash seconds)``.
+    With no usable ``encoded`` hash the password is hashed anyway, so unknown
+    users cost as much as known ones (see ModelBackend.authenticate).
+    """
+    from django.contrib.auth.hashers import (
+        check_password,
+        is_password_usable,
+        make_password,
+    )
+
+    started = time.monotonic()
+    upgrade = []
+    if encoded is None or not is_password_usable(encoded):
+        make_password(password)
+        correct = False
+    else:
+        correct = check_password(password, encoded, setter=upgrade.append)
+    return correct, bool(upgrade), started - submitted, time.monotonic() - started
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class PasswordHashPool:
+    """
+    Runs password checks in ``workers`` processes (0 runs them inline) with
+    at most ``max_pending`` in flight. stats() reports the pool wait and
+    hash time of the checks and how many were rejected.
+    """
+
+    def __init__(self, workers=0, max_pending=None, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending or max(1, workers) * 4
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._futures = set()
+        self._pending = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._wait = _Timing()
+        self._hash = _Timing()
+
+    def _get_executor(self):
+        # Workers forked by gunicorn must not share the parent's pool.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", ""),),
+                )
+            return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise PasswordHashPoolSaturated()
+            self._pending += 1
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+            self._futures.discard(future)
+
+    def check(self, password, encoded):
+        """
+        ``(correct, must_update)`` for ``password`` against ``encoded`` (None
+        for unknown users). Raises PasswordHashPoolSaturated when the pool is
+        full or the check takes longer than ``timeout`` seconds.
+        """
+        self._acquire()
+        if not self.workers:
+            try:
+                result = _verify(password, encoded, time.monotonic())
+            finally:
+                self._release()
+        else:
+            try:
+                future = self._get_executor().submit(
+                    _verify, password, encoded, time.monotonic()
+                )
+            except Exception:
+                self._release()
+                raise
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._release)
+            try:
+                result = future.result(timeout=self.timeout)
+            except concurrent.futures.TimeoutError as e:
+                future.cancel()
+                with self._lock:
+                    self._timeouts += 1
+                raise PasswordHashPoolSaturated() from e
+            except concurrent.futures.process.BrokenProcessPool as e:
+                logger.error("Password hashing pool broke; starting a new one.")
+                with self._lock:
+                    self._executor = None
+                raise PasswordHashPoolSaturated() from e
+
+        correct, must_update, wait, hashing = result
+        with self._lock:
+            self._wait.add(max(0.0, wait))
+            self._hash.add(hashing)
+        current = tracing.current_span()
+        if current is not None:
+            current.set("hash.pool_wait_ms", round(max(0.0, wait) * 1000, 3))
+            current.set("hash.ms", round(hashing * 1000, 3))
+        return correct, must_update
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "pool_wait": self._wait.as_dict(),
+                "hash_time": self._hash.as_dict(),
+            }
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures = list(self._futures)
+        if executor is not None and self._pid == os.getpid():
+            # Executor.shutdown(cancel_futures=True) needs Python 3.9.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=wait)
+
+
+pool = PasswordHashPool(
+    workers=settings.DISCOURSE_PASSWORD_HASH_WORKERS,
+    max_pending=settings.DISCOURSE_PASSWORD_HASH_MAX_PENDING,
+    timeout=settings.DISCOURSE_PASSWORD_HASH_TIMEOUT,
+)
+atexit.register(pool.shutdown, wait=True)
@@ -0,0 +1,127 @@
+# apps/discourse/imports.py
+
+import csv
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (
+    identify_hasher,
+    is_password_usable,
+    make_password,
+)
+from django.db import transaction
+
+from .profiles import provision_profiles
+from .syncqueue import user_sync
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FIELDS = ("username", "email", "first_name", "last_name", "password")
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _is_encoded_password(value):
+    """Whether ``value`` is a password hash one of PASSWORD_HASHERS can read."""
+    if not is_password_usable(value):
+        # "!..." marks an unusable password; it matches nothing.
+        return True
+    try:
+        identify_hasher(value).decode(value)
+    except (ValueError, TypeError, IndexError):
+        return False
+    return True
+
+
+def _build_user(User, row):
+    # ``password`` must already be a Django-encoded hash (e.g. exported from
+    # the previous IdP); hashing a million raw passwords would dominate the
+    # import, so import_chunk() rejects anything else. Rows without one get
+    # an unusable password.
+    return User(
+        username=row["username"],
+        email=row.get("email") or "",
+        first_name=row.get("first_name") or "",
+        last_name=row.get("last_name") or "",
+        password=row.get("password") or make_password(None),
+    )
+
+
+def import_chunk(rows, sync=True):
+    """
+    Insert one chunk of users and their DiscourseProfile rows in a single
+    transaction, queueing the users for a Discourse sync unless ``sync`` is
+    false. Usernames that already exist are skipped.
+    Returns the ids of the users created.
+    """
+    User = get_user_model()
+    usernames = [row["username"] for row in rows]
+    existing = set(
+        User.objects.filter(username__in=usernames).values_list("username", flat=True)
+    )
+    seen = set()
+    users = []
+    for row in rows:
+        if row["username"] in existing or row["username"] in seen:
+            continue
+        if row.get("password") and not _is_encoded_password(row["password"]):
+            # Never store what may be a plaintext password.
+            logger.warning(
+                "Skipping %s: password is not an encoded hash", row["username"]
+            )
+            continue
+        seen.add(row["username"])
+        users.append(_build_user(User, row))
+    if not users:
+        return []
+
+    # bulk_create() sends no post_save, so no per-user sync runs here.
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        if any(user.pk is None for user in users):
+            # Backends that cannot return ids from a bulk insert.
+            ids = dict(
+                User.objects.filter(username__in=seen).values_list("username", "id")
+            )
+            for user in users:
+                user.pk = ids[user.username]
+        provision_profiles(users)
+        if sync:
+            user_sync.schedule([user.pk for user in users])
+    return [user.pk for user in users]
+
+
+def import_users(rows, chunk_size=5000, sync=True):
+    """
+    Bulk-create users from an iterable of dicts with IMPORT_FIELDS keys.
+
+    Rows are inserted ``chunk_size`` at a time with bulk_create, without the
+    per-user post_save sync. Rows whose username exists, or whose password
+    is not an encoded hash, are skipped. The new users of each chunk are
+    queued for a Discourse sync (syncqueue.py) in the same transaction; the
+    web workers push them at the background budget of the API governor, so
+    a large import reaches the forum gradually. Returns
+    ``(created, skipped)``.
+    """
+    created = skipped = 0
+    for chunk in _chunks(rows, chunk_size):
+        ids = import_chunk(chunk, sync=sync)
+        created += len(ids)
+        skipped += len(chunk) - len(ids)
+        logger.info("Imported %d users (%d skipped)", created, skipped)
+    return created, skipped
+
+
+def read_import_csv(file):
+    """Yield import rows from a CSV file with a header line."""
+    for row in csv.DictReader(file):
+        yield {field: (row.get(field) or "").strip() for field in IMPORT_FIELDS}
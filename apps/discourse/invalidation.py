@@ -0,0 +1,249 @@
+# apps/discourse/invalidation.py
+"""
+Cross-worker invalidation of in-process caches over PostgreSQL LISTEN/NOTIFY.
+
+A LocalCache is a plain dict in one process: as fast as it gets, but every
+gunicorn worker has its own copy. publish() drops a key from the named cache
+here and sends ``pg_notify`` on DISCOURSE_INVALIDATION_CHANNEL. NOTIFY is
+transactional, so other workers hear about a change only once it has been
+committed; their listener thread then drops the key as well. If the listener
+loses its connection it clears every cache, as notifications may have been
+missed. On other databases (sqlite in development) only the local copy is
+invalidated, which is enough for a single process.
+"""
+
+import collections
+import json
+import logging
+import secrets
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .workers import BackgroundThread
+
+logger = logging.getLogger(__name__)
+
+# Caches keyed by user pk; saving or deleting a User or DiscourseProfile
+# invalidates its entry (see signals.py). DiscourseModelBackend.get_user()
+# serves request.user from it.
+USER_CACHE = "users"
+
+# name -> LocalCache of this process.
+_registry = {}
+_registry_lock = threading.Lock()
+# Tells our own notifications apart from other processes' (pids repeat across hosts).
+_ORIGIN = secrets.token_hex(8)
+_MISSING = object()
+
+
+class LocalCache:
+    """
+    A bounded LRU dict shared by the threads of one process, invalidated by
+    key from any process through publish(). Create it with local_cache().
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so get_or_set() can tell whether one
+        # arrived while it was computing.
+        self._generation = 0
+
+    def get(self, key, default=None):
+        listener.ensure_started()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        # Caller holds the lock.
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        """
+        The cached value of ``key``, or compute() stored, unless an
+        invalidation arrived meanwhile: compute() may then have read what the
+        invalidated change replaced, so the value is returned uncached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = compute()
+        with self._lock:
+            if generation == self._generation:
+                self._put(key, value)
+        return value
+
+    def invalidate(self, key):
+        """Drop ``key`` in this process only; see publish() for all of them."""
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def local_cache(name, maxsize=1024, ttl=None):
+    """Return the LocalCache registered as ``name``, creating it on first use."""
+    with _registry_lock:
+        cache = _registry.get(name)
+        if cache is None:
+            cache = _registry[name] = LocalCache(name, maxsize=maxsize, ttl=ttl)
+        return cache
+
+
+# What DiscourseModelBackend.get_user() caches. Entries also expire after
+# DISCOURSE_USER_CACHE_TTL seconds, in case a notification was missed or
+# rows were changed with queryset.update().
+user_cache = local_cache(
+    USER_CACHE,
+    maxsize=settings.DISCOURSE_USER_CACHE_SIZE,
+    ttl=settings.DISCOURSE_USER_CACHE_TTL,
+)
+
+
+def _message(name, key):
+    return json.dumps({"c": name, "k": key, "o": _ORIGIN}, separators=(",", ":"))
+
+
+def publish(name, key=None):
+    """
+    Invalidate ``key`` (everything if None; each key of a list) in the
+    LocalCache ``name`` of every process, once the current transaction
+    commits. Keys must be JSON values; they are compared after a JSON round
+    trip, so use str or int.
+    """
+    apply(_message(name, key), local=True)
+    connection = connections[settings.DISCOURSE_INVALIDATION_DATABASE]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)",
+            [settings.DISCOURSE_INVALIDATION_CHANNEL, _message(name, key)],
+        )
+
+
+def publish_many(name, keys, chunk_size=200):
+    """publish() for many keys, with one notification per ``chunk_size`` keys."""
+    keys = list(keys)
+    for start in range(0, len(keys), chunk_size):
+        publish(name, keys[start : start + chunk_size])
+
+
+def apply(payload, local=False):
+    """Apply one notification payload to this process's caches."""
+    try:
+        message = json.loads(payload)
+        name, key, origin = message["c"], message["k"], message["o"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Ignoring malformed invalidation: %r", payload)
+        return
+    if origin == _ORIGIN and not local:
+        # Already applied by publish().
+        return
+    cache = _registry.get(name)
+    if cache is None:
+        return
+    if key is None:
+        cache.clear()
+    else:
+        for item in key if isinstance(key, list) else [key]:
+            cache.invalidate(item)
+
+
+def clear_all():
+    with _registry_lock:
+        caches = list(_registry.values())
+    for cache in caches:
+        cache.clear()
+
+
+class InvalidationListener:
+    """
+    Background thread with its own database connection that LISTENs on the
+    invalidation channel and applies what it hears. Started on first use of a
+    LocalCache and again in every forked worker.
+    """
+
+    def __init__(self, channel, using="default", poll_interval=5.0):
+        self.channel = channel
+        self.using = using
+        self.poll_interval = poll_interval
+        self.thread = BackgroundThread(self._run, "discourse-invalidation")
+
+    def ensure_started(self):
+        if self.thread.alive():
+            return
+        if connections[self.using].vendor != "postgresql":
+            return
+        self.thread.ensure_started()
+
+    def _connect(self):
+        wrapper = connections[self.using]
+        raw = wrapper.get_new_connection(wrapper.get_connection_params())
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return raw
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            raw = None
+            try:
+                raw = self._connect()
+                # Anything may have changed while we were not listening.
+                clear_all()
+                backoff = 1.0
+                while True:
+                    if select.select([raw], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        apply(raw.notifies.pop(0).payload)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Invalidation listener failed: %s", e)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:  # pylint: disable=broad-except
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+
+listener = InvalidationListener(
+    settings.DISCOURSE_INVALIDATION_CHANNEL,
+    using=settings.DISCOURSE_INVALIDATION_DATABASE,
+)
@@ -0,0 +1,124 @@
+# apps/discourse/log.py
+
+import copy
+import logging
+import os
+import queue
+import random
+import re
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from django.utils.module_loading import import_string
+
+REDACTED = "[redacted]"
+SENSITIVE_KEYS = "sso|sig|signature|nonce|payload|payload_details"
+
+# key=value pairs in query strings and URLs.
+_QUERY_PATTERN = re.compile(r"(?i)\b(%s)=[^&\s'\"]+" % SENSITIVE_KEYS)
+# 'key': 'value' / 'key': ['value'] in dict and QueryDict reprs.
+_MAPPING_PATTERN = re.compile(
+    r"(?i)(['\"](?:%s)['\"]\s*:\s*)\[?'[^']*'\]?" % SENSITIVE_KEYS
+)
+
+
+def redact(message):
+    """Replace SSO payloads and signatures in a log message."""
+    message = _QUERY_PATTERN.sub(r"\1=" + REDACTED, message)
+    return _MAPPING_PATTERN.sub(r"\1'" + REDACTED + "'", message)
+
+
+class RedactingFilter(logging.Filter):
+    """Redacts payload and signature values from the rendered message."""
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only ``rate`` of the records at or below ``max_level``.
+    Warnings and errors are never sampled away. A record can opt out of
+    sampling with ``extra={"sample": False}``.
+    """
+
+    def __init__(self, rate=1.0, max_level="INFO", name=""):
+        super().__init__(name)
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level)
+
+    def filter(self, record):
+        if record.levelno > self.max_level or not getattr(record, "sample", True):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Queue-backed handler that can be configured from ``LOGGING``::
+
+        "class": "apps.discourse.log.AsyncQueueHandler",
+        "target": "logging.StreamHandler",
+        "formatter": "simple",
+
+    The target handler is created here and driven by a QueueListener thread,
+    started lazily in each process. When the queue is full records are dropped
+    rather than blocking the request thread.
+    """
+
+    def __init__(self, target="logging.StreamHandler", queue_size=10000, **kwargs):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = import_string(target)(**kwargs)
+        self.target.addFilter(RedactingFilter())
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._listener_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, in the target handler.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only merge the arguments here; the (possibly mutable) objects are
+        # rendered to text so the listener thread never touches them.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        # The traceback has already been rendered into exc_text by emit().
+        record.exc_info = None
+        return record
+
+    def emit(self, record):
+        self._ensure_listener()
+        if record.exc_info:
+            # Render tracebacks before the frames go away.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listener = QueueListener(
+                self.queue, self.target, respect_handler_level=True
+            )
+            self._listener.start()
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+        self.target.close()
+        super().close()
@@ -0,0 +1,103 @@
+# apps/discourse/management/commands/audit_sso_signatures.py
+import collections
+import contextlib
+import csv
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from apps.discourse.audit import (
+    CURRENT,
+    MISMATCH,
+    PREVIOUS,
+    UNSIGNED,
+    audit_signatures,
+)
+from apps.discourse.models import SsoEventLog
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the signature of every SsoEventLog row against the current and "
+        "previous DiscourseConnect secrets, using all cores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Only events at or after this datetime")
+        parser.add_argument("--end", help="Only events before this datetime")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Verifying processes (1 verifies inline)",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=10000, help="Events read per query"
+        )
+        parser.add_argument(
+            "--output",
+            "-o",
+            help="Write the flagged events as CSV (id, outcome) to this file "
+            "instead of listing them",
+        )
+        parser.add_argument(
+            "--show",
+            type=int,
+            default=20,
+            help="Flagged events listed without --output (default 20)",
+        )
+
+    def handle(self, *args, **options):
+        queryset = SsoEventLog.objects.all()
+        for option, lookup in (("start", "created_at__gte"), ("end", "created_at__lt")):
+            if options[option]:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError(f"--{option}: not a datetime")
+                queryset = queryset.filter(**{lookup: value})
+
+        secrets = [settings.DISCOURSE_CONNECT_SECRET]
+        secrets += settings.DISCOURSE_CONNECT_PREVIOUS_SECRETS
+        totals = collections.Counter()
+        shown = hidden = 0
+        with contextlib.ExitStack() as stack:
+            writer = None
+            if options["output"]:
+                output = stack.enter_context(
+                    open(options["output"], "w", encoding="utf-8", newline="")
+                )
+                writer = csv.writer(output)
+                writer.writerow(["id", "outcome"])
+            for counts, flagged in audit_signatures(
+                secrets,
+                queryset=queryset,
+                workers=options["workers"],
+                chunk_size=options["chunk_size"],
+            ):
+                totals.update(counts)
+                if writer:
+                    writer.writerows(flagged)
+                    continue
+                for event_id, outcome in flagged:
+                    if shown < options["show"]:
+                        self.stdout.write(f"{outcome}\t{event_id}")
+                        shown += 1
+                    else:
+                        hidden += 1
+
+        if hidden:
+            self.stdout.write(f"... and {hidden} more flagged events (use --output).")
+        audited = sum(totals.values())
+        self.stdout.write(
+            f"Audited {audited} SSO events: {totals[CURRENT]} current secret, "
+            f"{totals[PREVIOUS]} previous secrets, {totals[MISMATCH]} mismatches, "
+            f"{totals[UNSIGNED]} unsigned."
+        )
+        if totals[MISMATCH]:
+            self.stdout.write(
+                self.style.ERROR(f"{totals[MISMATCH]} signatures match no secret.")
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("No signature mismatches."))
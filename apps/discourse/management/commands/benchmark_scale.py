@@ -0,0 +1,173 @@
+# apps/discourse/management/commands/benchmark_scale.py
+import datetime
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from apps.discourse.backends import DiscourseModelBackend
+from apps.discourse.export import export_rows
+from apps.discourse.models import DiscourseProfile, SsoEventLog
+from apps.discourse.scaledata import generate_events, generate_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the admin changelists, user resolution and SSO event queries at "
+        "growing data sizes (topping the event log up to each scale first)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales",
+            default="10000,1000000,10000000",
+            help="Comma-separated SsoEventLog sizes to benchmark at",
+        )
+        parser.add_argument(
+            "--users-per-event",
+            type=float,
+            default=0.1,
+            help="Users generated alongside the events",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--output", help="Write the results as JSON")
+        parser.add_argument(
+            "--baseline", help="Fail when slower than this earlier --output"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=1.5,
+            help="Allowed slowdown against --baseline (1.5 = 50%% slower)",
+        )
+
+    # -- data ------------------------------------------------------------
+
+    def top_up(self, scale, users_per_event):
+        User = get_user_model()
+        missing_users = int(scale * users_per_event) - User.objects.count()
+        for _ in generate_users(max(0, missing_users)):
+            pass
+        missing_events = scale - SsoEventLog.objects.count()
+        if missing_events > 0:
+            user_ids = list(User.objects.values_list("id", flat=True))
+            for _ in generate_events(missing_events, user_ids):
+                pass
+
+    # -- benchmarks ------------------------------------------------------
+
+    def benchmarks(self):
+        User = get_user_model()
+        factory = RequestFactory()
+        staff = User(id=0, username="bench", is_active=True, is_staff=True)
+        staff.is_superuser = True
+        user_ids = list(User.objects.order_by("?").values_list("id", flat=True)[:200])
+        usernames = list(
+            User.objects.filter(id__in=user_ids).values_list("username", flat=True)
+        )
+        backend = DiscourseModelBackend()
+        since = timezone.now() - datetime.timedelta(days=1)
+
+        def changelist(model, query=""):
+            meta = model._meta
+            url = reverse(f"admin:{meta.app_label}_{meta.model_name}_changelist")
+            # The view as the admin URLconf serves it, permission check included.
+            view = resolve(url).func
+
+            def run():
+                request = factory.get(url + query)
+                request.user = staff
+                view(request).render()
+
+            return run
+
+        def resolve_by_id():
+            backend.get_user(random.choice(user_ids))
+
+        def resolve_by_username():
+            User.objects.get(username=random.choice(usernames))
+
+        def events_by_type():
+            list(
+                SsoEventLog.objects.filter(created_at__gte=since)
+                .values("event_type")
+                .annotate(count=Count("id"))
+            )
+
+        def user_history():
+            list(SsoEventLog.objects.filter(user_id=random.choice(user_ids))[:20])
+
+        def export_day():
+            for n, _ in enumerate(export_rows(start=since)):
+                if n >= 10000:
+                    break
+
+        return [
+            ("admin: profile changelist", changelist(DiscourseProfile)),
+            ("admin: profile search", changelist(DiscourseProfile, "?q=scale-1")),
+            ("admin: event log changelist", changelist(SsoEventLog)),
+            ("admin: event log filtered", changelist(SsoEventLog, "?event_type=error")),
+            ("resolve session user (backend)", resolve_by_id if user_ids else None),
+            ("resolve user by username", resolve_by_username if usernames else None),
+            ("events of the last day by type", events_by_type),
+            ("latest events of a user", user_history if user_ids else None),
+            ("export 10k events of the last day", export_day),
+        ]
+
+    def time(self, func, repeat):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options["scales"].split(",")]
+        except ValueError:
+            raise CommandError(
+                "--scales must be a comma-separated list of integers"
+            ) from None
+
+        results = {}
+        for scale in sorted(scales):
+            self.stdout.write(f"Preparing {scale} events ...")
+            self.top_up(scale, options["users_per_event"])
+            rows = SsoEventLog.objects.count()
+            self.stdout.write(
+                f"== {rows} events, {get_user_model().objects.count()} users"
+            )
+            results[str(scale)] = timings = {}
+            for name, func in self.benchmarks():
+                if func is None:
+                    continue
+                timings[name] = self.time(func, options["repeat"])
+                self.stdout.write(f"{name:<40} {timings[name]:10.2f} ms")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(results, output, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = [
+                f"{name} at {scale}: {ms:.2f} ms (was {baseline[scale][name]:.2f} ms)"
+                for scale, timings in results.items()
+                for name, ms in timings.items()
+                if name in baseline.get(scale, {})
+                and ms > baseline[scale][name] * options["tolerance"]
+            ]
+            if regressions:
+                raise CommandError("Scaling regressions:\n" + "\n".join(regressions))
+            self.stdout.write(
+                self.style.SUCCESS("No regressions against the baseline.")
+            )
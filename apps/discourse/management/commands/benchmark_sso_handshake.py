@@ -0,0 +1,76 @@
+# apps/discourse/management/commands/benchmark_sso_handshake.py
+import base64
+import timeit
+import urllib.parse
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.discourse.handshake import parse_sso_request
+from apps.discourse.models import DiscourseProfile
+from apps.discourse.sso import (
+    build_redirect_url,
+    decode_sso_payload,
+    generate_sso_payload,
+    get_return_url_matcher,
+    sign_payload,
+    validate_return_url,
+    verify_signature,
+)
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark the per-request cost of the SSO handshake."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        return_url = next(iter(get_return_url_matcher().origins.items()), None)
+        if return_url is None:
+            self.stderr.write("DISCOURSE_SSO_RETURN_ALLOWLIST has no plain host entry.")
+            return
+        (scheme, host, port), prefixes = return_url
+        return_sso_url = f"{scheme}://{host}:{port}{prefixes[0]}session/sso_login"
+        query = urllib.parse.urlencode(
+            {
+                "nonce": "cb68251eefb5211e58c00ff1395f0c0b",
+                "return_sso_url": return_sso_url,
+            }
+        )
+        sso = base64.b64encode(query.encode()).decode()
+        sig = sign_payload(sso.encode())
+        user = get_user_model()(id=1, username="bench", email="bench@example.com")
+        # Attach an unsaved profile so the benchmark never touches the database.
+        DiscourseProfile(user=user, group_names=["staff"])
+
+        def legacy():
+            verify_signature(sso, sig)
+            payload = decode_sso_payload(sso)
+            validate_return_url(payload["return_sso_url"])
+
+        def handshake():
+            parse_sso_request(sso, sig)
+
+        def untraced_handshake():
+            # The same work without the sso.parse_request span, to tell the
+            # parsing cost apart from the tracing overhead.
+            parse_sso_request.__wrapped__(sso, sig)
+
+        def round_trip():
+            request = parse_sso_request(sso, sig)
+            build_redirect_url(
+                request.return_sso_url,
+                generate_sso_payload(user, request.nonce, request.return_sso_url),
+            )
+
+        iterations = options["iterations"]
+        for name, func in (
+            ("verify + decode + validate (separate steps)", legacy),
+            ("parse_sso_request", handshake),
+            ("parse_sso_request without its span", untraced_handshake),
+            ("parse_sso_request + signed response", round_trip),
+        ):
+            best = min(timeit.repeat(func, number=iterations, repeat=options["repeat"]))
+            self.stdout.write(f"{name:<45} {best / iterations * 1e6:8.2f} µs/request")
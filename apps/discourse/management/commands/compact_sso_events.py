@@ -0,0 +1,50 @@
+# apps/discourse/management/commands/compact_sso_events.py
+from django.core.management.base import BaseCommand
+
+from apps.discourse.eventlog import pack_details
+from apps.discourse.models import SsoEventLog
+
+
+class Command(BaseCommand):
+    help = "Move the payload_details of older SsoEventLog rows to compact storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=2000, help="Rows updated per query"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        compacted = last_id = 0
+        while True:
+            events = list(
+                SsoEventLog.objects.filter(id__gt=last_id)
+                .exclude(payload_details="")
+                .order_by("id")
+                .only("id", "payload_details")[:batch_size]
+            )
+            if not events:
+                break
+            for event in events:
+                (
+                    event.nonce,
+                    event.external_id,
+                    event.return_host,
+                    event.payload_blob,
+                ) = pack_details(event.payload_details)
+                event.payload_details = ""
+            SsoEventLog.objects.bulk_update(
+                events,
+                [
+                    "payload_details",
+                    "nonce",
+                    "external_id",
+                    "return_host",
+                    "payload_blob",
+                ],
+            )
+            compacted += len(events)
+            last_id = events[-1].id
+            self.stdout.write(f"\r{compacted} events compacted", ending="")
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} SSO events."))
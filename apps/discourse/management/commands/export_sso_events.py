@@ -0,0 +1,53 @@
+# apps/discourse/management/commands/export_sso_events.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.discourse.export import SsoEventExportForm, export_rows, render_export
+
+
+class Command(BaseCommand):
+    help = "Stream SsoEventLog rows as NDJSON or CSV with constant memory use."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Only events at or after this datetime")
+        parser.add_argument("--end", help="Only events before this datetime")
+        parser.add_argument("--event-type", help="login, sync or error")
+        parser.add_argument("--user", help="Username or user id")
+        parser.add_argument("--format", default="ndjson", help="ndjson or csv")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+        parser.add_argument(
+            "--output", "-o", help="Output file (defaults to standard output)"
+        )
+
+    def handle(self, *args, **options):
+        form = SsoEventExportForm(
+            {
+                "start": options["start"],
+                "end": options["end"],
+                "event_type": options["event_type"],
+                "user": options["user"],
+                "format": options["format"],
+                "gzip": options["gzip"],
+            }
+        )
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        params = form.cleaned_data
+
+        rows = export_rows(
+            start=params["start"],
+            end=params["end"],
+            event_type=params["event_type"],
+            user=params["user"],
+        )
+        chunks = render_export(rows, params["format"], params["gzip"])
+
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
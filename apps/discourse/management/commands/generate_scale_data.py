@@ -0,0 +1,50 @@
+# apps/discourse/management/commands/generate_scale_data.py
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.discourse.scaledata import generate_events, generate_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, Discourse profiles and SSO events for "
+        "scale testing (COPY on PostgreSQL, bulk inserts elsewhere)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--events", type=int, default=100000)
+        parser.add_argument(
+            "--days", type=int, default=90, help="Spread events over this many days"
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, help="Seed for a repeatable event mix")
+
+    def handle(self, *args, **options):
+        user_ids = []
+        for ids in generate_users(options["users"], batch_size=options["batch_size"]):
+            user_ids.extend(ids)
+            self.stdout.write(f"\r{len(user_ids)} users", ending="")
+        generated_users = len(user_ids)
+        if user_ids:
+            self.stdout.write("")
+        else:
+            # Attribute the events to the users that already exist.
+            user_ids = list(get_user_model().objects.values_list("id", flat=True))
+
+        created = 0
+        for size in generate_events(
+            options["events"],
+            user_ids,
+            days=options["days"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+        ):
+            created += size
+            self.stdout.write(f"\r{created} events", ending="")
+        self.stdout.write("")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {generated_users} users and {created} events."
+            )
+        )
@@ -0,0 +1,30 @@
+# apps/discourse/management/commands/import_users.py
+from django.core.management.base import BaseCommand
+
+from apps.discourse.imports import IMPORT_FIELDS, import_users, read_import_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-import users from a CSV file (columns: %s; passwords as Django "
+        "hashes) and queue the new users for a background sync to Discourse."
+        % ", ".join(IMPORT_FIELDS)
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header line")
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000, help="Users inserted per query"
+        )
+        parser.add_argument(
+            "--no-sync", action="store_true", help="Do not sync to Discourse"
+        )
+
+    def handle(self, *args, **options):
+        with open(options["path"], newline="", encoding="utf-8") as file:
+            created, skipped = import_users(
+                read_import_csv(file),
+                chunk_size=options["chunk_size"],
+                sync=not options["no_sync"],
+            )
+        self.stdout.write(f"Imported {created} users, skipped {skipped}.")
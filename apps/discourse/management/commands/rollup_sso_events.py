@@ -0,0 +1,32 @@
+# apps/discourse/management/commands/rollup_sso_events.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.discourse.rollups import catch_up
+
+
+class Command(BaseCommand):
+    help = "Fold new SsoEventLog rows into the hourly and daily rollup tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50000,
+            help="Events aggregated per transaction",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and catch up every N seconds (0 runs once)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = catch_up(batch_size=options["batch_size"])
+            self.stdout.write(f"Rolled up {processed} SSO events.")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
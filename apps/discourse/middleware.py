@@ -0,0 +1,88 @@
+# apps/discourse/middleware.py
+
+import cProfile
+import logging
+import random
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from . import profiling, tracing
+
+logger = logging.getLogger(__name__)
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of every request, continuing an incoming
+    ``traceparent`` header (whose sampled flag counts only from
+    DISCOURSE_TRACE_TRUSTED_CALLERS), and returns the trace id in ``X-Trace-Id`` so a
+    slow login reported by a user can be found in the exported traces.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with tracing.span(
+            f"{request.method} {request.path}",
+            traceparent=request.META.get("HTTP_TRACEPARENT"),
+            trusted=request.META.get("REMOTE_ADDR")
+            in settings.DISCOURSE_TRACE_TRUSTED_CALLERS,
+            **{"http.method": request.method, "http.target": request.path},
+        ) as root:
+            response = self.get_response(request)
+            root.set("http.status_code", response.status_code)
+        if root.sampled:
+            response["X-Trace-Id"] = root.trace_id
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs a sample of the requests to the views in DISCOURSE_PROFILE_VIEWS
+    under cProfile and keeps the result in the on-disk profile ring. Requests
+    are picked at DISCOURSE_PROFILE_SAMPLE_RATE, or on demand with an
+    ``X-Discourse-Profile`` header holding a token from the staff profiles
+    page. Everything else only pays for one random() call.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _wants_profile(self, request):
+        token = request.META.get(profiling.PROFILE_HEADER)
+        if token:
+            return profiling.valid_profile_token(token)
+        rate = settings.DISCOURSE_PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def _profiled_view(self, request):
+        try:
+            view = resolve(request.path_info).func
+        except Resolver404:
+            return False
+        view_class = getattr(view, "view_class", view)
+        name = f"{view_class.__module__}.{view_class.__qualname__}"
+        return name in settings.DISCOURSE_PROFILE_VIEWS
+
+    def __call__(self, request):
+        if not self._wants_profile(request) or not self._profiled_view(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this interpreter.
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        try:
+            name = profiling.ring.save(profiler, f"{request.method} {request.path}")
+            logger.info("Stored request profile %s", name)
+        except OSError as e:
+            logger.error("Failed to store request profile: %s", e)
+        return response
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discourse", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discourseprofile",
+            name="suspended_till",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="End of the forum suspension, as reported by Discourse webhooks",
+                null=True,
+            ),
+        ),
+    ]
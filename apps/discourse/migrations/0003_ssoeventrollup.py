@@ -0,0 +1,97 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discourse", "0002_discourseprofile_suspended_till"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SsoEventRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")],
+                        help_text="Bucket granularity",
+                        max_length=4,
+                    ),
+                ),
+                ("bucket", models.DateTimeField(help_text="Start of the hour or day")),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("login", "Login"),
+                            ("sync", "Sync"),
+                            ("error", "Error"),
+                        ],
+                        help_text="Type of SSO event",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "count",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Number of events in the bucket"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "SSO Event Rollup",
+                "verbose_name_plural": "SSO Event Rollups",
+                "ordering": ["-bucket", "event_type"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SsoRollupState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                (
+                    "last_event_id",
+                    models.BigIntegerField(
+                        default=0, help_text="Highest SsoEventLog id already aggregated"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, help_text="Timestamp of the last rollup run"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "SSO Rollup State",
+                "verbose_name_plural": "SSO Rollup States",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="ssoeventrollup",
+            constraint=models.UniqueConstraint(
+                fields=("period", "bucket", "event_type"),
+                name="unique_sso_event_rollup_bucket",
+            ),
+        ),
+    ]
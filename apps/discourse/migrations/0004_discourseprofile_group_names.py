@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discourse", "0003_ssoeventrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discourseprofile",
+            name="group_names",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Names of the user's Django groups, sent as add_groups on SSO",
+            ),
+        ),
+        migrations.AddField(
+            model_name="discourseprofile",
+            name="removed_group_names",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Groups the user has left since the last sync, sent as remove_groups",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_missing_profiles(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    DiscourseProfile = apps.get_model("discourse", "DiscourseProfile")
+    users = User.objects.filter(discourse_profile__isnull=True).values_list(
+        "id", "username", "email"
+    )
+    batch = []
+    for user_id, username, email in users.iterator(chunk_size=2000):
+        batch.append(DiscourseProfile(user_id=user_id, username=username, email=email))
+        if len(batch) >= 2000:
+            DiscourseProfile.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    DiscourseProfile.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("discourse", "0004_discourseprofile_group_names"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discourseprofile",
+            name="last_sync_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("ok", "OK"), ("failed", "Failed")],
+                help_text="Outcome of the last attempt to sync with Discourse",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
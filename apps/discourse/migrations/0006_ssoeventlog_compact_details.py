@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discourse", "0005_discourseprofile_last_sync_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ssoeventlog",
+            name="external_id",
+            field=models.CharField(
+                blank=True, help_text="external_id of the SSO payload", max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="ssoeventlog",
+            name="nonce",
+            field=models.CharField(
+                blank=True, help_text="Nonce of the SSO payload", max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="ssoeventlog",
+            name="payload_blob",
+            field=models.BinaryField(
+                blank=True,
+                help_text="Remaining payload details, zlib-compressed",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ssoeventlog",
+            name="return_host",
+            field=models.CharField(
+                blank=True,
+                help_text="Host of the payload's return_sso_url",
+                max_length=255,
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discourse", "0006_ssoeventlog_compact_details"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingWebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("event", models.CharField(blank=True, max_length=64)),
+                ("event_id", models.CharField(blank=True, max_length=64)),
+                ("external_id", models.CharField(max_length=255)),
+                ("fields", models.JSONField(default=dict)),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(
+                        default=0, help_text="Failed attempts to apply the event"
+                    ),
+                ),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Pending Webhook Event",
+                "verbose_name_plural": "Pending Webhook Events",
+            },
+        ),
+    ]
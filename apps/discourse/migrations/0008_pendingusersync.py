@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("discourse", "0007_pendingwebhookevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingUserSync",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("queued_at", models.DateTimeField()),
+                (
+                    "claimed_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When a worker started syncing the user",
+                        null=True,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Pending User Sync",
+                "verbose_name_plural": "Pending User Syncs",
+            },
+        ),
+    ]
@@ -1,10 +1,8 @@
 # apps/discourse/mixins.py
 
-from .exceptions import SSOValidationError
+from . import tracing
+from .handshake import parse_sso_request
 from .sso import (
-    verify_signature,
-    decode_sso_payload,
-    validate_return_url,
     generate_sso_payload,
     build_redirect_url,
 )
@@ -18,21 +16,16 @@ class BaseSSOViewMixin:
     """
 
     def validate_and_decode_payload(self, sso, sig):
-        # Verify the signature and decode the payload.
-        verify_signature(sso, sig)
-        payload = decode_sso_payload(sso)
-        if "nonce" not in payload:
-            raise SSOValidationError("Missing nonce parameter in payload")
-        if "return_sso_url" not in payload:
-            raise SSOValidationError("Missing return_sso_url parameter in payload")
-        validate_return_url(payload["return_sso_url"])
-        return payload
+        # Verify the signature, decode the payload and validate it in one pass.
+        return parse_sso_request(sso, sig).params
 
     def build_response_url(self, user, payload):
         """
         Generate a new SSO payload with the user’s data and build the redirect URL.
+        ``payload`` is an SSORequest or the decoded payload dict.
         """
         nonce = payload.get("nonce")
         return_url = payload.get("return_sso_url")
-        sso_payload = generate_sso_payload(user, nonce, return_url)
-        return build_redirect_url(return_url, sso_payload)
+        with tracing.span("sso.build_response"):
+            sso_payload = generate_sso_payload(user, nonce, return_url)
+            return build_redirect_url(return_url, sso_payload)
@@ -0,0 +1,315 @@
+# apps/discourse/mmapcache.py
+"""
+Cache backend in a memory-mapped file shared by every process on the host::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "apps.discourse.mmapcache.MmapCache",
+            "LOCATION": "/var/lib/copdjsso/cache.mmap",
+            "OPTIONS": {"SLOTS": 32768, "SLOT_SIZE": 2048, "WAYS": 8},
+        }
+    }
+
+The file holds SLOTS fixed-size slots in sets of WAYS. A key can only live
+in the set its hash picks, so a lookup reads at most WAYS slot headers and
+the file never grows: SLOTS * SLOT_SIZE bytes. A full set evicts its least
+recently used (or an expired) entry. Storing a value that does not fit in
+a slot raises ValueError, so keep large values (sessions) in another cache.
+
+Reads take no lock. Each slot has a sequence number that writers make odd
+while they change the slot; a reader that sees it odd or changed retries.
+Writers serialize per set with a POSIX record lock on the file (plus a
+thread lock in the process). incr() and decr() read, change and write the
+value under that lock, so counters shared by processes (the budget windows
+of governor.py) lose no updates. The file outlives the workers, so restarted
+workers find the cache warm.
+
+Everything in the file is unpickled, so it must be private to the user the
+workers run as: its directory is created with mode 0700, and a file owned by
+another user or open to group or others is refused.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+MAGIC = b"DMMC"
+FORMAT_VERSION = 1
+# magic, version, slot size, slots, ways
+_FILE_HEADER = struct.Struct("<4sIIII")
+FILE_HEADER_SIZE = 64
+# seq, last access, expires (0: never), key hash, key length, value length
+_SLOT_HEADER = struct.Struct("<QddQHI")
+_SEQ = struct.Struct("<Q")
+_TIME = struct.Struct("<d")
+READ_RETRIES = 16
+
+
+def _key_hash(key):
+    # Never 0: that marks an empty slot.
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+class MmapCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.path = location
+        self.slot_size = int(options.get("SLOT_SIZE", 2048))
+        self.ways = int(options.get("WAYS", 8))
+        slots = int(options.get("SLOTS", 32768))
+        self.sets = max(1, slots // self.ways)
+        self.slots = self.sets * self.ways
+        self.max_value_size = self.slot_size - _SLOT_HEADER.size
+        self._pid = None
+        self._mm = None
+        self._fd = None
+        self._lock = None
+
+    # -- file handling -------------------------------------------------
+
+    def _open(self):
+        # Reopen in forked workers: the thread lock may have been held at fork.
+        if self._pid == os.getpid():
+            return self._mm
+        size = FILE_HEADER_SIZE + self.slots * self.slot_size
+        header = _FILE_HEADER.pack(
+            MAGIC, FORMAT_VERSION, self.slot_size, self.slots, self.ways
+        )
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            stat = os.fstat(fd)
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+                raise ImproperlyConfigured(
+                    f"{self.path} must be owned by this user and not accessible "
+                    "to group or others"
+                )
+            fcntl.lockf(fd, fcntl.LOCK_EX, FILE_HEADER_SIZE, 0)
+            try:
+                if os.pread(fd, _FILE_HEADER.size, 0) != header:
+                    # New file, or one written with other options: start over.
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, header, 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, FILE_HEADER_SIZE, 0)
+            mm = mmap.mmap(fd, size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd, self._mm = fd, mm
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        return mm
+
+    def _offset(self, index):
+        return FILE_HEADER_SIZE + index * self.slot_size
+
+    def _set_slots(self, key_hash):
+        first = (key_hash % self.sets) * self.ways
+        return range(first, first + self.ways)
+
+    @contextlib.contextmanager
+    def _locked(self, key_hash=None):
+        """Write lock for the set of ``key_hash`` (the whole file if None)."""
+        self._open()
+        if key_hash is None:
+            start, length = FILE_HEADER_SIZE, 0
+        else:
+            start = self._offset(self._set_slots(key_hash)[0])
+            length = self.ways * self.slot_size
+        # Record locks belong to the process, so threads need their own lock.
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    # -- slot access ---------------------------------------------------
+
+    def _read(self, mm, index, key_hash, key):
+        """The pickled value of ``key`` in slot ``index``, or None."""
+        offset = self._offset(index)
+        for _ in range(READ_RETRIES):
+            seq, _atime, expires, slot_hash, key_len, value_len = (
+                _SLOT_HEADER.unpack_from(mm, offset)
+            )
+            if seq & 1:
+                continue
+            if slot_hash != key_hash:
+                return None
+            start = offset + _SLOT_HEADER.size
+            data = mm[start : start + key_len + value_len]
+            if _SEQ.unpack_from(mm, offset)[0] != seq:
+                continue
+            if data[:key_len] != key or (expires and expires < time.time()):
+                return None
+            # Racy on purpose: LRU order only needs to be roughly right.
+            _TIME.pack_into(mm, offset + 8, time.time())
+            return data[key_len:]
+        return None
+
+    def _write(self, mm, index, key_hash=0, key=b"", value=b"", expires=0):
+        offset = self._offset(index)
+        seq = _SEQ.unpack_from(mm, offset)[0]
+        _SEQ.pack_into(mm, offset, seq | 1)
+        start = offset + _SLOT_HEADER.size
+        mm[start : start + len(key) + len(value)] = key + value
+        _SLOT_HEADER.pack_into(
+            mm,
+            offset,
+            seq | 1,
+            time.time(),
+            expires or 0.0,
+            key_hash,
+            len(key),
+            len(value),
+        )
+        _SEQ.pack_into(mm, offset, (seq | 1) + 1)
+
+    def _find(self, mm, key_hash, key):
+        """(slot holding ``key`` or None, slot to store it in otherwise)."""
+        now = time.time()
+        found = victim = None
+        victim_atime = None
+        for index in self._set_slots(key_hash):
+            _, atime, expires, slot_hash, key_len, _ = _SLOT_HEADER.unpack_from(
+                mm, self._offset(index)
+            )
+            if slot_hash == key_hash:
+                start = self._offset(index) + _SLOT_HEADER.size
+                if mm[start : start + key_len] == key:
+                    if expires and expires < now:
+                        return None, index
+                    found = index
+                    break
+            if not slot_hash or (expires and expires < now):
+                atime = -1.0
+            if victim_atime is None or atime < victim_atime:
+                victim, victim_atime = index, atime
+        return found, victim
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    # -- BaseCache API -------------------------------------------------
+
+    def _encode_key(self, key, version):
+        key = self.make_and_validate_key(key, version=version).encode()
+        return _key_hash(key), key
+
+    def _check_size(self, key, pickled):
+        if len(key) + len(pickled) > self.max_value_size:
+            raise ValueError(
+                f"Cache value of {len(key) + len(pickled)} bytes (with its key) "
+                f"does not fit in a {self.slot_size}-byte slot"
+            )
+
+    def _store(self, key_hash, key, pickled, timeout, only_new=False):
+        self._check_size(key, pickled)
+        mm = self._open()
+        with self._locked(key_hash):
+            found, victim = self._find(mm, key_hash, key)
+            if found is not None and only_new:
+                return False
+            self._write(
+                mm,
+                victim if found is None else found,
+                key_hash,
+                key,
+                pickled,
+                self._expires(timeout),
+            )
+        return True
+
+    def get(self, key, default=None, version=None):
+        key_hash, key = self._encode_key(key, version)
+        mm = self._open()
+        for index in self._set_slots(key_hash):
+            pickled = self._read(mm, index, key_hash, key)
+            if pickled is not None:
+                return pickle.loads(pickled)
+        return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key_hash, key = self._encode_key(key, version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        try:
+            self._store(key_hash, key, pickled, timeout)
+        except ValueError:
+            # Too big for a slot: make sure no older value is served instead.
+            self._delete(key_hash, key)
+            raise
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key_hash, key = self._encode_key(key, version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        return self._store(key_hash, key, pickled, timeout, only_new=True)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key_hash, key = self._encode_key(key, version)
+        mm = self._open()
+        with self._locked(key_hash):
+            found, _ = self._find(mm, key_hash, key)
+            if found is None:
+                return False
+            _TIME.pack_into(mm, self._offset(found) + 16, self._expires(timeout))
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key_hash, key = self._encode_key(key, version)
+        mm = self._open()
+        with self._locked(key_hash):
+            found, _ = self._find(mm, key_hash, key)
+            if found is None:
+                raise ValueError("Key '%s' not found" % key.decode())
+            offset = self._offset(found)
+            _, _, expires, _, key_len, value_len = _SLOT_HEADER.unpack_from(mm, offset)
+            start = offset + _SLOT_HEADER.size + key_len
+            value = pickle.loads(mm[start : start + value_len]) + delta
+            pickled = pickle.dumps(value, self.pickle_protocol)
+            self._check_size(key, pickled)
+            self._write(mm, found, key_hash, key, pickled, expires)
+        return value
+
+    def _delete(self, key_hash, key):
+        mm = self._open()
+        with self._locked(key_hash):
+            found, _ = self._find(mm, key_hash, key)
+            if found is None:
+                return False
+            self._write(mm, found)
+        return True
+
+    def delete(self, key, version=None):
+        return self._delete(*self._encode_key(key, version))
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        mm = self._open()
+        with self._locked():
+            for index in range(self.slots):
+                if _SLOT_HEADER.unpack_from(mm, self._offset(index))[3]:
+                    self._write(mm, index)
+
+    def close(self, **kwargs):
+        # Keep the mapping open across requests; it is per process anyway.
+        pass
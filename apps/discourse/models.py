@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.db import models
 
+from .eventlog import pack_details, unpack_details
+
 
 class DiscourseProfile(models.Model):
     """
@@ -34,6 +36,32 @@ class DiscourseProfile(models.Model):
         blank=True,
         help_text="Timestamp of the last successful sync with Discourse",
     )
+    SYNC_STATUS_CHOICES = [
+        ("ok", "OK"),
+        ("failed", "Failed"),
+    ]
+
+    last_sync_status = models.CharField(
+        max_length=10,
+        choices=SYNC_STATUS_CHOICES,
+        blank=True,
+        help_text="Outcome of the last attempt to sync with Discourse",
+    )
+    suspended_till = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="End of the forum suspension, as reported by Discourse webhooks",
+    )
+    group_names = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Names of the user's Django groups, sent as add_groups on SSO",
+    )
+    removed_group_names = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Groups the user has left since the last sync, sent as remove_groups",
+    )
     created_at = models.DateTimeField(
         auto_now_add=True, help_text="Record creation timestamp"
     )
@@ -76,6 +104,24 @@ class SsoEventLog(models.Model):
         blank=True,
         help_text="SSO payload details (encoded or decoded) for debugging purposes",
     )
+    # Compact storage (see eventlog.py): the fields worth querying are kept
+    # as columns and the rest of the details as a compressed blob that
+    # rebuilds the exact text with them.
+    nonce = models.CharField(
+        max_length=64, blank=True, help_text="Nonce of the SSO payload"
+    )
+    external_id = models.CharField(
+        max_length=255, blank=True, help_text="external_id of the SSO payload"
+    )
+    return_host = models.CharField(
+        max_length=255, blank=True, help_text="Host of the payload's return_sso_url"
+    )
+    payload_blob = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Remaining payload details, zlib-compressed",
+    )
     signature = models.CharField(
         max_length=255, blank=True, help_text="The HMAC signature of the SSO payload"
     )
@@ -86,7 +132,133 @@ class SsoEventLog(models.Model):
     def __str__(self):
         return f"SSO Event: {self.event_type} for {self.user} on {self.created_at:%Y-%m-%d %H:%M:%S}"
 
+    def set_details(self, details):
+        """Store payload details, compactly if DISCOURSE_SSO_EVENT_COMPACT is on."""
+        if settings.DISCOURSE_SSO_EVENT_COMPACT:
+            self.nonce, self.external_id, self.return_host, self.payload_blob = (
+                pack_details(details)
+            )
+            self.payload_details = ""
+        else:
+            self.payload_details = details
+
+    @property
+    def details(self):
+        """The payload details, whichever way they are stored."""
+        return self.payload_details or unpack_details(
+            self.nonce, self.external_id, self.return_host, self.payload_blob
+        )
+
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "SSO Event Log"
         verbose_name_plural = "SSO Event Logs"
+
+
+class SsoEventRollup(models.Model):
+    """
+    Pre-aggregated SsoEventLog counts per hour or day and event type.
+    Maintained incrementally by the rollup_sso_events command so that
+    analytics never have to scan the raw event log.
+    """
+
+    PERIOD_CHOICES = [
+        ("hour", "Hour"),
+        ("day", "Day"),
+    ]
+
+    period = models.CharField(
+        max_length=4, choices=PERIOD_CHOICES, help_text="Bucket granularity"
+    )
+    bucket = models.DateTimeField(help_text="Start of the hour or day")
+    event_type = models.CharField(
+        max_length=20,
+        choices=SsoEventLog.EVENT_TYPE_CHOICES,
+        help_text="Type of SSO event",
+    )
+    count = models.PositiveBigIntegerField(
+        default=0, help_text="Number of events in the bucket"
+    )
+
+    def __str__(self):
+        return f"{self.event_type} per {self.period} at {self.bucket:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        ordering = ["-bucket", "event_type"]
+        verbose_name = "SSO Event Rollup"
+        verbose_name_plural = "SSO Event Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "bucket", "event_type"],
+                name="unique_sso_event_rollup_bucket",
+            )
+        ]
+
+
+class SsoRollupState(models.Model):
+    """
+    High-water mark of the rollup job: the last SsoEventLog id that has been
+    folded into SsoEventRollup.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(
+        default=0, help_text="Highest SsoEventLog id already aggregated"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True, help_text="Timestamp of the last rollup run"
+    )
+
+    def __str__(self):
+        return f"Rollup state {self.name} at event {self.last_event_id}"
+
+    class Meta:
+        verbose_name = "SSO Rollup State"
+        verbose_name_plural = "SSO Rollup States"
+
+
+class PendingWebhookEvent(models.Model):
+    """
+    A verified Discourse webhook delivery that has been acknowledged but not
+    applied yet. The webhook batcher applies and deletes these in id order
+    (see webhooks.py), so accepted events survive failures and restarts.
+    """
+
+    event = models.CharField(max_length=64, blank=True)
+    event_id = models.CharField(max_length=64, blank=True)
+    external_id = models.CharField(max_length=255)
+    fields = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text="Failed attempts to apply the event"
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Webhook {self.event} {self.event_id} for {self.external_id}"
+
+    class Meta:
+        verbose_name = "Pending Webhook Event"
+        verbose_name_plural = "Pending Webhook Events"
+
+
+class PendingUserSync(models.Model):
+    """
+    A user whose data still has to be pushed to Discourse. The user sync
+    queue (see syncqueue.py) claims these rows in the background and deletes
+    them once synced; queueing a user again resets the claim.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True
+    )
+    queued_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(
+        null=True, blank=True, help_text="When a worker started syncing the user"
+    )
+
+    def __str__(self):
+        return f"Pending Discourse sync of {self.user_id}"
+
+    class Meta:
+        verbose_name = "Pending User Sync"
+        verbose_name_plural = "Pending User Syncs"
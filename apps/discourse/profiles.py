@@ -0,0 +1,113 @@
+# apps/discourse/profiles.py
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .groups import prune_removed_group_names
+from .models import DiscourseProfile
+from .workers import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+
+def provision_profiles(users):
+    """
+    Create the missing DiscourseProfile rows for ``users`` in one
+    ``INSERT ... ON CONFLICT DO NOTHING`` statement. Existing profiles are
+    left untouched, so concurrent logins or saves of the same user never
+    race into an IntegrityError.
+    """
+    DiscourseProfile.objects.bulk_create(
+        [
+            DiscourseProfile(user_id=user.pk, username=user.username, email=user.email)
+            for user in users
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class SyncStatusRecorder:
+    """
+    Collects the outcome of Discourse syncs and writes them back in batches:
+    one UPDATE per flush sets last_sync_status for every recorded user and
+    last_sync for the successful ones, and the groups a successful sync
+    removed are pruned from removed_group_names. Only the latest result per
+    user is kept. A background thread flushes every ``flush_interval`` seconds, or
+    sooner once ``batch_size`` users are pending.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=5.0):
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.worker = PeriodicWorker(
+            self._flush_logged,
+            flush_interval,
+            "discourse-sync-status",
+            "record Discourse sync status",
+        )
+
+    def record(self, user_id, ok, when=None, removed_groups=()):
+        """
+        Remember one sync result; never touches the database.
+        ``removed_groups`` are the names the sync sent as remove_groups.
+        """
+        with self._lock:
+            self._pending[user_id] = (when or timezone.now(), ok, removed_groups)
+            full = len(self._pending) >= self.batch_size
+        self.worker.ensure_started()
+        if full:
+            self.worker.wake()
+
+    def flush(self):
+        """Write all pending results with a single UPDATE. Returns the count."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            DiscourseProfile.objects.filter(user_id__in=list(pending)).update(
+                last_sync_status=Case(
+                    *[
+                        When(user_id=user_id, then=Value("ok" if ok else "failed"))
+                        for user_id, (_, ok, _) in pending.items()
+                    ]
+                ),
+                last_sync=Case(
+                    *[
+                        When(user_id=user_id, then=Value(when))
+                        for user_id, (when, ok, _) in pending.items()
+                        if ok
+                    ],
+                    default=F("last_sync"),
+                ),
+            )
+            prune_removed_group_names(
+                {
+                    user_id: removed
+                    for user_id, (_, ok, removed) in pending.items()
+                    if ok
+                }
+            )
+        except Exception:
+            # Put the results back unless a newer one arrived meanwhile.
+            with self._lock:
+                for user_id, result in pending.items():
+                    self._pending.setdefault(user_id, result)
+            raise
+        return len(pending)
+
+    def _flush_logged(self):
+        flushed = self.flush()
+        if flushed:
+            logger.debug("Recorded Discourse sync status for %d users", flushed)
+
+
+sync_status = SyncStatusRecorder(
+    batch_size=settings.DISCOURSE_SYNC_STATUS_BATCH_SIZE,
+    flush_interval=settings.DISCOURSE_SYNC_STATUS_FLUSH_INTERVAL,
+)
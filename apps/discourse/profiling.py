@@ -0,0 +1,103 @@
+# apps/discourse/profiling.py
+
+import datetime
+import io
+import os
+import pstats
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = "HTTP_X_DISCOURSE_PROFILE"
+_TOKEN_SALT = "apps.discourse.profiling"
+_NAME_PATTERN = re.compile(r"^\d+-[\w.-]+\.prof$")
+
+
+def make_profile_token():
+    """Return a header value that asks for the next requests to be profiled."""
+    return signing.TimestampSigner(salt=_TOKEN_SALT).sign("profile")
+
+
+def valid_profile_token(token):
+    """True for a token from make_profile_token() that has not expired yet."""
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=_TOKEN_SALT).unsign(
+            token, max_age=settings.DISCOURSE_PROFILE_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class ProfileRing:
+    """
+    A bounded directory of pstats files: each save removes the oldest files
+    beyond ``size``, so disk use stays fixed however often requests are
+    profiled. File names start with a nanosecond timestamp, so sorting by
+    name is sorting by age, across all processes writing to the directory.
+    """
+
+    def __init__(self, directory, size=50):
+        self.directory = str(directory)
+        self.size = size
+
+    def save(self, profiler, label):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^\w.-]+", "_", label).strip("_")[:80] or "request"
+        name = f"{time.time_ns()}-{slug}.prof"
+        profiler.dump_stats(os.path.join(self.directory, name))
+        self._trim()
+        return name
+
+    def names(self):
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((n for n in entries if _NAME_PATTERN.match(n)), reverse=True)
+
+    def _trim(self):
+        for name in self.names()[self.size :]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Another worker trimmed it first.
+                pass
+
+    def path(self, name):
+        """Absolute path of a stored profile; raises FileNotFoundError otherwise."""
+        if not _NAME_PATTERN.match(name or ""):
+            raise FileNotFoundError(name)
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def entries(self):
+        """(name, label, recorded at, size in bytes) for every stored profile."""
+        result = []
+        for name in self.names():
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            timestamp, _, label = name[: -len(".prof")].partition("-")
+            recorded = datetime.datetime.fromtimestamp(int(timestamp) / 1e9)
+            result.append((name, label, recorded, size))
+        return result
+
+    def render_text(self, name, sort="cumulative", limit=60):
+        """The profile as pstats text, for reading in the browser."""
+        output = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+ring = ProfileRing(
+    settings.DISCOURSE_PROFILE_DIR, size=settings.DISCOURSE_PROFILE_RING_SIZE
+)
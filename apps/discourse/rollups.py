@@ -0,0 +1,136 @@
+# apps/discourse/rollups.py
+
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import SsoEventLog, SsoEventRollup, SsoRollupState
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "sso_event_rollup"
+PERIOD_FUNCTIONS = {"hour": TruncHour, "day": TruncDay}
+
+# The high-water mark never passes an event younger than this: ids are
+# handed out before commit, so a lower id may still appear until every
+# transaction open when a later row was created has ended.
+SETTLE_DELAY = datetime.timedelta(seconds=60)
+
+
+def _aggregate(events, period):
+    trunc = PERIOD_FUNCTIONS[period]
+    rows = (
+        events.annotate(bucket=trunc("created_at"))
+        .values("bucket", "event_type")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    return {(period, row["bucket"], row["event_type"]): row["total"] for row in rows}
+
+
+def _merge_counts(counts):
+    """Add aggregated counts to existing rollup rows, creating missing ones."""
+    if not counts:
+        return
+    buckets = {bucket for _, bucket, _ in counts}
+    existing = {
+        (row.period, row.bucket, row.event_type): row
+        for row in SsoEventRollup.objects.filter(bucket__in=buckets)
+    }
+    to_update, to_create = [], []
+    for key, total in counts.items():
+        row = existing.get(key)
+        if row is None:
+            period, bucket, event_type = key
+            to_create.append(
+                SsoEventRollup(
+                    period=period, bucket=bucket, event_type=event_type, count=total
+                )
+            )
+        else:
+            row.count += total
+            to_update.append(row)
+    SsoEventRollup.objects.bulk_update(to_update, ["count"])
+    SsoEventRollup.objects.bulk_create(to_create)
+
+
+def update_rollups(batch_size=50000, now=None):
+    """
+    Fold the next batch of SsoEventLog rows above the high-water mark into the
+    hourly and daily rollups. Returns the number of events processed.
+    The state row is locked for the duration, so concurrent runs serialize.
+
+    The mark only moves over a contiguous run of ids that ends before the
+    first unsettled event (created within SETTLE_DELAY of ``now``, or
+    dated in the future by a skewed clock). Ids are not filtered by
+    created_at, which would skip such rows for good once the mark passed
+    them.
+    """
+    cutoff = (now or timezone.now()) - SETTLE_DELAY
+    with transaction.atomic():
+        state, _ = SsoRollupState.objects.select_for_update().get_or_create(
+            name=STATE_NAME
+        )
+        pending = SsoEventLog.objects.filter(id__gt=state.last_event_id)
+        unsettled = pending.filter(created_at__gte=cutoff).aggregate(first=Min("id"))[
+            "first"
+        ]
+        if unsettled is not None:
+            pending = pending.filter(id__lt=unsettled)
+        # Walk the primary key index: the id of the batch_size-th pending
+        # event bounds this batch, or the last pending event if fewer remain.
+        boundary = list(
+            pending.order_by("id").values_list("id", flat=True)[
+                batch_size - 1 : batch_size
+            ]
+        )
+        if boundary:
+            high_water = boundary[0]
+        else:
+            high_water = pending.aggregate(high_water=Max("id"))["high_water"]
+        if high_water is None:
+            return 0
+
+        events = pending.filter(id__lte=high_water)
+        counts = {}
+        for period in PERIOD_FUNCTIONS:
+            counts.update(_aggregate(events, period))
+        _merge_counts(counts)
+
+        processed = sum(v for (period, _, _), v in counts.items() if period == "day")
+        state.last_event_id = high_water
+        state.save(update_fields=["last_event_id", "updated_at"])
+
+    logger.info("Rolled up %d SSO events up to id %d", processed, high_water)
+    return processed
+
+
+def catch_up(batch_size=50000, now=None):
+    """Run update_rollups until the high-water mark reaches the settled tail."""
+    total = 0
+    while True:
+        processed = update_rollups(batch_size=batch_size, now=now)
+        if not processed:
+            return total
+        total += processed
+
+
+def rollup_summary(period, since):
+    """
+    Return ``[(bucket, {event_type: count})]`` for the dashboard, newest first.
+    Reads only from SsoEventRollup.
+    """
+    rows = (
+        SsoEventRollup.objects.filter(period=period, bucket__gte=since)
+        .values("bucket", "event_type")
+        .annotate(total=Sum("count"))
+        .order_by("-bucket")
+    )
+    summary = {}
+    for row in rows:
+        summary.setdefault(row["bucket"], {})[row["event_type"]] = row["total"]
+    return list(summary.items())
@@ -0,0 +1,152 @@
+# apps/discourse/scaledata.py
+
+import csv
+import datetime
+import io
+import random
+import secrets
+import urllib.parse
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .imports import import_chunk
+from .models import SsoEventLog
+
+# Roughly what production sees: mostly logins, background syncs, few errors.
+EVENT_MIX = (("login", 0.70), ("sync", 0.25), ("error", 0.05))
+# Share of the events produced by the most active 20% of the users.
+ACTIVE_USER_SHARE = 0.8
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        # bytea in COPY text/csv input is written in hex format.
+        return "\\x" + value.hex()
+    return value
+
+
+def insert_rows(table, columns, rows):
+    """
+    Insert tuples as fast as the backend allows: COPY FROM STDIN on
+    PostgreSQL, a single executemany INSERT elsewhere. Unlike bulk_create
+    this keeps explicit values for auto_now_add columns.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                (_copy_value(value) for value in row) for row in rows
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN "
+                "WITH (FORMAT csv, NULL '\\N')",
+                buffer,
+            )
+        else:
+            placeholders = ", ".join(["%s"] * len(columns))
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows,
+            )
+
+
+def generate_users(count, batch_size=10000):
+    """
+    Create ``count`` users (and their profiles) through the bulk import path,
+    with names unique to this run. Yields the ids of every batch.
+    """
+    run = secrets.token_hex(3)
+    for start in range(0, count, batch_size):
+        rows = [
+            {
+                "username": f"scale-{run}-{n}",
+                "email": f"scale-{run}-{n}@example.com",
+                "first_name": "Scale",
+                "last_name": str(n),
+            }
+            for n in range(start, min(count, start + batch_size))
+        ]
+        yield import_chunk(rows)
+
+
+# Relative traffic per hour of the day: quiet nights, busy office hours.
+HOUR_WEIGHTS = (1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 8, 8, 8, 8, 8, 7, 7, 6, 5, 4, 3, 2, 1)
+_HOUR_CUM_WEIGHTS = [sum(HOUR_WEIGHTS[: hour + 1]) for hour in range(24)]
+
+
+def _event_time(midnight, days, rng):
+    """Recent days weigh more (exponential decay), hours follow HOUR_WEIGHTS."""
+    age = min(days - 1, int(rng.expovariate(3.0 / days)))
+    hour = rng.choices(range(24), cum_weights=_HOUR_CUM_WEIGHTS)[0]
+    return midnight - datetime.timedelta(
+        days=age, hours=-hour, seconds=-rng.randrange(3600)
+    )
+
+
+def generate_events(count, user_ids, days=90, batch_size=10000, seed=None):
+    """
+    Insert ``count`` SsoEventLog rows spread over the last ``days`` days.
+    Event types follow EVENT_MIX, a fifth of the users produce most of the
+    traffic and some errors have no user. Yields the size of every batch.
+    """
+    rng = random.Random(seed)
+    user_ids = list(user_ids)
+    active = user_ids[: max(1, len(user_ids) // 5)]
+    types, weights = zip(*EVENT_MIX)
+    now = timezone.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    adapt = connection.ops.adapt_datetimefield_value
+    table = SsoEventLog._meta.db_table
+    columns = (
+        "user_id",
+        "event_type",
+        "payload_details",
+        "nonce",
+        "external_id",
+        "return_host",
+        "payload_blob",
+        "signature",
+        "created_at",
+    )
+    return_url = "https://forum.example.com/session/sso_login"
+
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        rows = []
+        for event_type in rng.choices(types, weights, k=size):
+            if not user_ids or (event_type == "error" and rng.random() < 0.3):
+                user_id = None
+            elif rng.random() < ACTIVE_USER_SHARE:
+                user_id = rng.choice(active)
+            else:
+                user_id = rng.choice(user_ids)
+            event = SsoEventLog()
+            event.set_details(
+                urllib.parse.urlencode(
+                    {
+                        "nonce": f"{rng.getrandbits(128):032x}",
+                        "return_sso_url": return_url,
+                        "external_id": user_id or "",
+                    }
+                )
+            )
+            rows.append(
+                (
+                    user_id,
+                    event_type,
+                    event.payload_details,
+                    event.nonce,
+                    event.external_id,
+                    event.return_host,
+                    event.payload_blob,
+                    f"{rng.getrandbits(256):064x}",
+                    adapt(min(now, _event_time(midnight, days, rng))),
+                )
+            )
+        with transaction.atomic():
+            insert_rows(table, columns, rows)
+        yield size
@@ -0,0 +1,196 @@
+# apps/discourse/sessions.py
+"""
+Session engine (SESSION_ENGINE = "apps.discourse.sessions") that serves
+sessions from the shared cache and writes them back to the database lazily.
+
+Saves go to the cache right away; the database copy is only there to survive
+cache evictions and restarts, so its writes are coalesced per process and
+sent as one upsert per batch. Deletes (logout, key rotation at login) reach
+the database at once. A save that changes nothing, such as a repeated SSO
+bounce, writes nothing at all.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.utils import timezone
+
+from .workers import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "apps.discourse.sessions"
+# Cached in place of a deleted session, so that no worker reloads the row a
+# late write-back from another worker may still put back.
+DELETED = "deleted"
+
+
+class SessionWriteBack:
+    """
+    Session rows waiting to be written to the database by this process. Only
+    the latest version of a session is kept. A background thread flushes
+    every ``interval`` seconds, or sooner once ``batch_size`` sessions are
+    pending, and once more at interpreter exit. Deletes are not buffered:
+    see SessionStore.delete().
+    """
+
+    def __init__(self, batch_size=500, interval=1.0):
+        self.batch_size = batch_size
+        self._writes = {}
+        self._lock = threading.Lock()
+        self.worker = PeriodicWorker(
+            self.flush,
+            interval,
+            "discourse-session-write-back",
+            "write sessions back",
+        )
+
+    def pending(self, session_key):
+        """Encoded data of a session not written back yet, or None."""
+        with self._lock:
+            entry = self._writes.get(session_key)
+        return entry and entry[0]
+
+    def write(self, session_key, session_data, expire_date):
+        with self._lock:
+            self._writes[session_key] = (session_data, expire_date)
+            full = len(self._writes) >= self.batch_size
+        self.worker.ensure_started()
+        if full:
+            self.worker.wake()
+
+    def discard(self, session_key):
+        """Forget a pending write of a session that is being deleted."""
+        with self._lock:
+            self._writes.pop(session_key, None)
+
+    def flush(self):
+        """Write all pending sessions with one upsert. Returns the count."""
+        from django.contrib.sessions.models import Session
+
+        with self._lock:
+            writes, self._writes = self._writes, {}
+        if not writes:
+            return 0
+        try:
+            Session.objects.bulk_create(
+                [
+                    Session(session_key=key, session_data=data, expire_date=expiry)
+                    for key, (data, expiry) in writes.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["session_key"],
+                update_fields=["session_data", "expire_date"],
+            )
+        except Exception:
+            # Put the batch back unless a newer version arrived meanwhile.
+            with self._lock:
+                for key, entry in writes.items():
+                    self._writes.setdefault(key, entry)
+            raise
+        return len(writes)
+
+
+write_back = SessionWriteBack(
+    batch_size=settings.DISCOURSE_SESSION_WRITE_BATCH_SIZE,
+    interval=settings.DISCOURSE_SESSION_WRITE_INTERVAL,
+)
+atexit.register(write_back.flush)
+
+
+class SessionStore(DBStore):
+    """Cache-first sessions with coalesced, batched database write-back."""
+
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        # What the stored copy holds, to skip saves that change nothing.
+        self._stored = None
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def _snapshot(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys. If this happens, reset the session. See #17810.
+            entry = None
+        if entry == DELETED:
+            return {}
+        if entry is not None:
+            data, expires = entry
+            self._stored = (self._snapshot(data), expires)
+            return data
+
+        pending = write_back.pending(self.session_key)
+        if pending is not None:
+            return self.decode(pending)
+        s = self._get_session_from_db()
+        if not s:
+            return {}
+        data = self.decode(s.session_data)
+        expires = s.expire_date.timestamp()
+        self._cache.set(
+            self.cache_key, (data, expires), self.get_expiry_age(expiry=s.expire_date)
+        )
+        self._stored = (self._snapshot(data), expires)
+        return data
+
+    def exists(self, session_key):
+        # Only used to pick a new key; save(must_create=True) uses cache.add(),
+        # which catches the (astronomically unlikely) collision atomically.
+        return (
+            bool(session_key) and (self.cache_key_prefix + session_key) in self._cache
+        )
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        age = self.get_expiry_age()
+        snapshot = self._snapshot(data)
+        if not must_create and self._stored is not None:
+            stored_snapshot, stored_expires = self._stored
+            # Unchanged and the stored expiry is still fresh: nothing to do.
+            if snapshot == stored_snapshot and stored_expires - time.time() > age * 0.9:
+                return
+
+        expire_date = timezone.now() + timezone.timedelta(seconds=age)
+        expires = time.time() + age
+        if must_create:
+            if not self._cache.add(self.cache_key, (data, expires), age):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, (data, expires), age)
+        write_back.write(self.session_key, self.encode(data), expire_date)
+        self._stored = (snapshot, expires)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        # The row goes at once and a marker stays in the shared cache: a
+        # logged-out session must not come back from a worker that still has
+        # an older version waiting to be written back.
+        write_back.discard(session_key)
+        self._cache.set(
+            self.cache_key_prefix + session_key,
+            DELETED,
+            settings.SESSION_COOKIE_AGE,
+        )
+        self.model.objects.filter(session_key=session_key).delete()
@@ -1,9 +1,14 @@
 # apps/discourse/signals.py
-from django.db.models.signals import post_save
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from apps.discourse.api import sync_user_with_discourse
+from . import invalidation
+from .groups import refresh_group_names
 from .models import DiscourseProfile
+from .profiles import provision_profiles
+from .syncqueue import user_sync
 
 User = get_user_model()
 
@@ -11,4 +16,72 @@ User = get_user_model()
 @receiver(post_save, sender=User)
 def sync_user_on_create_or_update(sender, instance, created, **kwargs):
     """Automatically sync new or updated users with Discourse."""
+    if created:
+        provision_profiles([instance])
     sync_user_with_discourse(instance)  # Sync after creation/update
+
+
+def resync_group_members(user_ids):
+    """
+    Refresh the denormalized group lists and queue only the users whose lists
+    actually changed for a background sync with Discourse (syncqueue.py), so
+    renaming a large group does not hold up the request.
+    """
+    changed = refresh_group_names(user_ids)
+    if changed:
+        user_sync.schedule(changed)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def update_groups_on_membership_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Keep DiscourseProfile.group_names in step with User.groups."""
+    if action == "pre_clear" and reverse:
+        # group.user_set.clear(): remember the members before they are gone.
+        instance._discourse_cleared_user_ids = list(
+            instance.user_set.values_list("id", flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == "post_clear":
+        user_ids = getattr(instance, "_discourse_cleared_user_ids", [])
+    else:
+        user_ids = pk_set or []
+    resync_group_members(user_ids)
+
+
+@receiver(post_save, sender=Group)
+def update_groups_on_rename(sender, instance, created, **kwargs):
+    """A renamed group changes the list of every member."""
+    if not created:
+        resync_group_members(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def remember_members_on_group_delete(sender, instance, **kwargs):
+    instance._discourse_deleted_user_ids = list(
+        instance.user_set.values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Group)
+def update_groups_on_delete(sender, instance, **kwargs):
+    resync_group_members(getattr(instance, "_discourse_deleted_user_ids", []))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the user from the "users" LocalCache of every worker."""
+    invalidation.publish(invalidation.USER_CACHE, instance.pk)
+
+
+@receiver(post_save, sender=DiscourseProfile)
+@receiver(post_delete, sender=DiscourseProfile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    invalidation.publish(invalidation.USER_CACHE, instance.user_id)
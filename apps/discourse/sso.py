@@ -1,14 +1,16 @@
 # apps/discourse/sso.py
 
 import base64
+import functools
 import hmac
 import hashlib
 import urllib.parse
 import logging
 from django.conf import settings
-from django.core.validators import URLValidator
-from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.http import HttpResponseBadRequest
+from .attributes import get_payload_serializer
 from .exceptions import SSOValidationError
 
 logger = logging.getLogger(__name__)
@@ -26,40 +28,38 @@ def decode_sso_payload(sso):
         raise SSOValidationError("Invalid payload encoding") from e
 
 
+@functools.lru_cache(maxsize=4)
+def _keyed_hmac(secret):
+    # The key schedule is computed once; every signature copies this state.
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+
+def sign_payload(data, secret=None):
+    """Return the hex HMAC-SHA256 of ``data`` (bytes) with the connect secret."""
+    mac = _keyed_hmac(secret or settings.DISCOURSE_CONNECT_SECRET).copy()
+    mac.update(data)
+    return mac.hexdigest()
+
+
 def verify_signature(sso, sig):
     """
     Verify that the provided HMAC-SHA256 signature matches the expected signature.
     Raises SSOValidationError if the signature is invalid.
     """
-    expected_sig = hmac.new(
-        settings.DISCOURSE_CONNECT_SECRET.encode(), sso.encode(), hashlib.sha256
-    ).hexdigest()
-
-    # Log comparison for debugging
-    logger.debug(f"Expected Signature:  %s", expected_sig)
-    logger.debug(f"Provided Signature: %s", sig)
-
-    if expected_sig != sig:
-        logger.error(
-            f"Expected Signature: %s, Provided Signature: %s", expected_sig, sig
-        )
-        raise SSOValidationError("Invalid signature")
+    expected_sig = sign_payload(sso.encode())
 
     if not hmac.compare_digest(expected_sig, sig):
+        # Never log the expected signature: it is a valid MAC for the payload.
+        logger.error("SSO signature mismatch")
         raise SSOValidationError("Invalid signature")
 
 
-def generate_sso_payload(user, nonce, return_url):  # pylint: disable=unused-argument
-    # Build a dictionary with the user data
-    payload_dict = {
-        "nonce": nonce,
-        "external_id": str(user.id),
-        "email": user.email,
-        "username": user.username,
-        # Add any additional fields as required, for example:
-        # "name": user.get_full_name(),
-        "name": f"{user.first_name} {user.last_name}".strip(),
-    }
+def generate_sso_params(user, nonce, return_url):  # pylint: disable=unused-argument
+    """Return the Base64 payload and its signature for the given user."""
+    # The parameters come from DISCOURSE_SSO_ATTRIBUTES (see attributes.py);
+    # users loaded with its queryset() need no further queries here.
+    payload_dict = {"nonce": nonce}
+    payload_dict.update(get_payload_serializer().serialize(user))
     # query_string = urllib.parse.urlencode(payload)
     # return base64.b64encode(query_string.encode()).decode()
     # Convert the dictionary into a URL-encoded query string
@@ -67,17 +67,19 @@ def generate_sso_payload(user, nonce, return_url):  # pylint: disable=unused-arg
     # Base64 encode the payload
     b64_payload = base64.b64encode(payload.encode("utf-8")).decode("utf-8")
     # Generate a signature using your shared secret
-    sig = hmac.new(
-        settings.DISCOURSE_CONNECT_SECRET.encode("utf-8"),
-        b64_payload.encode("utf-8"),
-        hashlib.sha256,
-    ).hexdigest()
+    sig = sign_payload(b64_payload.encode("utf-8"))
+    return b64_payload, sig
 
+
+def generate_sso_payload(user, nonce, return_url):
+    b64_payload, sig = generate_sso_params(user, nonce, return_url)
     # Return a payload in the form "sso=…&sig=…"
     return f"sso={urllib.parse.quote(b64_payload)}&sig={sig}"
 
 
 def build_redirect_url(return_sso_url, payload):
+    # Only ever redirect to an allowlisted return URL (cached, so cheap).
+    validate_return_url(return_sso_url)
     # Make sure return_sso_url is absolute
     parsed = urllib.parse.urlparse(return_sso_url)
     if parsed.scheme not in ["http", "https"]:
@@ -100,17 +102,97 @@ def fix_base64_padding(encoded_str):
     return encoded_str
 
 
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _split_origin(parsed):
+    """Return (scheme, host, port) for a parsed URL, with the default port filled in."""
+    scheme = parsed.scheme.lower()
+    return scheme, (parsed.hostname or ""), parsed.port or DEFAULT_PORTS.get(scheme)
+
+
+class ReturnUrlMatcher:
+    """
+    Matches return_sso_url values against the configured allowlist.
+
+    Entries look like ``https://forum.example.com/session/`` (scheme, host,
+    optional port and path prefix); a host of ``*.example.com`` also matches
+    subdomains. Entries are compiled into a dict keyed by origin, so a check is
+    one urlsplit, one dict lookup and a few ``startswith`` calls.
+    """
+
+    def __init__(self, entries):
+        self.origins = {}
+        self.wildcards = []
+        for entry in entries:
+            parsed = urllib.parse.urlsplit(entry)
+            scheme, host, port = _split_origin(parsed)
+            prefix = parsed.path or "/"
+            if host.startswith("*."):
+                self.wildcards.append((scheme, host[1:], port, prefix))
+            else:
+                self.origins.setdefault((scheme, host, port), []).append(prefix)
+        self.origins = {key: tuple(value) for key, value in self.origins.items()}
+
+    def __call__(self, url):
+        if not url or any(c in url for c in "\\\r\n\t "):
+            return False
+        try:
+            parsed = urllib.parse.urlsplit(url)
+            origin = _split_origin(parsed)
+        except ValueError:
+            return False
+        if origin[0] not in DEFAULT_PORTS or "@" in parsed.netloc:
+            return False
+        path = parsed.path or "/"
+        if "/../" in path + "/" or "/./" in path + "/":
+            return False
+
+        prefixes = self.origins.get(origin)
+        if prefixes and path.startswith(prefixes):
+            return True
+        scheme, host, port = origin
+        return any(
+            scheme == w_scheme
+            and port == w_port
+            and host.endswith(suffix)
+            and path.startswith(prefix)
+            for w_scheme, suffix, w_port, prefix in self.wildcards
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_return_url_matcher():
+    """
+    Compile DISCOURSE_SSO_RETURN_ALLOWLIST once per process. When it is empty,
+    only the forum itself (DISCOURSE_INSTANCE_URL) is allowed.
+    """
+    entries = settings.DISCOURSE_SSO_RETURN_ALLOWLIST or [
+        settings.DISCOURSE_INSTANCE_URL
+    ]
+    return ReturnUrlMatcher(entries)
+
+
+@functools.lru_cache(maxsize=1024)
+def is_allowed_return_url(url):
+    """Cached allowlist check; Discourse sends the same few return URLs."""
+    return get_return_url_matcher()(url)
+
+
+@receiver(setting_changed)
+def _reset_return_url_caches(setting, **kwargs):
+    if setting in ("DISCOURSE_SSO_RETURN_ALLOWLIST", "DISCOURSE_INSTANCE_URL"):
+        get_return_url_matcher.cache_clear()
+        is_allowed_return_url.cache_clear()
+
+
 def validate_return_url(url):
     """
-    Validate that the return_sso_url in the payload is a properly formatted URL.
+    Validate that the return_sso_url in the payload is on the allowlist.
     Raises SSOValidationError if validation fails.
     """
-    logger.debug(f"Validating return URL: %s", url)  # Log the URL being processed
-
-    validator = URLValidator(schemes=["http", "https"])
-    try:
-        validator(url)
-    except ValidationError:
+    if not is_allowed_return_url(url):
+        logger.error("Rejected return_sso_url not on the allowlist: %s", url)
         raise SSOValidationError("Invalid return_sso_url")
 
     return url
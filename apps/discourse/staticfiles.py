@@ -0,0 +1,151 @@
+# apps/discourse/staticfiles.py
+"""
+Fingerprinted, precompressed static files.
+
+PrecompressedManifestStaticFilesStorage writes ``name.<hash>.ext`` copies
+at collectstatic time (ManifestStaticFilesStorage) and next to every text
+asset a ``.gz`` and a ``.br`` variant. serve_static() hands out the best
+variant the browser accepts; fingerprinted names never change content, so
+they are cached for a year.
+"""
+
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+import brotli
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".html", ".txt", ".json", ".map")
+# Best first: (Accept-Encoding token, file suffix).
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# ManifestStaticFilesStorage inserts the first 12 hex digits of the MD5.
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{12}\.[^/.]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def compress(data):
+    """``{suffix: bytes}`` of the variants worth storing for ``data``."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    variants[".br"] = brotli.compress(data, quality=11)
+    return {suffix: blob for suffix, blob in variants.items() if len(blob) < len(data)}
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes .gz/.br variants."""
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        if kwargs.get("dry_run"):
+            return
+        # Both the original and the fingerprinted copy are served.
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                yield from self._write_variants(name)
+
+    def _write_variants(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < settings.DISCOURSE_STATIC_COMPRESS_MIN_SIZE:
+            return
+        for suffix, blob in compress(data).items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(blob))
+            yield name, name + suffix, True
+
+
+def _resolve(path):
+    """Absolute file path of a static file, or None."""
+    path = posixpath.normpath(path).lstrip("/")
+    if settings.STATIC_ROOT:
+        try:
+            full_path = safe_join(settings.STATIC_ROOT, path)
+        except SuspiciousFileOperation:
+            return None
+        if os.path.isfile(full_path):
+            return full_path
+    if settings.DEBUG:
+        # Not collected yet: fall back to the app and STATICFILES_DIRS copies.
+        return finders.find(path)
+    return None
+
+
+def _quality(params):
+    """The q value of an Accept-Encoding entry's parameters (1 if absent)."""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def _accepted(request):
+    """Content codings the request accepts, i.e. not with ``q=0``."""
+    accepted = set()
+    for entry in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, *params = entry.split(";")
+        if coding.strip() and _quality(params) > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@require_safe
+def serve_static(request, path):
+    """
+    Serve a collected static file, precompressed if the client accepts it.
+    Fingerprinted names get far-future immutable caching; others are
+    revalidated after DISCOURSE_STATIC_MAX_AGE seconds.
+    """
+    full_path = _resolve(path)
+    if full_path is None:
+        raise Http404(path)
+
+    accepted = _accepted(request)
+    served, encoding = full_path, None
+    for token, suffix in ENCODINGS:
+        if token in accepted and os.path.isfile(full_path + suffix):
+            served, encoding = full_path + suffix, token
+            break
+
+    stat = os.stat(served)
+    if not was_modified_since(
+        request.META.get("HTTP_IF_MODIFIED_SINCE"), int(stat.st_mtime)
+    ):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(full_path)
+        # FileResponse closes the file once it has been sent.
+        stream = open(served, "rb")  # pylint: disable=consider-using-with
+        response = FileResponse(
+            stream,
+            content_type=content_type or "application/octet-stream",
+            filename=os.path.basename(full_path),
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Vary"] = "Accept-Encoding"
+    if _FINGERPRINT.search(path):
+        response["Cache-Control"] = IMMUTABLE
+    else:
+        response["Cache-Control"] = (
+            f"public, max-age={settings.DISCOURSE_STATIC_MAX_AGE}"
+        )
+    return response
@@ -0,0 +1,103 @@
+# apps/discourse/syncqueue.py
+"""
+Durable queue of users to push to Discourse.
+
+Pushing a user is one sync_sso request paced by the background budget of the
+API governor, so syncing the members of a renamed group or a bulk import can
+take hours. schedule() only stores the user ids in the PendingUserSync table,
+in the caller's transaction, and returns. A background thread in every web
+process claims up to ``batch_size`` of them at a time and syncs them with
+sync_users_with_discourse(). A claim older than ``claim_timeout`` seconds
+belongs to a process that died, and is taken over.
+
+The thread starts with the first request a process serves, so users queued
+by management commands are synced by the web workers.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .api import sync_users_with_discourse
+from .models import PendingUserSync
+from .workers import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+
+class UserSyncQueue:
+    """Schedules users for a Discourse sync and syncs them in the background."""
+
+    def __init__(self, batch_size=100, interval=5.0, claim_timeout=3600, workers=4):
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        self.workers = workers
+        self.worker = PeriodicWorker(
+            self.drain, interval, "discourse-user-sync", "sync queued users"
+        )
+
+    def schedule(self, user_ids, chunk_size=5000):
+        """Queue ``user_ids`` for a sync; users already queued are synced once."""
+        # One upsert may not touch a row twice.
+        user_ids = list(dict.fromkeys(user_ids))
+        now = timezone.now()
+        for start in range(0, len(user_ids), chunk_size):
+            PendingUserSync.objects.bulk_create(
+                [
+                    PendingUserSync(user_id=user_id, queued_at=now)
+                    for user_id in user_ids[start : start + chunk_size]
+                ],
+                update_conflicts=True,
+                unique_fields=["user"],
+                update_fields=["queued_at", "claimed_at"],
+            )
+        transaction.on_commit(self.worker.wake)
+
+    def _claim(self):
+        """Claim the next batch. Returns (user ids, claim time)."""
+        now = timezone.now()
+        stale = now - timezone.timedelta(seconds=self.claim_timeout)
+        with transaction.atomic():
+            user_ids = list(
+                PendingUserSync.objects.select_for_update(skip_locked=True)
+                .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale))
+                .order_by("queued_at")
+                .values_list("user_id", flat=True)[: self.batch_size]
+            )
+            PendingUserSync.objects.filter(user_id__in=user_ids).update(claimed_at=now)
+        return user_ids, now
+
+    def drain(self):
+        """Sync queued users until none are left. Returns the number synced."""
+        total = 0
+        while True:
+            user_ids, claimed_at = self._claim()
+            if not user_ids:
+                return total
+            synced = sync_users_with_discourse(user_ids, workers=self.workers)
+            # Users queued again while we were syncing them stay queued.
+            PendingUserSync.objects.filter(
+                user_id__in=user_ids, queued_at__lte=claimed_at
+            ).delete()
+            logger.info(
+                "Synced %d of %d queued users with Discourse", synced, len(user_ids)
+            )
+            total += synced
+
+
+user_sync = UserSyncQueue(
+    batch_size=settings.DISCOURSE_USER_SYNC_BATCH_SIZE,
+    interval=settings.DISCOURSE_USER_SYNC_INTERVAL,
+    claim_timeout=settings.DISCOURSE_USER_SYNC_CLAIM_TIMEOUT,
+    workers=settings.DISCOURSE_USER_SYNC_WORKERS,
+)
+
+
+@receiver(request_started)
+def _start_user_sync(**kwargs):
+    user_sync.worker.ensure_started()
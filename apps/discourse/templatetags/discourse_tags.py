@@ -0,0 +1,110 @@
+# apps/discourse/templatetags/discourse_tags.py
+
+import re
+import secrets
+
+from django import template
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import SafeString
+
+from apps.discourse.usercards import get_user_cards
+
+register = template.Library()
+
+# Kept on the context (not render_context) so included templates see it too.
+_PENDING_KEY = "_discourse_user_cards"
+
+
+def card_html(username, card):
+    """A user card, or just the username while the card is not cached yet."""
+    if not card:
+        return format_html('<span class="discourse-user-card">{}</span>', username)
+    avatar = ""
+    if card.get("avatar_url"):
+        avatar = format_html(
+            '<img src="{}" alt="" width="24" height="24">', card["avatar_url"]
+        )
+    return format_html(
+        '<a class="discourse-user-card" href="{}" title="{}">{} {} '
+        "<small>TL{} &middot; {} posts</small></a>",
+        card["profile_url"],
+        card.get("name") or card["username"],
+        avatar,
+        card["username"],
+        card.get("trust_level"),
+        card.get("post_count") or 0,
+    )
+
+
+class UserCardsNode(template.Node):
+    """
+    Renders its body once, with a placeholder for every
+    ``{% discourse_user_card %}`` inside it, then looks all collected usernames
+    up with one get_user_cards() call and puts the cards in place of the
+    placeholders.
+    """
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        pending = {"marker": secrets.token_hex(8), "names": []}
+        with context.push({_PENDING_KEY: pending}):
+            output = self.nodelist.render(context)
+        if not pending["names"]:
+            return output
+
+        names = pending["names"]
+        cards = get_user_cards(names)
+        rendered = {}
+        for username in names:
+            if username not in rendered:
+                rendered[username] = card_html(username, cards.get(username))
+        # split() alternates pieces of the body's output with the index of the
+        # card between them. The pieces are slices of the nodelist's SafeString
+        # (slicing drops the type, not the escaping); only the cards are new
+        # markup, and format_html() built those.
+        parts = re.split(rf"<!--{pending['marker']}:(\d+)-->", output)
+        pieces = [SafeString(text) for text in parts[::2]]
+        between = [rendered[names[int(index)]] for index in parts[1::2]] + [""]
+        return format_html_join("", "{}{}", zip(pieces, between))
+
+
+class UserCardNode(template.Node):
+    def __init__(self, username):
+        self.username = username
+
+    def render(self, context):
+        username = str(self.username.resolve(context) or "")
+        pending = context.get(_PENDING_KEY)
+        if pending is None:
+            # Used outside {% discourse_user_cards %}: a lookup of its own.
+            return card_html(username, get_user_cards([username]).get(username))
+        pending["names"].append(username)
+        return format_html("<!--{}:{}-->", pending["marker"], len(pending["names"]) - 1)
+
+
+@register.tag
+def discourse_user_cards(parser, token):
+    """
+    Batch every user card in the block into one lookup::
+
+        {% discourse_user_cards %}
+          {% for user in users %}{% discourse_user_card user.username %}{% endfor %}
+        {% end_discourse_user_cards %}
+    """
+    nodelist = parser.parse(("end_discourse_user_cards",))
+    parser.delete_first_token()
+    return UserCardsNode(nodelist)
+
+
+@register.tag
+def discourse_user_card(parser, token):
+    """Forum avatar, trust level and post count for a username."""
+    try:
+        _, username = token.split_contents()
+    except ValueError:
+        raise template.TemplateSyntaxError(
+            "discourse_user_card takes exactly one argument (a username)"
+        ) from None
+    return UserCardNode(parser.compile_filter(username))
@@ -1,19 +1,100 @@
 # apps/discourse/tests.py
 import base64
+import collections
+import csv
+import datetime
+import gzip
 import hashlib
 import hmac
-import urllib.parse
+import io
+import json
 import logging
-from unittest.mock import patch, MagicMock
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
 
+import brotli
+import requests
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from django.test import TestCase, Client, override_settings
+from django.contrib import admin
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db.models import Count
+from django.http import Http404
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
-from apps.discourse.models import DiscourseProfile, SsoEventLog
-from apps.discourse.api import sync_user_with_discourse, fetch_discourse_data
+from apps.discourse import (
+    hashing,
+    invalidation,
+    profiling,
+    tracing,
+    usercards,
+    webhooks,
+)
+from apps.discourse.api import (
+    fetch_discourse_data,
+    iter_discourse_pages,
+    post_sync_sso,
+    sync_user_with_discourse,
+)
+from apps.discourse.attributes import SSOPayloadSerializer
+from apps.discourse.audit import audit_signatures
+from apps.discourse.backends import DiscourseModelBackend
+from apps.discourse.budgets import (
+    BudgetAssertionsMixin,
+    BudgetExceeded,
+    budget,
+    enforce_budgets,
+)
+from apps.discourse.checks import check_governor_cache
+from apps.discourse.context_processors import discourse_forum_url
+from apps.discourse.eventlog import pack_details, unpack_details
 from apps.discourse.exceptions import SSOValidationError
+from apps.discourse.governor import (
+    BACKGROUND,
+    DiscourseRateLimited,
+    RateGovernor,
+    parse_retry_after,
+)
+from apps.discourse.handshake import parse_sso_request
+from apps.discourse.hashing import PasswordHashPool, PasswordHashPoolSaturated
+from apps.discourse.imports import import_users
+from apps.discourse.log import AsyncQueueHandler, SamplingFilter, redact
+from apps.discourse.mmapcache import MmapCache
+from apps.discourse.models import (
+    DiscourseProfile,
+    PendingUserSync,
+    PendingWebhookEvent,
+    SsoEventLog,
+    SsoEventRollup,
+)
+from apps.discourse.profiles import SyncStatusRecorder, provision_profiles, sync_status
+from apps.discourse.rollups import update_rollups
+from apps.discourse.sessions import SessionStore, SessionWriteBack, write_back
+from apps.discourse.sso import (
+    ReturnUrlMatcher,
+    decode_sso_payload,
+    generate_sso_params,
+    generate_sso_payload,
+    sign_payload,
+    validate_return_url,
+)
+from apps.discourse.staticfiles import serve_static
+from apps.discourse.syncqueue import UserSyncQueue, user_sync
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -52,6 +133,7 @@ class DiscourseModelsTestCase(TestCase):
 # ----------------------------
 
 
+@override_settings(DISCOURSE_SSO_RETURN_ALLOWLIST=["http://dummy.com"])
 class DiscourseSSOViewsTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -131,7 +213,6 @@ class DiscourseAPITestCase(TestCase):
 # ----------------------------
 # (Optional) Context Processor Test
 # ----------------------------
-from apps.discourse.context_processors import discourse_forum_url
 
 
 class ContextProcessorTestCase(TestCase):
@@ -140,3 +221,1674 @@ class ContextProcessorTestCase(TestCase):
         context = discourse_forum_url(fake_request)
         self.assertIn("forum_url", context)
         self.assertEqual(context["forum_url"], settings.DISCOURSE_INSTANCE_URL)
+
+
+# ----------------------------
+# Webhook Tests
+# ----------------------------
+
+
+@override_settings(DISCOURSE_WEBHOOK_SECRET="webhook-secret")
+class DiscourseWebhookTestCase(TestCase):
+    def setUp(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            self.user = User.objects.create_user(
+                username="hookuser", password="secret", email="old@example.com"
+            )
+        self.profile = DiscourseProfile.objects.get(user=self.user)
+        # Drain by hand instead of on a background thread.
+        patcher = patch.object(webhooks.batcher.worker, "ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sign(self, body):
+        digest = hmac.new(b"webhook-secret", body, hashlib.sha256).hexdigest()
+        return f"sha256={digest}"
+
+    def build_event(self, event_id, **fields):
+        fields.setdefault("external_id", str(self.user.id))
+        body = json.dumps({"user": fields}).encode()
+        return webhooks.parse_webhook_event("user_updated", event_id, body)
+
+    @patch("apps.discourse.webhooks.batcher.enqueue", return_value=True)
+    def test_webhook_valid_signature_is_queued(self, mock_enqueue):
+        body = json.dumps(
+            {"user": {"external_id": str(self.user.id), "username": "renamed"}}
+        ).encode()
+        response = self.client.post(
+            reverse("discourse:discourse_webhooks"),
+            data=body,
+            content_type="application/json",
+            HTTP_X_DISCOURSE_EVENT="user_updated",
+            HTTP_X_DISCOURSE_EVENT_SIGNATURE=self.sign(body),
+        )
+        self.assertEqual(response.status_code, 202)
+        event = mock_enqueue.call_args[0][0]
+        self.assertEqual(event.fields, {"username": "renamed"})
+
+    @patch("apps.discourse.webhooks.batcher.enqueue")
+    def test_webhook_invalid_signature_is_rejected(self, mock_enqueue):
+        response = self.client.post(
+            reverse("discourse:discourse_webhooks"),
+            data=b"{}",
+            content_type="application/json",
+            HTTP_X_DISCOURSE_EVENT_SIGNATURE="sha256=bad",
+        )
+        self.assertEqual(response.status_code, 403)
+        mock_enqueue.assert_not_called()
+
+    def test_apply_webhook_events_deduplicates_batch(self):
+        events = [
+            self.build_event("1", username="first", email="new@example.com"),
+            self.build_event("2", username="second"),
+            self.build_event("3", suspended_till="2030-06-01T00:00:00Z"),
+        ]
+        with self.assertNumQueries(6):
+            # SAVEPOINT, SELECT profiles, SELECT users, UPDATE users,
+            # UPDATE profiles, RELEASE SAVEPOINT
+            webhooks.apply_webhook_events(events)
+
+        self.profile.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.profile.username, "second")
+        self.assertEqual(self.profile.email, "new@example.com")
+        self.assertEqual(self.profile.suspended_till.year, 2030)
+        self.assertEqual(self.user.email, "new@example.com")
+
+    def test_accepted_events_are_stored_until_applied(self):
+        user_cache = invalidation.local_cache(invalidation.USER_CACHE)
+        self.addCleanup(user_cache.clear)
+        user_cache.set(self.user.id, "stale")
+        self.assertTrue(webhooks.batcher.enqueue(self.build_event("1", username="a")))
+        self.assertTrue(webhooks.batcher.enqueue(self.build_event("2", username="b")))
+        self.assertEqual(PendingWebhookEvent.objects.count(), 2)
+
+        self.assertEqual(webhooks.batcher.drain(), 2)
+        self.assertFalse(PendingWebhookEvent.objects.exists())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.username, "b")
+        # bulk_update sends no post_save; the cached user is dropped anyway.
+        self.assertIsNone(user_cache.get(self.user.id))
+
+    def test_failed_events_are_retried_then_parked(self):
+        webhooks.batcher.enqueue(self.build_event("1", username="a"))
+        with patch(
+            "apps.discourse.webhooks.apply_webhook_events", side_effect=ValueError
+        ):
+            for _ in range(webhooks.batcher.max_attempts):
+                self.assertEqual(webhooks.batcher.drain(), 0)
+        event = PendingWebhookEvent.objects.get()
+        self.assertEqual(event.attempts, webhooks.batcher.max_attempts)
+        self.assertEqual(webhooks.batcher.drain(), 0)
+
+
+# ----------------------------
+# Export Tests
+# ----------------------------
+
+
+class SsoEventExportTestCase(TestCase):
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = User.objects.create_user(
+            username="auditor", password="secret", is_staff=True
+        )
+        self.other = User.objects.create_user(username="other", password="secret")
+        SsoEventLog.objects.create(user=self.staff, event_type="login", signature="a")
+        SsoEventLog.objects.create(user=self.other, event_type="error", signature="b")
+        SsoEventLog.objects.create(user=self.other, event_type="login", signature="c")
+
+    def export(self, **params):
+        self.client.login(username="auditor", password="secret")
+        response = self.client.get(reverse("discourse:sso_event_export"), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_export_requires_staff(self):
+        self.client.login(username="other", password="secret")
+        response = self.client.get(reverse("discourse:sso_event_export"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_ndjson_filters_by_user_and_event_type(self):
+        body = self.export(user="other", event_type="login")
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["username"], "other")
+        self.assertEqual(records[0]["signature"], "c")
+
+    def test_export_csv_gzip(self):
+        body = gzip.decompress(self.export(format="csv", gzip="1"))
+        lines = body.decode().splitlines()
+        self.assertTrue(lines[0].startswith("id,created_at,event_type"))
+        self.assertEqual(len(lines), 4)
+
+    def test_export_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.ndjson")
+            call_command("export_sso_events", "--event-type", "login", "-o", path)
+            with open(path, encoding="utf-8") as output:
+                self.assertEqual(len(output.readlines()), 2)
+
+
+# ----------------------------
+# Rollup Tests
+# ----------------------------
+
+
+class SsoEventRollupTestCase(TestCase):
+    def setUp(self):
+        self.base = datetime.datetime(2025, 1, 1, 10, 15)
+        self.now = self.base + datetime.timedelta(days=1)
+
+    def log_events(self, event_type, count, at):
+        events = SsoEventLog.objects.bulk_create(
+            [SsoEventLog(event_type=event_type) for _ in range(count)]
+        )
+        # created_at is auto_now_add; backdate the rows explicitly.
+        SsoEventLog.objects.filter(id__in=[e.id for e in events]).update(created_at=at)
+
+    def count(self, period, event_type):
+        return SsoEventRollup.objects.get(period=period, event_type=event_type).count
+
+    def test_rollups_are_incremental(self):
+        self.log_events("login", 3, self.base)
+        self.log_events("error", 1, self.base)
+        self.assertEqual(update_rollups(now=self.now), 4)
+        self.assertEqual(self.count("hour", "login"), 3)
+        self.assertEqual(self.count("day", "error"), 1)
+
+        # Only rows above the high-water mark are aggregated on the next run.
+        self.log_events("login", 2, self.base + datetime.timedelta(minutes=5))
+        self.assertEqual(update_rollups(now=self.now), 2)
+        self.assertEqual(update_rollups(now=self.now), 0)
+        self.assertEqual(self.count("hour", "login"), 5)
+        self.assertEqual(self.count("day", "login"), 5)
+
+    def test_rollups_respect_batch_size(self):
+        self.log_events("sync", 5, self.base)
+        self.assertEqual(update_rollups(batch_size=2, now=self.now), 2)
+        self.assertEqual(update_rollups(batch_size=10, now=self.now), 3)
+        self.assertEqual(self.count("day", "sync"), 5)
+
+    def test_mark_stops_before_unsettled_events(self):
+        self.log_events("login", 1, self.base)
+        # A clock running ahead dates this event after the settle cutoff.
+        self.log_events("error", 1, self.now)
+        self.log_events("login", 2, self.base)
+        self.assertEqual(update_rollups(now=self.now), 1)
+        self.assertEqual(update_rollups(now=self.now), 0)
+        # Once it settles, it is counted together with the rows behind it.
+        later = self.now + datetime.timedelta(minutes=5)
+        self.assertEqual(update_rollups(now=later), 3)
+        self.assertEqual(self.count("day", "login"), 3)
+        self.assertEqual(self.count("day", "error"), 1)
+
+    def test_dashboard_reads_rollups(self):
+        SsoEventRollup.objects.create(
+            period="hour", bucket=datetime.datetime.now(), event_type="login", count=7
+        )
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            admin_user = User.objects.create_superuser("boss", "b@example.com", "pw")
+            self.client.force_login(admin_user)
+            response = self.client.get(
+                reverse("admin:discourse_ssoeventrollup_changelist")
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Last 48 hours")
+        self.assertEqual(response.context["hourly"][0][1][0], 7)
+
+
+# ----------------------------
+# Logging Tests
+# ----------------------------
+
+
+class DiscourseLoggingTestCase(TestCase):
+    def test_redact_query_string_and_mapping(self):
+        message = redact("url=https://f/?sso=abc%3D&sig=123 params={'sig': ['456']}")
+        self.assertNotIn("abc", message)
+        self.assertNotIn("123", message)
+        self.assertNotIn("456", message)
+        self.assertIn("sso=[redacted]", message)
+
+    def test_sampling_filter_keeps_errors(self):
+        sampler = SamplingFilter(rate=0.0)
+        info = logging.LogRecord("x", logging.INFO, __file__, 1, "ok", None, None)
+        error = logging.LogRecord("x", logging.ERROR, __file__, 1, "bad", None, None)
+        self.assertFalse(sampler.filter(info))
+        self.assertTrue(sampler.filter(error))
+
+    def test_async_handler_writes_on_listener_thread(self):
+        stream = io.StringIO()
+        handler = AsyncQueueHandler(stream=stream)
+        test_logger = logging.getLogger("apps.discourse.tests.async")
+        test_logger.addHandler(handler)
+        test_logger.propagate = False
+        try:
+            test_logger.error("Invalid signature for sig=%s", "deadbeef")
+        finally:
+            test_logger.removeHandler(handler)
+            handler.close()  # Stops the listener after draining the queue.
+        self.assertEqual(stream.getvalue(), "Invalid signature for sig=[redacted]\n")
+
+
+# ----------------------------
+# Return URL Allowlist Tests
+# ----------------------------
+
+
+class ReturnUrlAllowlistTestCase(TestCase):
+    def test_matcher_hosts_paths_and_wildcards(self):
+        matcher = ReturnUrlMatcher(
+            ["https://forum.example.com/session/", "https://*.example.org"]
+        )
+        self.assertTrue(matcher("https://forum.example.com/session/sso_login"))
+        self.assertTrue(matcher("https://forum.example.com:443/session/sso_login"))
+        self.assertTrue(matcher("https://a.b.example.org/anything"))
+        self.assertFalse(matcher("http://forum.example.com/session/sso_login"))
+        self.assertFalse(matcher("https://forum.example.com/admin/"))
+        self.assertFalse(matcher("https://forum.example.com/session/../admin"))
+        self.assertFalse(matcher("https://evil.com@forum.example.com/session/"))
+        self.assertFalse(matcher("https://forum.example.com.evil.com/session/"))
+        self.assertFalse(matcher("javascript:alert(1)"))
+
+    @override_settings(
+        DISCOURSE_SSO_RETURN_ALLOWLIST=[],
+        DISCOURSE_INSTANCE_URL="https://forum.example.com",
+    )
+    def test_defaults_to_instance_url(self):
+        url = "https://forum.example.com/session/sso_login"
+        self.assertEqual(validate_return_url(url), url)
+        with self.assertRaises(SSOValidationError):
+            validate_return_url("https://elsewhere.example.com/session/sso_login")
+
+    @override_settings(DISCOURSE_SSO_RETURN_ALLOWLIST=["https://forum.example.com"])
+    def test_provider_rejects_unlisted_return_url(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            user = User.objects.create_user(username="listed", password="secret")
+            self.client.force_login(user)
+        payload = base64.b64encode(
+            b"nonce=abc&return_sso_url=https%3A%2F%2Fevil.example.com%2F"
+        ).decode()
+        sig = hmac.new(
+            settings.DISCOURSE_CONNECT_SECRET.encode(),
+            payload.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+        response = self.client.get(
+            reverse("discourse:discourse_sso_provider"),
+            data={"sso": payload, "sig": sig},
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+# ----------------------------
+# Group Sync Tests
+# ----------------------------
+
+
+class DiscourseGroupSyncTestCase(TestCase):
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = Group.objects.create(name="staff")
+        self.writers = Group.objects.create(name="writers")
+        self.alice = User.objects.create_user(username="alice", password="secret")
+        self.bob = User.objects.create_user(username="bob", password="secret")
+
+    def profile(self, user):
+        return DiscourseProfile.objects.get(user=user)
+
+    def queued(self):
+        return sorted(PendingUserSync.objects.values_list("user_id", flat=True))
+
+    def test_membership_changes_update_profile_and_resync(self):
+        self.alice.groups.add(self.staff, self.writers)
+        self.assertEqual(self.profile(self.alice).group_names, ["staff", "writers"])
+        self.assertEqual(self.queued(), [self.alice.id])
+
+        self.alice.groups.remove(self.writers)
+        profile = self.profile(self.alice)
+        self.assertEqual(profile.group_names, ["staff"])
+        self.assertEqual(profile.removed_group_names, ["writers"])
+
+    def test_group_edit_resyncs_only_members(self):
+        self.staff.user_set.add(self.bob)
+        PendingUserSync.objects.all().delete()
+        self.staff.name = "moderators"
+        self.staff.save()
+        self.assertEqual(self.queued(), [self.bob.id])
+        self.assertEqual(self.profile(self.bob).group_names, ["moderators"])
+        self.assertEqual(self.profile(self.alice).group_names, [])
+
+    def test_payload_includes_groups_without_queries(self):
+        self.alice.groups.add(self.staff)
+        self.bob.groups.add(self.staff)
+        self.bob.groups.remove(self.staff)
+        for user in (self.alice, self.bob):
+            loaded = User.objects.select_related("discourse_profile").get(pk=user.pk)
+            with self.assertNumQueries(0):
+                sso = generate_sso_payload(loaded, "n", "https://forum.example.com")
+            encoded = urllib.parse.unquote(sso.split("&")[0][len("sso=") :])
+            payload = decode_sso_payload(encoded)
+            if user is self.alice:
+                self.assertEqual(payload["add_groups"], "staff")
+            else:
+                self.assertEqual(payload["remove_groups"], "staff")
+                self.assertNotIn("add_groups", payload)
+
+    @patch("apps.discourse.api.post_sync_sso")
+    def test_successful_sync_prunes_removed_groups(self, mock_post):
+
+        mock_post.return_value = MagicMock(status_code=200)
+        self.alice.groups.add(self.staff, self.writers)
+        self.alice.groups.remove(self.staff)
+        user = User.objects.select_related("discourse_profile").get(pk=self.alice.pk)
+        with patch.object(sync_status.worker, "ensure_started"):
+            sync_user_with_discourse(user)
+        # Left after the payload was built: still to be sent.
+        self.alice.groups.remove(self.writers)
+        sync_status.flush()
+        self.assertEqual(self.profile(self.alice).removed_group_names, ["writers"])
+
+    def test_queued_users_are_synced_in_the_background(self):
+        queue = UserSyncQueue(batch_size=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            queue.schedule([self.alice.id, self.bob.id, self.alice.id])
+        self.assertEqual(self.queued(), sorted([self.alice.id, self.bob.id]))
+
+        synced = []
+
+        def sync(user_ids, workers):
+            synced.append(user_ids)
+            if synced.count([self.alice.id]) == 1 and self.alice.id in user_ids:
+                # Changed again while syncing: must be synced once more.
+                queue.schedule([self.alice.id])
+            return len(user_ids)
+
+        with patch("apps.discourse.syncqueue.sync_users_with_discourse", sync):
+            self.assertEqual(queue.drain(), 3)
+        self.assertEqual(sorted(synced), [[self.alice.id]] * 2 + [[self.bob.id]])
+        self.assertEqual(self.queued(), [])
+
+    def test_group_names_with_commas_are_not_synced(self):
+        odd = Group.objects.create(name="staff,admins")
+        with self.assertLogs("apps.discourse.groups", "WARNING"):
+            self.alice.groups.add(self.staff, odd)
+        self.assertEqual(self.profile(self.alice).group_names, ["staff"])
+
+
+# ----------------------------
+# Handshake Engine Tests
+# ----------------------------
+
+
+@override_settings(DISCOURSE_SSO_RETURN_ALLOWLIST=["https://forum.example.com"])
+class SSOHandshakeTestCase(TestCase):
+    def encode(self, query, strip_padding=False):
+        sso = base64.b64encode(query.encode()).decode()
+        if strip_padding:
+            sso = sso.rstrip("=")
+        return sso, sign_payload(sso.encode())
+
+    def test_parses_values_containing_equals(self):
+        sso, sig = self.encode(
+            urllib.parse.urlencode(
+                {
+                    "nonce": "abc==",
+                    "return_sso_url": "https://forum.example.com/session/sso_login?a=b",
+                }
+            ),
+            strip_padding=True,
+        )
+        request = parse_sso_request(sso, sig)
+        self.assertEqual(request.nonce, "abc==")
+        self.assertTrue(request.return_sso_url.endswith("?a=b"))
+
+    def test_accepts_newline_wrapped_payload(self):
+        # Ruby's Base64.encode64 wraps lines; the signature covers the newlines.
+        sso = base64.encodebytes(
+            b"nonce=1&return_sso_url=https%3A%2F%2Fforum.example.com%2F&pad=xxxxxxxxxx"
+            b"xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+        ).decode()
+        self.assertIn("\n", sso)
+        request = parse_sso_request(sso, sign_payload(sso.encode()))
+        self.assertEqual(request.nonce, "1")
+
+    def test_rejects_bad_signature_and_missing_fields(self):
+        sso, sig = self.encode("nonce=1&return_sso_url=https%3A%2F%2Fforum.example.com")
+        for bad_sig in ("bad_signature", "é" * 64, sig[:-1] + "0"):
+            with self.assertRaises(SSOValidationError):
+                parse_sso_request(sso, bad_sig)
+        sso, sig = self.encode("return_sso_url=https%3A%2F%2Fforum.example.com")
+        with self.assertRaises(SSOValidationError):
+            parse_sso_request(sso, sig)
+
+
+# ----------------------------
+# Rate Governor Tests
+# ----------------------------
+
+
+class RateGovernorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.governor = RateGovernor(requests_per_second=10, max_window=8)
+
+    def response(self, status, retry_after=None):
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        return MagicMock(status_code=status, headers=headers)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("7"), 7.0)
+        self.assertEqual(parse_retry_after(None, default=3.0), 3.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    @patch("apps.discourse.governor.time.sleep")
+    def test_background_call_honours_retry_after(self, mock_sleep):
+        func = MagicMock(side_effect=[self.response(429, "0.3"), self.response(200)])
+        response = self.governor.call(func, priority=BACKGROUND)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(func.call_count, 2)
+        self.assertGreater(mock_sleep.call_args_list[0][0][0], 0.2)
+        # The 429 halved the window (4 -> 2); the success then added 1/2.
+        self.assertEqual(self.governor.window, 2.5)
+        self.assertLess(self.governor.shared_rate(), 10)
+
+    def test_interactive_call_fails_fast_during_cooldown(self):
+        func = MagicMock(return_value=self.response(429, "60"))
+        self.assertEqual(self.governor.call(func).status_code, 429)
+        with self.assertRaises(DiscourseRateLimited):
+            self.governor.call(func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_token_is_returned_when_no_slot_frees_up(self):
+        self.governor.interactive_max_wait = 0
+        self.governor._in_flight = self.governor.max_window
+        with self.assertRaises(DiscourseRateLimited):
+            self.governor.call(MagicMock())
+        window = int(time.time() // 10)
+        self.assertEqual(cache.get(f"discourse:governor:window:{window}"), 0)
+        # An expired window key is not an error.
+        self.governor._return_token("discourse:governor:window:gone")
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_process_local_budget_cache_fails_the_system_check(self):
+
+        self.assertEqual([e.id for e in check_governor_cache(None)], ["discourse.E001"])
+
+    def test_window_grows_on_fast_success(self):
+        func = MagicMock(return_value=self.response(200))
+        for _ in range(5):
+            self.governor.call(func)
+        self.assertGreater(self.governor.window, 4.0)
+
+
+# ----------------------------
+# Login Fast Path Tests
+# ----------------------------
+@override_settings(DISCOURSE_SSO_RETURN_ALLOWLIST=["http://dummy.com"])
+class SSOLoginFastPathTestCase(TestCase):
+    def setUp(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            User.objects.create_user(username="cold", password="secret")
+
+    def start_handshake(self):
+        query = urllib.parse.urlencode(
+            {"nonce": "n-1", "return_sso_url": "http://dummy.com/session/sso_login"}
+        )
+        sso = base64.b64encode(query.encode()).decode()
+        return self.client.get(
+            reverse("discourse:discourse_sso_provider"),
+            {"sso": sso, "sig": sign_payload(sso.encode())},
+        )
+
+    @patch("apps.discourse.signals.sync_user_with_discourse")
+    def test_login_redirects_straight_to_discourse(self, mock_sync):
+        response = self.start_handshake()
+        self.assertRedirects(response, reverse("login"), fetch_redirect_response=False)
+
+        with patch("apps.discourse.views.parse_sso_request") as mock_parse:
+            response = self.client.post(
+                reverse("login"), {"username": "cold", "password": "secret"}
+            )
+            mock_parse.assert_not_called()
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith("http://dummy.com/session/sso_login?"))
+        payload = decode_sso_payload(
+            urllib.parse.parse_qs(urllib.parse.urlsplit(response.url).query)["sso"][0]
+        )
+        self.assertEqual(payload["nonce"], "n-1")
+        self.assertEqual(payload["username"], "cold")
+
+    @patch("apps.discourse.signals.sync_user_with_discourse")
+    def test_plain_login_is_unchanged(self, mock_sync):
+        response = self.client.post(
+            reverse("login"), {"username": "cold", "password": "secret"}
+        )
+        self.assertRedirects(
+            response, settings.LOGIN_REDIRECT_URL, fetch_redirect_response=False
+        )
+
+
+# ----------------------------
+# Bulk Import Tests
+# ----------------------------
+
+
+class BulkUserImportTestCase(TestCase):
+    @patch("apps.discourse.signals.sync_user_with_discourse")
+    def test_import_creates_users_and_profiles_and_queues_a_sync(self, mock_sync):
+        User.objects.create_user(username="taken", password="x")
+        mock_sync.reset_mock()
+        rows = [
+            {"username": "taken", "email": "t@example.com"},
+            {"username": "ann", "email": "ann@example.com", "first_name": "Ann"},
+            {"username": "bob", "email": "bob@example.com"},
+            {"username": "cy", "email": "cy@example.com"},
+        ]
+        created, skipped = import_users(rows, chunk_size=2)
+
+        self.assertEqual((created, skipped), (3, 1))
+        mock_sync.assert_not_called()
+        imported = set(
+            User.objects.filter(username__in=["ann", "bob", "cy"]).values_list(
+                "id", flat=True
+            )
+        )
+        self.assertEqual(
+            set(PendingUserSync.objects.values_list("user_id", flat=True)), imported
+        )
+        profile = DiscourseProfile.objects.get(user__username="ann")
+        self.assertEqual(profile.email, "ann@example.com")
+        self.assertFalse(User.objects.get(username="bob").has_usable_password())
+
+    @patch("apps.discourse.signals.sync_user_with_discourse")
+    def test_plaintext_passwords_are_rejected(self, mock_sync):
+        rows = [
+            {"username": "dee", "password": "hunter2"},
+            {"username": "eve", "password": make_password("hunter2")},
+        ]
+        self.assertEqual(import_users(rows, sync=False), (1, 1))
+        self.assertFalse(PendingUserSync.objects.exists())
+        self.assertTrue(User.objects.get(username="eve").check_password("hunter2"))
+        self.assertFalse(User.objects.filter(username="dee").exists())
+
+
+# ----------------------------
+# Paginated Listing Tests
+# ----------------------------
+
+
+class DiscoursePaginationTestCase(TestCase):
+    def pages(self, *pages):
+        def fetch(endpoint, params=None, priority=None):
+            self.requested.append(params["page"])
+            return {
+                "groups": pages[params["page"]] if params["page"] < len(pages) else []
+            }
+
+        self.requested = []
+        return patch("apps.discourse.api.fetch_discourse_data", side_effect=fetch)
+
+    def test_follows_pages_until_empty(self):
+        with self.pages([1, 2], [3, 4], [5]):
+            items = list(iter_discourse_pages("groups.json", items_key="groups"))
+        self.assertEqual(items, [1, 2, 3, 4, 5])
+        self.assertEqual(self.requested, [0, 1, 2, 3])
+
+    def test_short_page_ends_listing_with_page_size(self):
+        with self.pages([1, 2], [3]) as mock_fetch:
+            items = list(
+                iter_discourse_pages("groups.json", items_key="groups", page_size=2)
+            )
+        self.assertEqual(items, [1, 2, 3])
+        self.assertEqual(self.requested, [0, 1])
+        self.assertEqual(mock_fetch.call_args[1]["params"]["per_page"], 2)
+
+    def test_stops_early_when_caller_does(self):
+        with self.pages([1, 2], [3, 4], [5, 6], [7]):
+            for item in iter_discourse_pages("groups.json", items_key="groups"):
+                if item == 3:
+                    break
+        # The current page and at most one prefetched page were requested.
+        self.assertLessEqual(max(self.requested), 2)
+
+
+# ----------------------------
+# Profile Provisioning Tests
+# ----------------------------
+
+
+class DiscourseProfileProvisioningTestCase(TestCase):
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            username="prov", password="secret", email="prov@example.com"
+        )
+
+    def test_provisioning_is_an_idempotent_upsert(self):
+        profile = DiscourseProfile.objects.get(user=self.user)
+        self.assertEqual(profile.username, "prov")
+        DiscourseProfile.objects.filter(pk=profile.pk).update(username="forum-name")
+
+        with self.assertNumQueries(1):
+            provision_profiles([self.user])
+        self.assertEqual(DiscourseProfile.objects.filter(user=self.user).count(), 1)
+        # Existing profiles are not overwritten.
+        self.assertEqual(
+            DiscourseProfile.objects.get(user=self.user).username, "forum-name"
+        )
+
+    def test_sync_results_are_flushed_in_one_statement(self):
+        other = User.objects.create_user(username="prov2", password="secret")
+        recorder = SyncStatusRecorder(batch_size=100)
+        when = datetime.datetime(2030, 6, 1, 12, 0)
+        with patch.object(recorder.worker, "ensure_started"):
+            recorder.record(self.user.id, ok=True, when=when)
+            recorder.record(other.id, ok=False, when=when)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(recorder.flush(), 2)
+        self.assertEqual(recorder.flush(), 0)
+
+        ok = DiscourseProfile.objects.get(user=self.user)
+        failed = DiscourseProfile.objects.get(user=other)
+        self.assertEqual((ok.last_sync, ok.last_sync_status), (when, "ok"))
+        self.assertEqual((failed.last_sync, failed.last_sync_status), (None, "failed"))
+
+
+# ----------------------------
+# Tracing Tests
+# ----------------------------
+
+
+@override_settings(
+    DISCOURSE_TRACE_SAMPLE_RATE=1.0,
+    DISCOURSE_SSO_RETURN_ALLOWLIST=["http://dummy.com"],
+)
+class TracingTestCase(TestCase):
+    def setUp(self):
+        self.exported = []
+        for patcher in (
+            patch.object(tracing.exporter, "path", "traces.ndjson"),
+            patch.object(tracing.exporter, "export", self.exported.append),
+            patch("apps.discourse.signals.sync_user_with_discourse"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("apps.discourse.api.requests.post")
+    def test_outbound_calls_carry_traceparent(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200)
+        with tracing.span("login") as root:
+            post_sync_sso("payload", "sig")
+
+        sent = mock_post.call_args[1]["headers"][tracing.TRACEPARENT_HEADER]
+        trace_id, parent_id, sampled = tracing.parse_traceparent(sent)
+        self.assertEqual(trace_id, root.trace_id)
+        self.assertTrue(sampled)
+        call_span = self.exported[0]
+        self.assertEqual(call_span.name, "discourse.sync_sso")
+        self.assertEqual(call_span.span_id, parent_id)
+        self.assertEqual(call_span.parent_id, root.span_id)
+
+    def test_context_follows_work_into_threads(self):
+
+        def job():
+            with tracing.span("job") as child:
+                return child.parent_id, child.trace_id
+
+        with tracing.span("request") as root:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(tracing.propagate(job)).result()
+        self.assertEqual(result, (root.span_id, root.trace_id))
+
+    def test_middleware_continues_incoming_trace(self):
+        user = User.objects.create_user(username="traced", password="secret")
+        self.client.force_login(user)
+        query = urllib.parse.urlencode(
+            {"nonce": "n", "return_sso_url": "http://dummy.com/session/sso_login"}
+        )
+        sso = base64.b64encode(query.encode()).decode()
+        incoming = "00-" + "ab" * 16 + "-" + "cd" * 8 + "-01"
+        response = self.client.get(
+            reverse("discourse:discourse_sso_provider"),
+            {"sso": sso, "sig": sign_payload(sso.encode())},
+            HTTP_TRACEPARENT=incoming,
+        )
+        self.assertEqual(response["X-Trace-Id"], "ab" * 16)
+        names = [s.name for s in self.exported]
+        self.assertIn("sso.parse_request", names)
+        self.assertIn("sso.build_response", names)
+        root = self.exported[-1]
+        self.assertEqual(root.parent_id, "cd" * 8)
+        self.assertEqual(root.attributes["http.status_code"], 302)
+
+    @override_settings(DISCOURSE_TRACE_SAMPLE_RATE=0.0)
+    def test_incoming_sampled_flag_needs_a_trusted_caller(self):
+        incoming = "00-" + "ab" * 16 + "-" + "cd" * 8 + "-01"
+        with tracing.span("request", traceparent=incoming) as root:
+            pass
+        self.assertEqual(root.trace_id, "ab" * 16)
+        self.assertFalse(root.sampled)
+        with override_settings(DISCOURSE_TRACE_TRUSTED_CALLERS=["127.0.0.1"]):
+            response = self.client.get(reverse("login"), HTTP_TRACEPARENT=incoming)
+        self.assertEqual(response["X-Trace-Id"], "ab" * 16)
+
+    def test_no_spans_without_an_exporter(self):
+        with patch.object(tracing.exporter, "path", ""):
+            with tracing.span("request") as root:
+                self.assertIs(root, tracing.NOOP_SPAN)
+                self.assertIsNone(tracing.current_span())
+                self.assertEqual(tracing.inject_headers({}), {})
+        self.assertEqual(self.exported, [])
+
+    def test_spans_are_written_as_otlp_json(self):
+        with tracing.span("stage", user=3):
+            pass
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "traces.ndjson")
+            tracing.SpanExporter(path=path).write(self.exported)
+            with open(path) as f:
+                document = json.loads(f.readline())
+        span = document["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        self.assertEqual(span["name"], "stage")
+        self.assertEqual(
+            span["attributes"], [{"key": "user", "value": {"intValue": "3"}}]
+        )
+
+
+# ----------------------------
+# Request Profiling Tests
+# ----------------------------
+
+
+class RequestProfilingTestCase(TestCase):
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        ring_patch = patch.object(
+            profiling, "ring", profiling.ProfileRing(tmp.name, size=2)
+        )
+        self.ring = ring_patch.start()
+        self.addCleanup(ring_patch.stop)
+
+    def test_signed_header_profiles_listed_views_only(self):
+        token = profiling.make_profile_token()
+        self.client.get(reverse("login"), HTTP_X_DISCOURSE_PROFILE=token)
+        self.client.get(reverse("discourse:index"), HTTP_X_DISCOURSE_PROFILE=token)
+        self.client.get(reverse("login"), HTTP_X_DISCOURSE_PROFILE="forged")
+        self.assertEqual(len(self.ring.names()), 1)
+        self.assertIn("accounts_login", self.ring.names()[0])
+
+    @override_settings(DISCOURSE_PROFILE_SAMPLE_RATE=1.0)
+    def test_ring_is_bounded(self):
+        for _ in range(4):
+            self.client.get(reverse("login"))
+        self.assertEqual(len(self.ring.names()), 2)
+
+    @override_settings(DISCOURSE_PROFILE_SAMPLE_RATE=1.0)
+    def test_staff_can_list_and_download(self):
+        self.client.get(reverse("login"))
+        name = self.ring.names()[0]
+        staff = User.objects.create_user(username="ops", password="x", is_staff=True)
+        url = reverse("discourse:request_profile_download", args=[name])
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(staff)
+        listing = self.client.get(reverse("discourse:request_profiles"))
+        self.assertContains(listing, name)
+        self.assertEqual(listing.context["site_header"], admin.site.site_header)
+        self.assertContains(listing, reverse("admin:logout"))
+        download = self.client.get(url)
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b"".join(download.streaming_content))
+        self.assertContains(self.client.get(url, {"format": "txt"}), "cumulative")
+        missing = reverse("discourse:request_profile_download", args=["1-x.prof"])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+
+# ----------------------------
+# User Card Template Tag Tests
+# ----------------------------
+
+
+class DiscourseUserCardTestCase(TestCase):
+    TEMPLATE = Template(
+        "{% load discourse_tags %}{% discourse_user_cards %}"
+        "{% for name in names %}[{% discourse_user_card name %}]{% endfor %}"
+        "{% end_discourse_user_cards %}"
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def fake_fetch(self, endpoint, params=None, priority=None):
+        name = endpoint[len("u/") : -len(".json")]
+        if name == "ghost":
+            not_found = MagicMock(status_code=404)
+            cause = requests.HTTPError("404", response=not_found)
+            raise Exception("Error fetching data from Discourse") from cause
+        if name == "busy":
+            cause = DiscourseRateLimited(3.0)
+            raise Exception("Error fetching data from Discourse") from cause
+        return {
+            "user": {
+                "username": name,
+                "trust_level": 2,
+                "post_count": 7,
+                "avatar_template": f"/user_avatar/{name}/{{size}}/1.png",
+            }
+        }
+
+    def test_one_cache_lookup_per_render(self):
+        names = ["ann", "bob", "ann", "ghost", "busy"]
+        with patch(
+            "apps.discourse.usercards.fetch_discourse_data",
+            side_effect=self.fake_fetch,
+        ) as mock_fetch, patch.object(
+            usercards.warmer, "put"
+        ) as mock_put, patch.object(
+            cache, "get_many", wraps=cache.get_many
+        ) as mock_get_many:
+            # A cold cache renders plain usernames and queues the lookups
+            # instead of making them during the render.
+            html = self.TEMPLATE.render(Context({"names": names}))
+            self.assertEqual(mock_get_many.call_count, 1)
+            mock_fetch.assert_not_called()
+            self.assertEqual(
+                [c.args[0] for c in mock_put.call_args_list],
+                ["ann", "bob", "ghost", "busy"],
+            )
+            self.assertIn('<span class="discourse-user-card">ann</span>', html)
+
+            # The warmer: one request per distinct uncached name.
+            usercards.fetch_user_cards([c.args[0] for c in mock_put.call_args_list])
+            self.assertEqual(mock_fetch.call_count, 4)
+
+            # The second render is served from the cache, unknown users
+            # included; only the rate-limited lookup is queued again.
+            mock_fetch.reset_mock()
+            mock_put.reset_mock()
+            html = self.TEMPLATE.render(Context({"names": names}))
+            mock_fetch.assert_not_called()
+            mock_put.assert_called_once_with("busy")
+
+        self.assertEqual(html.count("discourse-user-card"), 5)
+        self.assertIn("/user_avatar/ann/48/1.png", html)
+        self.assertIn("TL2", html)
+        self.assertIn('<span class="discourse-user-card">ghost</span>', html)
+        self.assertNotIn("<!--", html)
+
+    def test_card_markup_is_escaped(self):
+        cache.set(
+            usercards._cache_key("eve"),
+            {
+                "username": "eve",
+                "name": '"><script>',
+                "trust_level": 1,
+                "post_count": None,
+                "avatar_url": "",
+                "profile_url": "https://forum.example/u/eve",
+            },
+        )
+        html = Template(
+            "{% load discourse_tags %}{% discourse_user_cards %}"
+            "<b>{{ label }}</b>{% discourse_user_card name %}"
+            "{% end_discourse_user_cards %}"
+        ).render(Context({"name": "eve", "label": "<i>"}))
+        self.assertEqual(
+            html,
+            "<b>&lt;i&gt;</b>"
+            '<a class="discourse-user-card" href="https://forum.example/u/eve" '
+            'title="&quot;&gt;&lt;script&gt;"> eve '
+            "<small>TL1 &middot; 0 posts</small></a>",
+        )
+
+    def test_card_outside_block_looks_itself_up(self):
+        with patch.object(usercards.warmer, "put") as mock_put:
+            html = Template(
+                "{% load discourse_tags %}{% discourse_user_card 'bob' %}"
+            ).render(Context())
+        self.assertEqual(html, '<span class="discourse-user-card">bob</span>')
+        mock_put.assert_called_once_with("bob")
+
+
+# ----------------------------
+# Scale Data Tests
+# ----------------------------
+
+
+class ScaleDataTestCase(TestCase):
+    def test_generate_scale_data(self):
+        call_command(
+            "generate_scale_data",
+            users=50,
+            events=2000,
+            days=30,
+            batch_size=500,
+            seed=7,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith="scale-").count(), 50)
+        self.assertEqual(
+            DiscourseProfile.objects.filter(username__startswith="scale-").count(), 50
+        )
+        self.assertEqual(SsoEventLog.objects.count(), 2000)
+        counts = dict(
+            SsoEventLog.objects.values_list("event_type").annotate(n=Count("id"))
+        )
+        self.assertGreater(counts["login"], counts["sync"])
+        self.assertGreater(counts["sync"], counts["error"])
+        oldest = SsoEventLog.objects.order_by("created_at").first().created_at
+        newest = SsoEventLog.objects.order_by("-created_at").first().created_at
+        self.assertGreater(newest - oldest, datetime.timedelta(days=7))
+
+
+# ----------------------------
+# Query Budget Tests
+# ----------------------------
+
+
+@override_settings(DISCOURSE_SSO_RETURN_ALLOWLIST=["http://dummy.com"])
+class SSOViewBudgetTestCase(BudgetAssertionsMixin, TestCase):
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username="budget", password="secret")
+
+    def signed(self, **fields):
+        fields.setdefault("nonce", "n")
+        fields.setdefault("return_sso_url", "http://dummy.com/session/sso_login")
+        sso = base64.b64encode(urllib.parse.urlencode(fields).encode()).decode()
+        return {"sso": sso, "sig": sign_payload(sso.encode())}
+
+    def test_sso_flow_stays_within_declared_budgets(self):
+        provider = reverse("discourse:discourse_sso_provider")
+        with self.enforce_budgets():
+            self.assertEqual(self.client.get(provider, self.signed()).status_code, 302)
+            response = self.client.post(
+                reverse("login"), {"username": "budget", "password": "secret"}
+            )
+            self.assertTrue(response.url.startswith("http://dummy.com"))
+            self.assertEqual(self.client.get(provider, self.signed()).status_code, 302)
+            response = self.client.post(
+                reverse("discourse:discourse_sso_login"), self.signed()
+            )
+            self.assertEqual(response.status_code, 302)
+            response = self.client.post(
+                provider, self.signed(external_id=str(self.user.id))
+            )
+            self.assertEqual(response.status_code, 302)
+
+    def test_violation_fails_when_enforced(self):
+        with self.assertRaises(BudgetExceeded):
+            with enforce_budgets(), budget("extra lookup", queries=0):
+                User.objects.count()
+        with self.assertWithinBudget(queries=1) as usage:
+            User.objects.count()
+        self.assertEqual(len(usage.queries), 1)
+
+    def test_wall_time_is_only_warned_about_when_enforced(self):
+        with self.assertLogs("apps.discourse.budgets", "WARNING") as logs:
+            with enforce_budgets(), budget("slow block", queries=1, ms=0):
+                time.sleep(0.001)
+        self.assertIn("slow block exceeded its budget", logs.output[0])
+
+    @override_settings(DISCOURSE_BUDGET_SAMPLE_RATE=1.0)
+    def test_violation_is_logged_in_production(self):
+        with self.assertLogs("apps.discourse.budgets", "WARNING") as logs:
+            with budget("extra lookup", queries=0):
+                User.objects.count()
+        self.assertIn("extra lookup exceeded its budget: 1 queries", logs.output[0])
+
+    @override_settings(DISCOURSE_BUDGET_SAMPLE_RATE=0.0)
+    def test_unsampled_runs_are_not_measured(self):
+        with budget("extra lookup", queries=0) as usage:
+            User.objects.count()
+        self.assertIsNone(usage)
+
+
+# ----------------------------
+# Compact Event Storage Tests
+# ----------------------------
+
+
+class CompactSsoEventLogTestCase(TestCase):
+    PAYLOAD = urllib.parse.urlencode(
+        {
+            "nonce": "cb68251eefb5211e58c00ff1395f0c0b",
+            "return_sso_url": "https://forum.example.com/session/sso_login",
+            "external_id": "42",
+            "email": "alice@example.com",
+            "username": "alice",
+            "name": "Alice Smith",
+            "add_groups": "staff,writers",
+        }
+    )
+
+    def setUp(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_payload_is_split_and_restored(self):
+        nonce, external_id, host, blob = pack_details(self.PAYLOAD)
+        self.assertEqual(
+            (nonce, external_id, host),
+            ("cb68251eefb5211e58c00ff1395f0c0b", "42", "forum.example.com"),
+        )
+        self.assertLess(len(blob), len(self.PAYLOAD) / 2)
+        self.assertEqual(unpack_details(nonce, external_id, host, blob), self.PAYLOAD)
+        # Signatures cover the exact text: encoding, order and line breaks.
+        for details in (
+            self.PAYLOAD.replace("+", "%20"),
+            base64.encodebytes(self.PAYLOAD.encode()).decode(),
+            base64.b64encode(self.PAYLOAD.encode()).decode(),
+        ):
+            packed = pack_details(details)
+            self.assertEqual(packed[:3], (nonce, external_id, host))
+            self.assertEqual(unpack_details(*packed), details)
+        # Anything else is kept verbatim.
+        self.assertEqual(
+            unpack_details(*pack_details("Invalid signature")), "Invalid signature"
+        )
+
+    @override_settings(DISCOURSE_SSO_EVENT_DETAILS_MAX_BYTES=32)
+    def test_blob_input_is_capped(self):
+        details = unpack_details(*pack_details("x" * 1000))
+        self.assertEqual(details, "x" * 32 + " [truncated]")
+
+    def test_admin_and_export_show_details(self):
+        staff = User.objects.create_superuser(
+            username="auditor", password="secret", email="a@example.com"
+        )
+        event = SsoEventLog(user=staff, event_type="login", signature="s")
+        event.set_details(self.PAYLOAD)
+        event.save()
+        self.assertEqual(SsoEventLog.objects.get().payload_details, "")
+
+        self.client.force_login(staff)
+        change = self.client.get(
+            reverse("admin:discourse_ssoeventlog_change", args=[event.pk])
+        )
+        self.assertContains(change, "alice%40example.com")
+
+        body = b"".join(
+            self.client.get(reverse("discourse:sso_event_export")).streaming_content
+        )
+        record = json.loads(body.decode().splitlines()[0])
+        self.assertEqual(record["nonce"], "cb68251eefb5211e58c00ff1395f0c0b")
+        self.assertIn("username=alice", record["payload_details"])
+
+    def test_compact_command_converts_legacy_rows(self):
+        SsoEventLog.objects.create(event_type="error", payload_details=self.PAYLOAD)
+        call_command("compact_sso_events", stdout=io.StringIO())
+        event = SsoEventLog.objects.get()
+        self.assertEqual((event.payload_details, event.external_id), ("", "42"))
+        self.assertIn("username=alice", event.details)
+
+
+# ----------------------------
+# Session Store Tests
+# ----------------------------
+
+
+def setUpModule():
+    # Tests flush sessions by hand: a write-back thread would write through
+    # its own connection to the test database while a test holds it.
+    for worker in (write_back.worker, user_sync.worker):
+        patcher = patch.object(worker, "ensure_started")
+        patcher.start()
+        unittest.addModuleCleanup(patcher.stop)
+
+
+class CoalescedSessionStoreTestCase(TestCase):
+    def setUp(self):
+        write_back.flush()
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        for name, value in (("batch_size", 1000),):
+            patcher = patch.object(write_back, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_writes_are_coalesced_into_one_upsert(self):
+        session = SessionStore()
+        session["step"] = 1
+        with self.assertNumQueries(0):
+            session.save()
+            session["step"] = 2
+            session.save()
+            other = SessionStore()
+            other["step"] = 1
+            other.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(write_back.flush(), 2)
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertEqual(
+            Session.objects.get(pk=session.session_key).get_decoded(), {"step": 2}
+        )
+
+    def test_unchanged_session_is_not_written(self):
+        session = SessionStore()
+        session["user"] = "alice"
+        session.save()
+        write_back.flush()
+
+        again = SessionStore(session.session_key)
+        self.assertEqual(again["user"], "alice")
+        again.save()
+        self.assertIsNone(write_back.pending(session.session_key))
+
+    def test_sessions_survive_cache_loss_and_deletes_are_immediate(self):
+        session = SessionStore()
+        session["user"] = "alice"
+        session.save()
+        write_back.flush()
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        self.assertEqual(SessionStore(session.session_key)["user"], "alice")
+
+        SessionStore(session.session_key).delete()
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+
+    def test_deleted_session_is_not_revived_by_another_worker(self):
+        session = SessionStore()
+        session["_auth_user_id"] = "1"
+        session.save()
+        # Another worker still has this version waiting to be written back.
+        other_worker = SessionWriteBack()
+        other_worker.worker.ensure_started = lambda: None
+        other_worker.write(
+            session.session_key,
+            session.encode({"_auth_user_id": "1"}),
+            session.get_expiry_date(),
+        )
+        SessionStore(session.session_key).delete()
+        other_worker.flush()
+        self.assertTrue(Session.objects.exists())
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+
+    def test_background_thread_flushes_idle_workers(self):
+        buffer = SessionWriteBack(interval=0.01)
+        flushed = threading.Event()
+        with patch.object(buffer.worker, "func", side_effect=lambda: flushed.set()):
+            buffer.write("k", "data", None)
+            self.assertTrue(flushed.wait(5))
+            # Park the thread before the real flush() is back in place.
+            buffer.worker.interval = 3600
+            buffer.discard("k")
+
+    def test_login_writes_no_session_rows_until_flushed(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            User.objects.create_user(username="bob", password="secret")
+            self.client.login(username="bob", password="secret")
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(
+            self.client.session["_auth_user_id"], str(User.objects.get().pk)
+        )
+        write_back.flush()
+        self.assertEqual(Session.objects.count(), 1)
+
+
+# ----------------------------
+# Static Asset Tests
+# ----------------------------
+
+
+class PrecompressedStaticFilesTestCase(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(
+            STATIC_ROOT=tmp.name,
+            STORAGES={
+                **settings.STORAGES,
+                "staticfiles": {
+                    "BACKEND": "apps.discourse.staticfiles."
+                    "PrecompressedManifestStaticFilesStorage"
+                },
+            },
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.hashed = staticfiles_storage.stored_name("css/site.css")
+        with open(os.path.join(tmp.name, "css", "site.css"), "rb") as f:
+            self.original = f.read()
+
+    def test_collectstatic_writes_fingerprinted_compressed_variants(self):
+        self.assertRegex(self.hashed, r"^css/site\.[0-9a-f]{12}\.css$")
+        for name in ("css/site.css.gz", self.hashed + ".gz"):
+            with staticfiles_storage.open(name) as f:
+                self.assertEqual(gzip.decompress(f.read()), self.original)
+
+    def test_login_page_links_fingerprinted_asset(self):
+        response = self.client.get(reverse("login"))
+        self.assertContains(response, "/static/" + self.hashed)
+
+    def test_serves_precompressed_variant_with_far_future_caching(self):
+        response = self.client.get(
+            "/static/" + self.hashed, HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", response["Cache-Control"])
+        body = b"".join(response.streaming_content)
+        self.assertEqual(gzip.decompress(body), self.original)
+
+        plain = self.client.get("/static/css/site.css")
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(plain.streaming_content), self.original)
+        self.assertNotIn("immutable", plain["Cache-Control"])
+
+        with self.assertRaises(Http404):
+            serve_static(RequestFactory().get("/static/"), "../manage.py")
+
+    def test_prefers_brotli_unless_refused(self):
+        response = self.client.get(
+            "/static/" + self.hashed, HTTP_ACCEPT_ENCODING="gzip, br;q=0.5"
+        )
+        self.assertEqual(response["Content-Encoding"], "br")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(brotli.decompress(body), self.original)
+
+        for header in ("gzip, br;q=0", "gzip, br; q=0.0", "gzip, br;q=oops"):
+            response = self.client.get(
+                "/static/" + self.hashed, HTTP_ACCEPT_ENCODING=header
+            )
+            self.assertEqual(response["Content-Encoding"], "gzip", header)
+
+
+# ----------------------------
+# Password Hashing Pool Tests
+# ----------------------------
+
+
+class PasswordHashPoolTestCase(TestCase):
+    def test_checks_run_in_worker_processes(self):
+        pool = PasswordHashPool(workers=1, max_pending=2)
+        self.addCleanup(pool.shutdown, wait=True)
+        encoded = make_password("secret")
+        self.assertEqual(pool.check("secret", encoded), (True, False))
+        self.assertEqual(pool.check("wrong", encoded), (False, False))
+        self.assertEqual(pool.check("secret", None), (False, False))
+        stats = pool.stats()
+        self.assertEqual((stats["pending"], stats["rejected"]), (0, 0))
+        self.assertEqual(stats["hash_time"]["count"], 3)
+        self.assertEqual(stats["pool_wait"]["count"], 3)
+
+    def test_saturated_pool_rejects_at_once(self):
+        pool = PasswordHashPool(workers=0, max_pending=1)
+        pool._pending = 1
+        with self.assertRaises(PasswordHashPoolSaturated):
+            pool.check("secret", make_password("secret"))
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    def test_login_is_shed_when_saturated(self):
+        patcher = patch("apps.discourse.signals.sync_user_with_discourse")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        User.objects.create_user(username="carol", password="secret")
+        with patch.object(hashing.pool, "_pending", hashing.pool.max_pending):
+            response = self.client.post(
+                reverse("login"), {"username": "carol", "password": "secret"}
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+        response = self.client.post(
+            reverse("login"), {"username": "carol", "password": "secret"}
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_other_logins_fail_instead_of_erroring_when_saturated(self):
+
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            User.objects.create_superuser(
+                username="ops", password="secret", email="ops@example.com"
+            )
+        with patch.object(hashing.pool, "_pending", hashing.pool.max_pending):
+            self.assertIsNone(authenticate(username="ops", password="secret"))
+            response = self.client.post(
+                reverse("admin:login"), {"username": "ops", "password": "secret"}
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_shutdown_cancels_queued_checks(self):
+        pool = PasswordHashPool(workers=1, max_pending=2)
+        pool.check("secret", None)
+        queued = MagicMock()
+        pool._futures.add(queued)
+        pool.shutdown(wait=True)
+        queued.cancel.assert_called_once_with()
+
+    def test_metrics_view_is_staff_only(self):
+        url = reverse("discourse:password_hashing_metrics")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            staff = User.objects.create_superuser(
+                username="ops", password="secret", email="ops@example.com"
+            )
+        self.client.force_login(staff)
+        self.assertIn("pool_wait", self.client.get(url).json())
+
+
+# ----------------------------
+# Signature Audit Tests
+# ----------------------------
+
+
+@override_settings(DISCOURSE_CONNECT_PREVIOUS_SECRETS=["old-secret"])
+class AuditSsoSignaturesTestCase(TestCase):
+    def setUp(self):
+        # Signed as sent: external_id not last, %20 spaces, Base64 line breaks.
+        payload = base64.encodebytes(
+            b"nonce=abc&external_id=7&name=Alice%20Smith"
+            b"&return_sso_url=https%3A%2F%2Ff.example%2Fx&admin=false"
+        )
+        self.payload = payload.decode()
+        self.ids = {}
+        for name, details, sig in (
+            ("current", self.payload, sign_payload(payload)),
+            ("previous", self.payload, sign_payload(payload, "old-secret")),
+            ("forged", self.payload, "0" * 64),
+            ("unsigned", self.payload, ""),
+        ):
+            event = SsoEventLog(event_type="login", signature=sig)
+            event.set_details(details)
+            event.save()
+            self.ids[name] = event.pk
+
+    def test_compact_and_legacy_rows_are_verified(self):
+        SsoEventLog.objects.create(
+            event_type="login",
+            payload_details=self.payload,
+            signature=sign_payload(self.payload.encode()),
+        )
+        secrets = [settings.DISCOURSE_CONNECT_SECRET, "old-secret"]
+        counts, flagged = collections.Counter(), []
+        for chunk_counts, chunk_flagged in audit_signatures(secrets, chunk_size=2):
+            counts.update(chunk_counts)
+            flagged += chunk_flagged
+        self.assertEqual(
+            counts, {"current": 2, "previous": 1, "mismatch": 1, "unsigned": 1}
+        )
+        self.assertEqual(
+            sorted(flagged),
+            sorted(
+                [(self.ids["previous"], "previous"), (self.ids["forged"], "mismatch")]
+            ),
+        )
+
+    def test_command_uses_a_process_pool(self):
+        out = io.StringIO()
+        call_command("audit_sso_signatures", workers=2, chunk_size=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn(f"mismatch\t{self.ids['forged']}", output)
+        self.assertIn(
+            "Audited 4 SSO events: 1 current secret, 1 previous secrets, "
+            "1 mismatches, 1 unsigned.",
+            output,
+        )
+
+    def test_command_lists_the_first_flagged_events_only(self):
+        out = io.StringIO()
+        call_command("audit_sso_signatures", workers=1, show=1, stdout=out)
+        output = out.getvalue()
+        self.assertEqual(output.count("\t"), 1)
+        self.assertIn("... and 1 more flagged events (use --output).", output)
+
+    def test_command_writes_flagged_events_as_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "flagged.csv")
+            call_command(
+                "audit_sso_signatures", workers=1, output=path, stdout=io.StringIO()
+            )
+            with open(path, encoding="utf-8", newline="") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["id", "outcome"])
+        self.assertEqual(len(rows), 3)
+
+
+# ----------------------------
+# Cache Invalidation Tests
+# ----------------------------
+
+
+class InvalidationBusTestCase(TestCase):
+    def setUp(self):
+        self.cache = invalidation.local_cache(invalidation.USER_CACHE)
+        self.addCleanup(self.cache.clear)
+
+    def test_model_changes_invalidate_cached_users(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            user = User.objects.create_user(username="dave", password="secret")
+            self.cache.set(user.pk, "stale")
+            user.first_name = "Dave"
+            user.save()
+            self.assertIsNone(self.cache.get(user.pk))
+
+            self.cache.set(user.pk, "stale")
+            user.discourse_profile.save()
+            self.assertIsNone(self.cache.get(user.pk))
+
+    def test_notifications_from_other_processes_are_applied(self):
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        invalidation.apply('{"c": "users", "k": 1, "o": "elsewhere"}')
+        self.assertEqual((self.cache.get(1), self.cache.get(2)), (None, "two"))
+        invalidation.apply('{"c": "users", "k": null, "o": "elsewhere"}')
+        self.assertEqual(len(self.cache), 0)
+        # Our own notifications were applied when they were published.
+        self.cache.set(2, "two")
+        invalidation.apply(invalidation._message("users", 2))
+        self.assertEqual(self.cache.get(2), "two")
+
+    def test_local_cache_is_a_bounded_lru(self):
+        lru = invalidation.LocalCache("test", maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        self.assertEqual(lru.get_or_set("d", lambda: 4), 4)
+
+    def test_get_or_set_skips_values_invalidated_while_computing(self):
+        lru = invalidation.LocalCache("test")
+
+        def compute():
+            lru.invalidate("a")
+            return "stale"
+
+        self.assertEqual(lru.get_or_set("a", compute), "stale")
+        self.assertEqual(lru.get_or_set("a", lambda: "fresh"), "fresh")
+        self.assertEqual(lru.get("a"), "fresh")
+
+    def test_backend_serves_request_users_from_the_cache(self):
+
+        backend = DiscourseModelBackend()
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            user = User.objects.create_user(username="fay", password="secret")
+            first = backend.get_user(user.pk)
+            with self.assertNumQueries(0):
+                second = backend.get_user(user.pk)
+            self.assertIsNot(first, second)
+            self.assertEqual(second.discourse_profile.user_id, user.pk)
+
+            user.first_name = "Fay"
+            user.save()
+            self.assertEqual(backend.get_user(user.pk).first_name, "Fay")
+
+
+# ----------------------------
+# SSO Attribute Mapping Tests
+# ----------------------------
+
+
+class SSOAttributeMappingTestCase(TestCase):
+    MAPPING = {
+        "external_id": "id",
+        "username": "username",
+        "name": ["first_name", "last_name"],
+        "admin": "is_superuser",
+        "add_groups": "discourse_profile.group_names",
+        "custom.discourse_username": "discourse_profile.username",
+    }
+
+    def setUp(self):
+        with patch("apps.discourse.signals.sync_user_with_discourse"):
+            self.user = User.objects.create_user(
+                username="erin", first_name="Erin", email="erin@example.com"
+            )
+        DiscourseProfile.objects.filter(user=self.user).update(
+            group_names=["staff", "writers"], username="erin_forum"
+        )
+
+    def test_mapping_compiles_into_one_query_serializer(self):
+        serializer = SSOPayloadSerializer(self.MAPPING)
+        self.assertEqual(serializer.select_related, ("discourse_profile",))
+        self.assertIn("discourse_profile__group_names", serializer.only)
+        self.assertNotIn("email", serializer.only)
+
+        with self.assertNumQueries(1):
+            user = serializer.queryset().get(pk=self.user.pk)
+            params = serializer.serialize(user)
+        self.assertEqual(
+            params,
+            {
+                "external_id": str(self.user.pk),
+                "username": "erin",
+                "name": "Erin",
+                "admin": "false",
+                "add_groups": "staff,writers",
+                "custom.discourse_username": "erin_forum",
+            },
+        )
+
+    def test_default_mapping_matches_the_previous_payload(self):
+        user = User.objects.select_related("discourse_profile").get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            b64_payload, _ = generate_sso_params(user, "n1", None)
+        self.assertEqual(
+            base64.b64decode(b64_payload).decode(),
+            "nonce=n1&external_id={}&email=erin%40example.com&username=erin"
+            "&name=Erin&add_groups=staff%2Cwriters".format(self.user.pk),
+        )
+
+    def test_bad_paths_fail_at_compile_time(self):
+        for source in ("nickname", "discourse_profile.nope", "groups.name"):
+            with self.assertRaises(ImproperlyConfigured):
+                SSOPayloadSerializer({"x": source})
+
+
+# ----------------------------
+# Shared Mmap Cache Tests
+# ----------------------------
+
+
+def _set_in_child(path, options):
+    MmapCache(path, {"OPTIONS": options}).set("from-child", {"pid": os.getpid()})
+
+
+def _count_in_child(path, options, count):
+    shared = MmapCache(path, {"OPTIONS": options})
+    threads = [
+        threading.Thread(target=lambda: [shared.incr("hits") for _ in range(count)])
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class MmapCacheTestCase(TestCase):
+    OPTIONS = {"SLOTS": 64, "SLOT_SIZE": 256, "WAYS": 4}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache.mmap")
+
+    def make_cache(self, **options):
+        return MmapCache(self.path, {"OPTIONS": {**self.OPTIONS, **options}})
+
+    def test_basic_operations(self):
+        shared = self.make_cache()
+        shared.set("a", {"x": 1})
+        self.assertEqual(shared.get("a"), {"x": 1})
+        self.assertFalse(shared.add("a", 2))
+        self.assertTrue(shared.add("b", 2))
+        self.assertEqual(shared.incr("b", 3), 5)
+        self.assertEqual(shared.get_many(["a", "b", "c"]), {"a": {"x": 1}, "b": 5})
+        self.assertTrue(shared.delete("a"))
+        self.assertIsNone(shared.get("a"))
+        shared.set("gone", 1, timeout=-1)
+        self.assertFalse(shared.has_key("gone"))
+        shared.clear()
+        self.assertIsNone(shared.get("b"))
+
+    def test_oversized_values_raise(self):
+        shared = self.make_cache()
+        shared.set("big", "small")
+        with self.assertRaises(ValueError):
+            shared.set("big", "x" * 1000)
+        self.assertIsNone(shared.get("big"))
+        with self.assertRaises(ValueError):
+            shared.add("other", "x" * 1000)
+
+    def test_refuses_files_open_to_others(self):
+        self.make_cache().set("a", 1)
+        os.chmod(self.path, 0o644)
+        with self.assertRaises(ImproperlyConfigured):
+            self.make_cache().get("a")
+
+    def test_full_set_evicts_least_recently_used(self):
+        shared = self.make_cache(SLOTS=2, WAYS=2)
+        shared.set("a", 1)
+        shared.set("b", 2)
+        shared.get("a")
+        shared.set("c", 3)
+        self.assertEqual([shared.get(k) for k in "abc"], [1, None, 3])
+
+    def test_entries_are_shared_between_processes_and_survive_reopening(self):
+        shared = self.make_cache()
+        child = multiprocessing.get_context("fork").Process(
+            target=_set_in_child, args=(self.path, self.OPTIONS)
+        )
+        child.start()
+        child.join()
+        self.assertEqual(shared.get("from-child"), {"pid": child.pid})
+        self.assertEqual(self.make_cache().get("from-child"), {"pid": child.pid})
+        # A file written with other options is started over.
+        self.assertIsNone(self.make_cache(SLOT_SIZE=512).get("from-child"))
+
+    def test_incr_is_atomic_across_processes_and_threads(self):
+        shared = self.make_cache()
+        shared.set("hits", 0)
+        fork = multiprocessing.get_context("fork")
+        children = [
+            fork.Process(target=_count_in_child, args=(self.path, self.OPTIONS, 1000))
+            for _ in range(4)
+        ]
+        for child in children:
+            child.start()
+        for _ in range(1000):
+            shared.decr("hits")
+        for child in children:
+            child.join()
+        self.assertEqual(shared.get("hits"), 4 * 2 * 1000 - 1000)
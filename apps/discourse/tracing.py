@@ -0,0 +1,265 @@
+# apps/discourse/tracing.py
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import random
+import re
+import time
+
+import requests
+from django.conf import settings
+
+from .workers import BatchQueue
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("discourse_span", default=None)
+
+
+class Span:
+    """One timed operation of a trace (W3C trace-context ids)."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "sampled",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "error",
+    )
+
+    def __init__(self, name, trace_id, parent_id, sampled, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    """What span() yields while tracing is off: records nothing."""
+
+    name = trace_id = span_id = parent_id = error = None
+    sampled = False
+    duration_ms = 0.0
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def parse_traceparent(value):
+    """Return (trace_id, parent_span_id, sampled) or None for a bad header."""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _should_sample():
+    return random.random() < settings.DISCOURSE_TRACE_SAMPLE_RATE
+
+
+@contextlib.contextmanager
+def span(name, traceparent=None, trusted=False, **attributes):
+    """
+    Time the enclosed block as a child of the current span. Without a current
+    span a new trace starts, continuing ``traceparent`` (an incoming W3C
+    header) when given; the sampling decision is made once per trace, and
+    taken from ``traceparent`` only if its sender is ``trusted``. While no
+    exporter is configured this yields NOOP_SPAN and costs next to nothing.
+    """
+    parent = _current_span.get()
+    if parent is None and not exporter.enabled:
+        yield NOOP_SPAN
+        return
+    if parent is not None:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        remote = parse_traceparent(traceparent)
+        if remote:
+            trace_id, parent_id, sampled = remote
+            if not trusted:
+                sampled = _should_sample()
+        else:
+            trace_id, parent_id = "%032x" % random.getrandbits(128), None
+            sampled = _should_sample()
+    current = Span(name, trace_id, parent_id, sampled, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if current.sampled:
+            exporter.export(current)
+
+
+def traced(name):
+    """Decorator form of span()."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_headers(headers):
+    """Add the traceparent of the current span to outbound request headers."""
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent
+    return headers
+
+
+def propagate(func):
+    """
+    Bind ``func`` to the caller's trace context, for work handed to a thread
+    pool or a background worker: spans it opens become children of the span
+    that was current when propagate() was called.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans):
+    """Render finished spans as an OTLP/JSON ExportTraceServiceRequest."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": settings.DISCOURSE_TRACE_SERVICE},
+                        }
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "apps.discourse"},
+                        "spans": [
+                            {
+                                "traceId": s.trace_id,
+                                "spanId": s.span_id,
+                                "parentSpanId": s.parent_id or "",
+                                "name": s.name,
+                                "kind": 1,
+                                "startTimeUnixNano": str(s.start_ns),
+                                "endTimeUnixNano": str(s.end_ns),
+                                "attributes": [
+                                    {"key": key, "value": _otlp_value(value)}
+                                    for key, value in s.attributes.items()
+                                ],
+                                "status": (
+                                    {"code": 2, "message": s.error}
+                                    if s.error
+                                    else {"code": 1}
+                                ),
+                            }
+                            for s in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """
+    Ships finished spans off the request thread. A background thread drains a
+    bounded queue and writes each batch as one OTLP/JSON document, either
+    appended as a line to ``path`` or POSTed to an OTLP/HTTP ``endpoint``
+    (e.g. ``http://localhost:4318/v1/traces``). Spans are dropped when the
+    queue is full.
+    """
+
+    def __init__(
+        self, path="", endpoint="", batch_size=256, max_wait=2.0, maxsize=10000
+    ):
+        self.path = path
+        self.endpoint = endpoint
+        self.queue = BatchQueue(
+            self.write,
+            "discourse-traces",
+            "export spans",
+            batch_size=batch_size,
+            max_wait=max_wait,
+            maxsize=maxsize,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.endpoint)
+
+    def export(self, finished):
+        self.queue.put(finished)
+
+    def write(self, spans):
+        document = otlp_payload(spans)
+        if self.endpoint:
+            # Sent directly, not through the governor or traced itself.
+            requests.post(self.endpoint, json=document, timeout=5)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as output:
+                output.write(json.dumps(document, separators=(",", ":")) + "\n")
+
+
+exporter = SpanExporter(
+    path=settings.DISCOURSE_TRACE_FILE,
+    endpoint=settings.DISCOURSE_TRACE_OTLP_ENDPOINT,
+)
@@ -4,6 +4,11 @@ from .views import (
     CustomLoginView,
     DiscourseSSOProviderView,
     DiscourseSSOLoginView,
+    DiscourseWebhookView,
+    PasswordHashingMetricsView,
+    RequestProfileDownloadView,
+    RequestProfileListView,
+    SsoEventLogExportView,
     index,
 )
 
@@ -20,6 +25,19 @@ urlpatterns = [
         DiscourseSSOLoginView.as_view(),
         name="discourse_sso_login",
     ),
+    path("webhooks/", DiscourseWebhookView.as_view(), name="discourse_webhooks"),
+    path("events/export/", SsoEventLogExportView.as_view(), name="sso_event_export"),
+    path("profiles/", RequestProfileListView.as_view(), name="request_profiles"),
+    path(
+        "profiles/<str:name>/",
+        RequestProfileDownloadView.as_view(),
+        name="request_profile_download",
+    ),
+    path(
+        "metrics/password-hashing/",
+        PasswordHashingMetricsView.as_view(),
+        name="password_hashing_metrics",
+    ),
     # path('discourse/session/sso_provider/', discourse_sso_provider, name='discourse_sso_provider') ,
     path("", index, name="index"),
 ]
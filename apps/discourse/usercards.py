@@ -0,0 +1,123 @@
+# apps/discourse/usercards.py
+
+import logging
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import tracing
+from .api import fetch_discourse_data
+from .governor import BACKGROUND
+from .workers import BatchQueue
+
+logger = logging.getLogger(__name__)
+
+CARD_FIELDS = ("username", "name", "trust_level", "post_count", "avatar_template")
+AVATAR_SIZE = 48
+
+# Stored for users Discourse does not know (404), so they are not looked up
+# again on every render.
+_MISSING = {}
+# A lookup that failed (rate limited, timeout, ...): not cached, so the next
+# render queues it again.
+_FAILED = None
+
+
+def _cache_key(username):
+    return "discourse:usercard:" + urllib.parse.quote(username.lower(), safe="")
+
+
+def _card_from_response(data):
+    user = (data or {}).get("user") or {}
+    card = {field: user.get(field) for field in CARD_FIELDS}
+    if not card["username"]:
+        return _MISSING
+    avatar = card.pop("avatar_template") or ""
+    if avatar.startswith("/"):
+        avatar = settings.DISCOURSE_INSTANCE_URL + avatar
+    card["avatar_url"] = avatar.replace("{size}", str(AVATAR_SIZE))
+    card["profile_url"] = f"{settings.DISCOURSE_INSTANCE_URL}/u/{card['username']}"
+    return card
+
+
+def _fetch_card(username):
+    try:
+        return _card_from_response(
+            fetch_discourse_data(
+                f"u/{urllib.parse.quote(username)}.json", priority=BACKGROUND
+            )
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        # fetch_discourse_data has already logged the failure.
+        response = getattr(e.__cause__, "response", None)
+        if response is not None and response.status_code == 404:
+            return _MISSING
+        logger.debug("No Discourse user card for %s: %s", username, e)
+        return _FAILED
+
+
+def fetch_user_cards(usernames):
+    """
+    Look ``usernames`` up on Discourse and cache the cards, skipping names
+    cached meanwhile. Discourse has no lookup of several users by username,
+    so each name is a /u/<name>.json request of its own, sent through the
+    governor at background priority; a pool only overlaps them. Unknown
+    users are cached as missing for DISCOURSE_USER_CARD_MISSING_TTL, failed
+    lookups not at all. Runs on the warmer thread, never in a request.
+    """
+    names = list(dict.fromkeys(name for name in usernames if name))
+    cache = caches[settings.DISCOURSE_USER_CARD_CACHE]
+    keys = {name: _cache_key(name) for name in names}
+    cached = cache.get_many(keys.values())
+    misses = [name for name in names if keys[name] not in cached]
+    if not misses:
+        return {}
+    workers = min(len(misses), settings.DISCOURSE_USER_CARD_WORKERS)
+    with tracing.span("discourse.user_cards", misses=len(misses)):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fetched = dict(
+                zip(misses, pool.map(tracing.propagate(_fetch_card), misses))
+            )
+    found = {
+        keys[n]: card
+        for n, card in fetched.items()
+        if card is not _MISSING and card is not _FAILED
+    }
+    missing = {keys[n]: card for n, card in fetched.items() if card is _MISSING}
+    if found:
+        cache.set_many(found, settings.DISCOURSE_USER_CARD_TTL)
+    if missing:
+        cache.set_many(missing, settings.DISCOURSE_USER_CARD_MISSING_TTL)
+    return fetched
+
+
+# Fetches the cards renders did not find in the cache, in batches.
+warmer = BatchQueue(
+    fetch_user_cards,
+    "discourse-user-cards",
+    "fetch Discourse user cards",
+    batch_size=100,
+    max_wait=0.5,
+    maxsize=10000,
+)
+
+
+def get_user_cards(usernames):
+    """
+    Return ``{username: card dict or None}`` for all ``usernames`` from a
+    single cache get_many. Nothing is fetched here: names not cached yet
+    come back as None (rendered as a plain username) and are handed to the
+    warmer, so render time does not depend on how many users are unknown.
+    """
+    names = list(dict.fromkeys(name for name in usernames if name))
+    if not names:
+        return {}
+    cache = caches[settings.DISCOURSE_USER_CARD_CACHE]
+    keys = {name: _cache_key(name) for name in names}
+    cached = cache.get_many(keys.values())
+    for name in names:
+        if keys[name] not in cached:
+            warmer.put(name)
+    return {name: (cached.get(keys[name]) or None) for name in names}
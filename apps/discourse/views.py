@@ -1,51 +1,47 @@
 # apps/discourse/views.py
 
 import logging
-import base64
-import hmac
-import hashlib
-import urllib.parse
 import requests
 
 
 from django.conf import settings
-from django.http import HttpResponseBadRequest, HttpResponseRedirect, HttpResponse
-from django.shortcuts import redirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import redirect, render, resolve_url
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model, login
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.views import LoginView
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from .api import post_sync_sso
+from .attributes import get_payload_serializer
+from .budgets import within_budget
 from .exceptions import SSOValidationError
+from .governor import DiscourseRateLimited
+from .handshake import parse_sso_request, pop_handshake, stash_handshake
 from .mixins import BaseSSOViewMixin
-from .sso import (
-    fix_base64_padding,
-    error_response,
-    generate_sso_payload,
-    build_redirect_url,
-    decode_sso_payload,
-    verify_signature,
-)  # Make sure these functions exist and work correctly.
+from . import export, hashing, profiling, webhooks
 
 logger = logging.getLogger(__name__)
-DISCOURSE_CONNECT_SECRET = settings.DISCOURSE_CONNECT_SECRET  # Same shared secret
 
 
 def sync_discourse_user(sso, sig):
     """Synchronize user session with Discourse after login"""
     try:
-        sync_url = f"{settings.DISCOURSE_INSTANCE_URL}/admin/users/sync_sso"
-        sync_data = {"sso": sso, "sig": sig}
-        headers = {
-            "Content-Type": "application/json",
-            "Api-Key": settings.DISCOURSE_API_KEY,
-            "Api-Username": settings.DISCOURSE_ADMIN_USERNAME,
-        }
-
-        response = requests.post(sync_url, json=sync_data, headers=headers, timeout=10)
+        response = post_sync_sso(sso, sig)
         response.raise_for_status()  # Ensure HTTP errors raise exceptions
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, DiscourseRateLimited) as e:
         logger.error("Failed to sync user with Discourse: %s", e)
 
 
@@ -53,103 +49,72 @@ def index(request):
     return HttpResponse("Discourse app home. Please use the proper SSO URLs.")
 
 
-def fix_base64_padding(encoded_str):
-    """Fix Base64 encoding issues due to missing padding"""
-    missing_padding = len(encoded_str) % 4
-    if missing_padding:
-        encoded_str += "=" * (4 - missing_padding)  # 🔹 Add missing '=' padding
-    return encoded_str
-
-
-@method_decorator(login_required, name="dispatch")
+# Per-view database and latency budgets (see budgets.py). The session and
+# request.user (with its profile) are loaded lazily, so the first view code to
+# touch them pays those two queries. Budgets of views that log a user in
+# include the savepoints a test transaction adds.
+@method_decorator(within_budget("sso.provider.get", queries=2, ms=50), name="get")
+@method_decorator(within_budget("sso.provider.post", queries=4, ms=100), name="post")
 class DiscourseSSOProviderView(BaseSSOViewMixin, View):
     """
     Handles the Discourse SSO handshake via a GET request.
     Utilizes the BaseSSOViewMixin to perform payload validation and redirection.
+
+    Anonymous users are not bounced back here after logging in: the verified
+    handshake is kept in their session and CustomLoginView answers Discourse
+    directly.
     """
 
     def get(self, request):
-        sso = request.GET.get("sso")
-        sig = request.GET.get("sig")
-        logger.debug(f"Incoming GET parameters: %s", request.GET)
-
-        if not sso or not sig:
-            logger.error("Missing SSO parameters in request: %s", request.GET)
-            return HttpResponseBadRequest("SSO parameters are required.")
-
-        fixed_sso = fix_base64_padding(sso)
         try:
-            decoded_payload = base64.b64decode(fixed_sso).decode("utf-8")
-        except UnicodeDecodeError:
-            # logger.error(f"Failed UTF-8 decoding. Raw decoded payload: {base64.b64decode(fixed_sso)}")
-            logger.error("Failed decoding SSO payload: %s", base64.b64decode(fixed_sso))
-            return HttpResponseBadRequest("SSO payload decoding failed.")
-
-        logger.debug(f"Decoded SSO payload: %s", decoded_payload)
-        params = dict(
-            item.split("=") for item in decoded_payload.split("&") if "=" in item
-        )
-        nonce = params.get("nonce")
-        return_sso_url = params.get("return_sso_url")
-
-        if not nonce or not return_sso_url:
-            logger.error("SSO payload missing required nonce or return_sso_url")
+            handshake = parse_sso_request(
+                request.GET.get("sso"), request.GET.get("sig")
+            )
+        except SSOValidationError as e:
+            logger.error("Rejected SSO request: %s", e)
             return HttpResponseBadRequest("Invalid SSO payload.")
 
-        # If user is not authenticated, redirect them to login
+        # If user is not authenticated, remember the handshake and log in.
         if not request.user.is_authenticated:
-            login_url = f"/accounts/login/?sso={sso}&sig={sig}"
-            # return redirect(f"/accounts/login/?sso={sso}&sig={sig}")
-            logger.debug(f"User not authenticated, redirecting to %s", login_url)
+            stash_handshake(request.session, handshake)
+            login_url = resolve_url(settings.LOGIN_URL)
+            logger.debug("User not authenticated, redirecting to %s", login_url)
             return redirect(login_url)
 
         # Now that the user is authenticated, generate a return payload.
         try:
-            # This function should build a query string that includes external_id, email, username, etc.
-            # response_payload = generate_sso_payload(request.user, nonce, return_sso_url)
-            response_payload = generate_sso_payload(request.user, nonce, return_sso_url)
-            redirect_url = build_redirect_url(return_sso_url, response_payload)
-            logger.debug(f"Redirecting user to: %s", redirect_url)
+            redirect_url = self.build_response_url(request.user, handshake)
+            logger.debug("Redirecting user to: %s", redirect_url)
             return HttpResponseRedirect(redirect_url)
         except Exception as e:
             logger.error("Error generating SSO response: %s", e)
             return HttpResponseBadRequest("Error generating SSO response.")
 
+    @method_decorator(login_required)
     def post(self, request):
-        sso = request.POST.get("sso")
-        sig = request.POST.get("sig")
-
-        if not sso or not sig:
-            logger.error("Missing SSO parameters in POST request.")
-            return HttpResponseBadRequest("Missing SSO parameters.")
-
         try:
-            verify_signature(sso, sig)
-            payload = decode_sso_payload(sso)
-        except Exception as e:
+            handshake = parse_sso_request(
+                request.POST.get("sso"),
+                request.POST.get("sig"),
+                required=("nonce", "return_sso_url", "external_id"),
+            )
+        except SSOValidationError as e:
             logger.error("Error verifying SSO payload in POST: %s", e)
             return HttpResponseBadRequest("Invalid payload or signature.")
 
-        nonce = payload.get("nonce")
-        return_sso_url = payload.get("return_sso_url")
-        external_id = payload.get("external_id")  # Ensure external_id is provided
-
-        if not nonce or not return_sso_url or not external_id:
-            logger.error("Missing required parameters in payload (POST).")
-            return HttpResponseBadRequest("Missing required parameters in payload.")
-
         # Authenticate user in Django using external_id
         User = get_user_model()
         try:
-            user = User.objects.get(id=external_id)
+            user = (
+                get_payload_serializer().queryset().get(id=handshake.get("external_id"))
+            )
             login(request, user)  # Log in user in Django session
-        except User.DoesNotExist:
+        except (User.DoesNotExist, ValueError):
             logger.error("SSO login failed: User not found in Django.")
             return HttpResponseBadRequest("User not found.")
 
         try:
-            response_payload = generate_sso_payload(user, nonce, return_sso_url)
-            redirect_url = build_redirect_url(return_sso_url, response_payload)
+            redirect_url = self.build_response_url(user, handshake)
         except Exception as e:
             logger.error("Error generating SSO response in POST: %s", e)
             return HttpResponseBadRequest("Error generating SSO response.")
@@ -160,7 +125,8 @@ class DiscourseSSOProviderView(BaseSSOViewMixin, View):
 
 @method_decorator(csrf_exempt, name="dispatch")
 @method_decorator(login_required, name="dispatch")
-class DiscourseSSOLoginView(View):
+@method_decorator(within_budget("sso.login.post", queries=0, ms=50), name="post")
+class DiscourseSSOLoginView(BaseSSOViewMixin, View):
     """
     POST endpoint for handling the SSO callback from Discourse.
 
@@ -169,28 +135,16 @@ class DiscourseSSOLoginView(View):
     """
 
     def post(self, request):
-        sso = request.POST.get("sso")
-        sig = request.POST.get("sig")
-        if not sso or not sig:
-            logger.error("Missing SSO parameters in POST request.")
-            return HttpResponseBadRequest("Missing SSO parameters.")
-
         try:
-            verify_signature(sso, sig)
-            payload = decode_sso_payload(sso)
-        except Exception as e:
+            handshake = parse_sso_request(
+                request.POST.get("sso"), request.POST.get("sig")
+            )
+        except SSOValidationError as e:
             logger.error("Error verifying SSO payload in POST: %s", e)
             return HttpResponseBadRequest("Invalid payload or signature.")
 
-        nonce = payload.get("nonce")
-        return_sso_url = payload.get("return_sso_url")
-        if not nonce or not return_sso_url:
-            logger.error("Missing required parameters in payload (POST).")
-            return HttpResponseBadRequest("Missing required parameters in payload.")
-
         try:
-            response_payload = generate_sso_payload(request.user, nonce, return_sso_url)
-            redirect_url = build_redirect_url(return_sso_url, response_payload)
+            redirect_url = self.build_response_url(request.user, handshake)
         except Exception as e:
             logger.error("Error generating SSO response in POST: %s", e)
             return HttpResponseBadRequest("Error generating SSO response.")
@@ -199,37 +153,182 @@ class DiscourseSSOLoginView(View):
         return redirect(redirect_url)
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class DiscourseWebhookView(View):
+    """
+    Receives Discourse webhooks (user created/updated/suspended, ...).
+
+    The HMAC signature is verified and the event is stored for the background
+    batcher with one INSERT; the request is acknowledged before it is applied.
+    """
+
+    def post(self, request):
+        body = request.body
+        if not webhooks.verify_webhook_signature(
+            body, request.META.get(webhooks.SIGNATURE_HEADER)
+        ):
+            logger.error("Rejected Discourse webhook with invalid signature.")
+            return HttpResponseForbidden("Invalid signature.")
+
+        event = webhooks.parse_webhook_event(
+            request.META.get(webhooks.EVENT_HEADER, ""),
+            request.META.get(webhooks.EVENT_ID_HEADER, ""),
+            body,
+        )
+        if event is None:
+            # Pings and events we do not mirror are acknowledged and ignored.
+            return HttpResponse("OK")
+
+        if not webhooks.batcher.enqueue(event):
+            # Let Discourse retry the delivery later.
+            return HttpResponse("Busy", status=503)
+        return HttpResponse("OK", status=202)
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class SsoEventLogExportView(View):
+    """
+    Streams SsoEventLog rows as NDJSON or CSV, optionally gzip-compressed.
+    Accepts the filters of SsoEventExportForm as query parameters.
+    """
+
+    def get(self, request):
+        form = export.SsoEventExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        params = form.cleaned_data
+
+        rows = export.export_rows(
+            start=params["start"],
+            end=params["end"],
+            event_type=params["event_type"],
+            user=params["user"],
+        )
+        # A gzip export is a .gz download, not a transfer encoding.
+        content_type = (
+            "application/gzip"
+            if params["gzip"]
+            else export.CONTENT_TYPES[params["format"]]
+        )
+        response = StreamingHttpResponse(
+            export.render_export(rows, params["format"], params["gzip"]),
+            content_type=content_type,
+        )
+        filename = export.export_filename(params["format"], params["gzip"])
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class RequestProfileListView(View):
+    """
+    Lists the request profiles in the ring and hands out a short-lived token
+    for the X-Discourse-Profile header to profile requests on demand.
+    """
+
+    def get(self, request):
+        return render(
+            request,
+            "admin/discourse/request_profiles.html",
+            {
+                # Site header, user tools and nav sidebar of the admin base template.
+                **admin.site.each_context(request),
+                "title": "Request profiles",
+                "profiles": profiling.ring.entries(),
+                "token": profiling.make_profile_token(),
+                "header": "X-Discourse-Profile",
+                "sample_rate": settings.DISCOURSE_PROFILE_SAMPLE_RATE,
+            },
+        )
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class RequestProfileDownloadView(View):
+    """Serves a stored profile as a .prof file, or as pstats text with ?format=txt."""
+
+    def get(self, request, name):
+        try:
+            if request.GET.get("format") == "txt":
+                return HttpResponse(
+                    profiling.ring.render_text(
+                        name, sort=request.GET.get("sort", "cumulative")
+                    ),
+                    content_type="text/plain; charset=utf-8",
+                )
+            return FileResponse(
+                open(profiling.ring.path(name), "rb"),
+                as_attachment=True,
+                filename=name,
+                content_type="application/octet-stream",
+            )
+        except FileNotFoundError:
+            raise Http404("No such profile.") from None
+        except KeyError:
+            return HttpResponseBadRequest("Unknown sort key.")
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class PasswordHashingMetricsView(View):
+    """Pool wait, hash time and rejections of the password hashing pool, as JSON."""
+
+    def get(self, request):
+        return JsonResponse(hashing.pool.stats())
+
+
+@within_budget("sso.provider_by_external_id", queries=8, ms=100)
 def discourse_sso_provider(request):
     """Handles Discourse SSO login requests."""
-    sso_payload = request.GET.get("sso")
-    sig = request.GET.get("sig")
-
-    # Verify signature
-    expected_sig = hmac.new(
-        DISCOURSE_CONNECT_SECRET.encode(), sso_payload.encode(), hashlib.sha256
-    ).hexdigest()
-    if expected_sig != sig:
+    try:
+        handshake = parse_sso_request(
+            request.GET.get("sso"), request.GET.get("sig"), required=("external_id",)
+        )
+    except SSOValidationError:
         return HttpResponseBadRequest("Invalid SSO request.")
 
-    # Decode payload
-    decoded_payload = base64.b64decode(sso_payload).decode()
-    params = dict(item.split("=") for item in decoded_payload.split("&"))
-    external_id = params.get("external_id")
-
     # Authenticate user in Django
     User = get_user_model()
     try:
-        user = User.objects.get(id=external_id)
+        user = get_payload_serializer().queryset().get(id=handshake.get("external_id"))
         login(request, user)
         return HttpResponseRedirect(settings.DISCOURSE_SSO_RETURN_URL)
-    except User.DoesNotExist:
+    except (User.DoesNotExist, ValueError):
         return HttpResponseBadRequest("User not found.")
 
 
-class CustomLoginView(LoginView):
+@method_decorator(within_budget("login.get", queries=0, ms=100), name="get")
+# Password hashing alone takes a few hundred milliseconds. On PostgreSQL the
+# last_login save also sends one NOTIFY (invalidation.py).
+@method_decorator(within_budget("login.post", queries=10, ms=1500), name="post")
+class CustomLoginView(BaseSSOViewMixin, LoginView):
     template_name = "registration/login.html"
     """Preserve SSO parameters when redirecting after login"""
 
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        retry_after = getattr(request, "password_hash_retry_after", None)
+        if retry_after is not None:
+            # The backend shed the login (hashing.py): say so instead of
+            # showing "wrong password".
+            response = HttpResponse("Too many logins, please retry.", status=503)
+            response["Retry-After"] = str(retry_after)
+        return response
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # Fast path: a handshake verified by DiscourseSSOProviderView is waiting
+        # in the session, so answer Discourse now instead of bouncing back
+        # through the provider view (one redirect and one verify fewer).
+        handshake = pop_handshake(self.request.session)
+        if handshake is None:
+            return response
+        try:
+            return HttpResponseRedirect(
+                self.build_response_url(form.get_user(), handshake)
+            )
+        except SSOValidationError as e:
+            logger.error("Pending SSO handshake rejected after login: %s", e)
+            return response
+
     def get_success_url(self):
         # next_url = self.request.GET.get("next", "/")
         sso = self.request.GET.get("sso")
@@ -0,0 +1,240 @@
+# apps/discourse/webhooks.py
+
+import hashlib
+import hmac
+import json
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import invalidation
+from .models import DiscourseProfile, PendingWebhookEvent
+from .workers import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+# Discourse sends the event metadata as request headers.
+SIGNATURE_HEADER = "HTTP_X_DISCOURSE_EVENT_SIGNATURE"
+EVENT_HEADER = "HTTP_X_DISCOURSE_EVENT"
+EVENT_TYPE_HEADER = "HTTP_X_DISCOURSE_EVENT_TYPE"
+EVENT_ID_HEADER = "HTTP_X_DISCOURSE_EVENT_ID"
+
+# Fields of the Discourse user payload that are mirrored locally.
+USER_FIELDS = ("username", "email", "suspended_till")
+
+WebhookEvent = namedtuple(
+    "WebhookEvent", ["event", "event_id", "external_id", "fields"]
+)
+
+
+def verify_webhook_signature(body, signature_header):
+    """
+    Verify the ``X-Discourse-Event-Signature`` header against the raw body.
+    Discourse signs the body with HMAC-SHA256 and sends ``sha256=<hexdigest>``.
+    """
+    secret = settings.DISCOURSE_WEBHOOK_SECRET
+    if not secret or not signature_header:
+        return False
+    algorithm, _, provided = signature_header.partition("=")
+    if algorithm != "sha256" or not provided:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, provided)
+
+
+def parse_webhook_event(event, event_id, body):
+    """
+    Turn a verified webhook delivery into a WebhookEvent.
+    Returns None for deliveries we do not mirror (pings, non-user events,
+    users that were not provisioned through our SSO).
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    user = data.get("user") if isinstance(data, dict) else None
+    if not isinstance(user, dict) or not user.get("external_id"):
+        return None
+    fields = {name: user.get(name) for name in USER_FIELDS if name in user}
+    return WebhookEvent(event, event_id, str(user["external_id"]), fields)
+
+
+def _parse_timestamp(value):
+    """Parse a Discourse ISO timestamp, honouring the project's USE_TZ."""
+    parsed = parse_datetime(value) if value else None
+    if parsed is not None and not settings.USE_TZ and timezone.is_aware(parsed):
+        parsed = timezone.make_naive(parsed)
+    return parsed
+
+
+def coalesce_events(events):
+    """
+    Deduplicate a batch so every user is touched at most once.
+    Later deliveries override earlier ones field by field.
+    """
+    merged = {}
+    for event in events:
+        merged.setdefault(event.external_id, {}).update(event.fields)
+    return merged
+
+
+def apply_webhook_events(events):
+    """
+    Apply a batch of webhook events to DiscourseProfile and User.
+    Uses one SELECT and one bulk UPDATE per model regardless of the batch size.
+    Writes go through bulk_update so the post_save sync back to Discourse
+    is not triggered for changes that originated on the forum; cached users
+    are invalidated here instead, as the post_save receivers would.
+    """
+    merged = coalesce_events(events)
+    user_ids = [int(ext_id) for ext_id in merged if ext_id.isdigit()]
+    if not user_ids:
+        return 0
+
+    User = get_user_model()
+    with transaction.atomic():
+        users = (
+            User.objects.select_for_update().filter(id__in=user_ids).only("id", "email")
+        )
+        profiles = {
+            p.user_id: p
+            for p in DiscourseProfile.objects.select_for_update().filter(
+                user_id__in=user_ids
+            )
+        }
+        changed_users, changed_profiles = [], []
+        for user in users:
+            fields = merged[str(user.id)]
+            profile = profiles.get(user.id)
+            if profile is None:
+                continue
+            if "username" in fields:
+                profile.username = fields["username"]
+            if "email" in fields and fields["email"]:
+                profile.email = fields["email"]
+                if user.email != fields["email"]:
+                    user.email = fields["email"]
+                    changed_users.append(user)
+            if "suspended_till" in fields:
+                profile.suspended_till = _parse_timestamp(fields["suspended_till"])
+            changed_profiles.append(profile)
+
+        User.objects.bulk_update(changed_users, ["email"])
+        DiscourseProfile.objects.bulk_update(
+            changed_profiles, ["username", "email", "suspended_till"]
+        )
+        invalidation.publish_many(
+            invalidation.USER_CACHE, [p.user_id for p in changed_profiles]
+        )
+    return len(changed_profiles)
+
+
+class WebhookBatcher:
+    """
+    Durable queue of webhook events in the PendingWebhookEvent table.
+
+    Request threads only insert the event; a background thread per process
+    applies pending rows in id order, in batches of up to ``batch_size``,
+    and deletes them in the same transaction. It wakes up when this process
+    queued an event and every ``max_wait`` seconds otherwise, which picks up
+    events left by other processes, failures and restarts. A failed batch
+    is retried one event at a time; an event that failed ``max_attempts``
+    times is left in the table (see the admin) instead of blocking the rest.
+    """
+
+    def __init__(self, batch_size=500, max_wait=1.0, max_attempts=5):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.worker = PeriodicWorker(
+            self.drain, max_wait, "discourse-webhooks", "drain Discourse webhook events"
+        )
+
+    def enqueue(self, event):
+        """Store an event for the batcher. Returns False if it could not be stored."""
+        self.worker.ensure_started()
+        try:
+            PendingWebhookEvent.objects.create(
+                event=event.event[:64],
+                event_id=event.event_id[:64],
+                external_id=event.external_id[:255],
+                fields=event.fields,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error(
+                "Could not queue Discourse webhook event %s: %s", event.event_id, e
+            )
+            return False
+        transaction.on_commit(self.worker.wake)
+        return True
+
+    def _apply(self, ids):
+        """Apply and delete the pending events ``ids``. Returns (events, profiles)."""
+        with transaction.atomic():
+            # Workers drain in turn: a concurrent batch waits for these rows,
+            # so events for one user are never applied out of order.
+            rows = list(
+                PendingWebhookEvent.objects.select_for_update()
+                .filter(id__in=ids)
+                .order_by("id")
+            )
+            applied = apply_webhook_events(
+                [
+                    WebhookEvent(row.event, row.event_id, row.external_id, row.fields)
+                    for row in rows
+                ]
+            )
+            PendingWebhookEvent.objects.filter(id__in=[row.id for row in rows]).delete()
+        return len(rows), applied
+
+    def drain(self):
+        """Apply pending events until none are left. Returns the number applied."""
+        total = 0
+        while True:
+            ids = list(
+                PendingWebhookEvent.objects.filter(attempts__lt=self.max_attempts)
+                .order_by("id")
+                .values_list("id", flat=True)[: self.batch_size]
+            )
+            if not ids:
+                return total
+            try:
+                count, applied = self._apply(ids)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Failed to apply Discourse webhook batch: %s", e)
+                count, applied = self._apply_one_by_one(ids)
+            logger.info(
+                "Applied %d Discourse webhook events to %d profiles", count, applied
+            )
+            total += count
+            if len(ids) < self.batch_size:
+                return total
+
+    def _apply_one_by_one(self, ids):
+        count = applied = 0
+        for event_id in ids:
+            try:
+                one_count, one_applied = self._apply([event_id])
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(
+                    "Failed to apply Discourse webhook event %s: %s", event_id, e
+                )
+                PendingWebhookEvent.objects.filter(id=event_id).update(
+                    attempts=F("attempts") + 1
+                )
+                continue
+            count += one_count
+            applied += one_applied
+        return count, applied
+
+
+batcher = WebhookBatcher(
+    batch_size=settings.DISCOURSE_WEBHOOK_BATCH_SIZE,
+    max_wait=settings.DISCOURSE_WEBHOOK_BATCH_WAIT,
+    max_attempts=settings.DISCOURSE_WEBHOOK_MAX_ATTEMPTS,
+)
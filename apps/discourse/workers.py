@@ -0,0 +1,140 @@
+# apps/discourse/workers.py
+"""
+Background threads shared by the batchers of this app.
+
+gunicorn forks its workers after the app has been imported, and a forked
+process does not inherit the threads of its parent. BackgroundThread keeps
+the pid that started its thread and starts another one in each process on
+first use there. PeriodicWorker and BatchQueue build the two loops the app
+needs on top of it: call a function every few seconds (or when woken up),
+and hand the items of an in-memory queue to a function in batches.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundThread:
+    """A daemon thread running ``target``, started once per process."""
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def alive(self):
+        return (
+            self._thread is not None
+            and self._thread.is_alive()
+            and self._pid == os.getpid()
+        )
+
+    def ensure_started(self):
+        if self.alive():
+            return
+        with self._lock:
+            if self.alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self.target, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+
+class PeriodicWorker:
+    """
+    Calls ``func`` on a background thread every ``interval`` seconds, or as
+    soon as wake() is called. Each call gets fresh database connections; a
+    failure is logged as "Failed to <description>" and the next call waits a
+    full interval.
+    """
+
+    def __init__(self, func, interval, name, description):
+        self.func = func
+        self.interval = interval
+        self.description = description
+        self._wakeup = threading.Event()
+        self.thread = BackgroundThread(self._run, name)
+
+    def ensure_started(self):
+        self.thread.ensure_started()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                self.func()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Failed to %s: %s", self.description, e)
+                time.sleep(self.interval)
+            finally:
+                close_old_connections()
+
+
+def next_batch(items, batch_size, max_wait):
+    """
+    Block for the first item of the queue ``items``, then take more until
+    there are ``batch_size`` or ``max_wait`` seconds have passed.
+    """
+    batch = [items.get()]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(items.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+class BatchQueue:
+    """
+    Bounded in-memory queue whose items a background thread hands to
+    ``func`` in batches (see next_batch()). put() never blocks: items that
+    do not fit are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, func, name, description, batch_size, max_wait, maxsize):
+        self.func = func
+        self.description = description
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.items = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.thread = BackgroundThread(self._run, name)
+
+    def put(self, item):
+        self.thread.ensure_started()
+        try:
+            self.items.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            batch = next_batch(self.items, self.batch_size, self.max_wait)
+            try:
+                self.func(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(
+                    "Failed to %s (%d items): %s", self.description, len(batch), e
+                )
@@ -27,6 +27,8 @@ INSTALLED_APPS = [
 # Middleware settings must include session, authentication, and message middleware.
 # Note the order: SessionMiddleware should come before AuthenticationMiddleware.
 MIDDLEWARE = [
+    'apps.discourse.middleware.TracingMiddleware',  # Outermost, so the root span covers the request
+    'apps.discourse.middleware.ProfilingMiddleware',  # Profiles the rest of the middleware and the view
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',  # Required by admin (must be first)
     'django.middleware.common.CommonMiddleware',
@@ -100,9 +102,182 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# collectstatic writes fingerprinted copies plus .gz/.br variants
+# (apps/discourse/staticfiles.py). {% static %} fails until it has run, so
+# deploys run it before starting gunicorn (docker-compose.yml); development
+# keeps the plain storage so it works without collectstatic.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'apps.discourse.staticfiles.PrecompressedManifestStaticFilesStorage',
+    },
+}
+# Files smaller than this are not worth a compressed variant.
+DISCOURSE_STATIC_COMPRESS_MIN_SIZE = 256
+# Cache lifetime of static files without a fingerprint in their name.
+DISCOURSE_STATIC_MAX_AGE = int(os.getenv('DISCOURSE_STATIC_MAX_AGE', '3600'))
+
 ALLOWED_HOSTS = ['*']  # Or use '*' for development
 
 ROOT_URLCONF = 'myproject.urls'
 
+# Loads request.user together with its DiscourseProfile (see apps/discourse/backends.py).
+AUTHENTICATION_BACKENDS = [
+    'apps.discourse.backends.DiscourseModelBackend',
+]
+
 LOGIN_REDIRECT_URL = "/discourse/session/sso_provider/?sso={sso}&sig={sig}"
 #LOGIN_REDIRECT_URL = "/discourse/session/sso_provider/"
+
+# Discourse webhooks (Admin > API > Webhooks on the forum side).
+DISCOURSE_WEBHOOK_SECRET = os.getenv("DISCOURSE_WEBHOOK_SECRET", "")
+DISCOURSE_WEBHOOK_BATCH_SIZE = int(os.getenv("DISCOURSE_WEBHOOK_BATCH_SIZE", "500"))
+DISCOURSE_WEBHOOK_BATCH_WAIT = float(os.getenv("DISCOURSE_WEBHOOK_BATCH_WAIT", "1.0"))
+# Accepted events wait in the PendingWebhookEvent table; one that fails this
+# many times is left there for inspection.
+DISCOURSE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("DISCOURSE_WEBHOOK_MAX_ATTEMPTS", "5"))
+
+# Users waiting for a Discourse sync (group changes, bulk imports) are kept in
+# the PendingUserSync table and synced by a background thread of each web
+# worker (apps/discourse/syncqueue.py), BATCH_SIZE users per claim. A claim
+# older than CLAIM_TIMEOUT seconds is taken over by another worker.
+DISCOURSE_USER_SYNC_BATCH_SIZE = int(os.getenv("DISCOURSE_USER_SYNC_BATCH_SIZE", "100"))
+DISCOURSE_USER_SYNC_INTERVAL = float(os.getenv("DISCOURSE_USER_SYNC_INTERVAL", "5.0"))
+DISCOURSE_USER_SYNC_CLAIM_TIMEOUT = int(os.getenv("DISCOURSE_USER_SYNC_CLAIM_TIMEOUT", "3600"))
+DISCOURSE_USER_SYNC_WORKERS = int(os.getenv("DISCOURSE_USER_SYNC_WORKERS", "4"))
+
+# Fraction of DEBUG/INFO records from apps.discourse that are kept (1.0 keeps all).
+DISCOURSE_LOG_SAMPLE_RATE = float(os.getenv("DISCOURSE_LOG_SAMPLE_RATE", "1.0"))
+
+# Allowed return_sso_url prefixes, e.g. "https://forum.example.com/session/".
+# Comma-separated in the environment; defaults to DISCOURSE_INSTANCE_URL.
+DISCOURSE_SSO_RETURN_ALLOWLIST = [
+    entry.strip()
+    for entry in os.getenv("DISCOURSE_SSO_RETURN_ALLOWLIST", "").split(",")
+    if entry.strip()
+]
+
+# DiscourseConnect parameters sent for a user (apps/discourse/attributes.py):
+# a field, a "relation.field" path, or a list of them joined with spaces.
+# Booleans are sent as true/false; empty lists and None are left out. E.g.
+# "admin": "is_superuser", "moderator": "is_staff" or "custom.x": "...".
+DISCOURSE_SSO_ATTRIBUTES = {
+    "external_id": "id",
+    "email": "email",
+    "username": "username",
+    "name": ["first_name", "last_name"],
+    "add_groups": "discourse_profile.group_names",
+    "remove_groups": "discourse_profile.removed_group_names",
+}
+
+# Outbound Discourse API throttling (apps/discourse/governor.py). Discourse
+# allows 60 admin API requests per minute per key by default.
+DISCOURSE_API_REQUESTS_PER_SECOND = float(os.getenv("DISCOURSE_API_REQUESTS_PER_SECOND", "1.0"))
+DISCOURSE_API_MAX_CONCURRENCY = int(os.getenv("DISCOURSE_API_MAX_CONCURRENCY", "8"))
+DISCOURSE_API_GOVERNOR_CACHE = os.getenv("DISCOURSE_API_GOVERNOR_CACHE", "default")
+
+# Seconds a verified SSO handshake waits in the session for the user to log in.
+DISCOURSE_SSO_HANDSHAKE_TTL = int(os.getenv("DISCOURSE_SSO_HANDSHAKE_TTL", "600"))
+
+# Sync results are written to DiscourseProfile in batches (apps/discourse/profiles.py).
+DISCOURSE_SYNC_STATUS_BATCH_SIZE = int(os.getenv("DISCOURSE_SYNC_STATUS_BATCH_SIZE", "500"))
+DISCOURSE_SYNC_STATUS_FLUSH_INTERVAL = float(os.getenv("DISCOURSE_SYNC_STATUS_FLUSH_INTERVAL", "5.0"))
+
+# Request tracing (apps/discourse/tracing.py). Spans are exported as OTLP/JSON,
+# appended to DISCOURSE_TRACE_FILE and/or POSTed to an OTLP/HTTP endpoint such
+# as http://localhost:4318/v1/traces; tracing is off when neither is set.
+DISCOURSE_TRACE_SAMPLE_RATE = float(os.getenv("DISCOURSE_TRACE_SAMPLE_RATE", "0.1"))
+DISCOURSE_TRACE_FILE = os.getenv("DISCOURSE_TRACE_FILE", "")
+DISCOURSE_TRACE_OTLP_ENDPOINT = os.getenv("DISCOURSE_TRACE_OTLP_ENDPOINT", "")
+DISCOURSE_TRACE_SERVICE = os.getenv("DISCOURSE_TRACE_SERVICE", "copdjsso")
+# Clients (REMOTE_ADDR) whose traceparent sampled flag is honoured, e.g. the
+# Discourse host. Anyone else could force every request to be traced, so for
+# them the sampling decision is made here and only the trace id is continued.
+DISCOURSE_TRACE_TRUSTED_CALLERS = [c for c in os.getenv("DISCOURSE_TRACE_TRUSTED_CALLERS", "").split(",") if c]
+
+# Sampled request profiling (apps/discourse/middleware.py). Profiles of the
+# listed views go to a ring of at most DISCOURSE_PROFILE_RING_SIZE pstats
+# files; staff can list them and get an on-demand header token at
+# /discourse/profiles/.
+DISCOURSE_PROFILE_SAMPLE_RATE = float(os.getenv("DISCOURSE_PROFILE_SAMPLE_RATE", "0.0"))
+DISCOURSE_PROFILE_VIEWS = [
+    "apps.discourse.views.DiscourseSSOProviderView",
+    "apps.discourse.views.CustomLoginView",
+]
+DISCOURSE_PROFILE_DIR = os.getenv("DISCOURSE_PROFILE_DIR", str(BASE_DIR / "profiles"))
+DISCOURSE_PROFILE_RING_SIZE = int(os.getenv("DISCOURSE_PROFILE_RING_SIZE", "50"))
+DISCOURSE_PROFILE_TOKEN_MAX_AGE = int(os.getenv("DISCOURSE_PROFILE_TOKEN_MAX_AGE", "3600"))
+
+# Forum user cards ({% discourse_user_card %}), cached per username. Renders
+# only read the cache; missing cards are fetched by a background warmer.
+DISCOURSE_USER_CARD_CACHE = os.getenv("DISCOURSE_USER_CARD_CACHE", "default")
+DISCOURSE_USER_CARD_TTL = int(os.getenv("DISCOURSE_USER_CARD_TTL", "900"))
+DISCOURSE_USER_CARD_MISSING_TTL = int(os.getenv("DISCOURSE_USER_CARD_MISSING_TTL", "60"))
+DISCOURSE_USER_CARD_WORKERS = int(os.getenv("DISCOURSE_USER_CARD_WORKERS", "4"))
+
+# Query and latency budgets of the SSO views (apps/discourse/budgets.py).
+# Query count violations raise while enforced (tests); latency violations,
+# and all violations otherwise, are logged as warnings for the sampled share
+# of requests.
+DISCOURSE_BUDGET_ENFORCE = os.getenv("DISCOURSE_BUDGET_ENFORCE", "False") == "True"
+DISCOURSE_BUDGET_SAMPLE_RATE = float(os.getenv("DISCOURSE_BUDGET_SAMPLE_RATE", "0.01"))
+
+# Store SsoEventLog payload details as nonce/external_id/return_host columns
+# plus a compressed blob (apps/discourse/eventlog.py), capped at this size.
+DISCOURSE_SSO_EVENT_COMPACT = os.getenv("DISCOURSE_SSO_EVENT_COMPACT", "True") == "True"
+DISCOURSE_SSO_EVENT_DETAILS_MAX_BYTES = int(os.getenv("DISCOURSE_SSO_EVENT_DETAILS_MAX_BYTES", "4096"))
+
+# Sessions live in the cache and are written back to the database in
+# batches (apps/discourse/sessions.py). SESSION_CACHE_ALIAS must be shared by
+# all workers and take values of any size: "sessions" below, or Redis.
+SESSION_ENGINE = "apps.discourse.sessions"
+SESSION_CACHE_ALIAS = "sessions"
+DISCOURSE_SESSION_WRITE_BATCH_SIZE = int(os.getenv("DISCOURSE_SESSION_WRITE_BATCH_SIZE", "500"))
+DISCOURSE_SESSION_WRITE_INTERVAL = float(os.getenv("DISCOURSE_SESSION_WRITE_INTERVAL", "1.0"))
+
+# Password checks run inline (0) or in a pool of this many processes per
+# gunicorn worker (apps/discourse/hashing.py); keep gunicorn workers times
+# this within the cores. Off by default: only threaded (gthread) workers gain
+# from it, and the right size depends on the gunicorn setup. Logins beyond MAX_PENDING checks in flight per
+# worker, or waiting longer than TIMEOUT seconds, get a 503.
+DISCOURSE_PASSWORD_HASH_WORKERS = int(os.getenv("DISCOURSE_PASSWORD_HASH_WORKERS", "0"))
+DISCOURSE_PASSWORD_HASH_MAX_PENDING = int(os.getenv("DISCOURSE_PASSWORD_HASH_MAX_PENDING", str(4 * DISCOURSE_PASSWORD_HASH_WORKERS or 16)))
+DISCOURSE_PASSWORD_HASH_TIMEOUT = float(os.getenv("DISCOURSE_PASSWORD_HASH_TIMEOUT", "5"))
+
+# Secrets retired by a DiscourseConnect secret rotation (comma-separated).
+# Only audit_sso_signatures uses them; live requests need the current secret.
+DISCOURSE_CONNECT_PREVIOUS_SECRETS = [s for s in os.getenv("DISCOURSE_CONNECT_PREVIOUS_SECRETS", "").split(",") if s]
+
+# In-process caches are invalidated across workers with NOTIFY on this
+# channel of this database (apps/discourse/invalidation.py; PostgreSQL only).
+DISCOURSE_INVALIDATION_CHANNEL = os.getenv("DISCOURSE_INVALIDATION_CHANNEL", "discourse_invalidate")
+DISCOURSE_INVALIDATION_DATABASE = "default"
+# request.user is served from such a cache for this many seconds at most.
+DISCOURSE_USER_CACHE_SIZE = int(os.getenv("DISCOURSE_USER_CACHE_SIZE", "10000"))
+DISCOURSE_USER_CACHE_TTL = float(os.getenv("DISCOURSE_USER_CACHE_TTL", "300"))
+
+# One cache per host, shared by all gunicorn workers through a memory-mapped
+# file (apps/discourse/mmapcache.py): no Redis or memcached needed. The file
+# is SLOTS * SLOT_SIZE bytes and holds values up to SLOT_SIZE only; sessions
+# go to files instead. DISCOURSE_CACHE_DIR must be private to the user the
+# workers run as (it is created with mode 0700); a directory on tmpfs under
+# /run or /dev/shm is fastest.
+DISCOURSE_CACHE_DIR = os.getenv("DISCOURSE_CACHE_DIR", str(BASE_DIR / "var" / "cache"))
+CACHES = {
+    "default": {
+        "BACKEND": "apps.discourse.mmapcache.MmapCache",
+        "LOCATION": os.path.join(DISCOURSE_CACHE_DIR, "cache.mmap"),
+        "OPTIONS": {
+            "SLOTS": int(os.getenv("DISCOURSE_CACHE_SLOTS", "32768")),
+            "SLOT_SIZE": int(os.getenv("DISCOURSE_CACHE_SLOT_SIZE", "2048")),
+            "WAYS": 8,
+        },
+    },
+    "sessions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(DISCOURSE_CACHE_DIR, "sessions"),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("DISCOURSE_SESSION_CACHE_MAX_ENTRIES", "100000")),
+        },
+    },
+}
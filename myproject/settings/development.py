@@ -3,6 +3,22 @@ import os
 from .base import *
 
 DEBUG = True
+
+STORAGES = {
+    **STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# runserver is a single process; keep the caches in memory.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+# ... so the API governor's budget needs no cache shared between processes.
+SILENCED_SYSTEM_CHECKS = ['discourse.E001']
 #ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 
 DATABASES = {
@@ -33,11 +49,25 @@ DISCOURSE_ADMIN_USERNAME = 'admin'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        # Keep a fraction of the per-request DEBUG/INFO records of the SSO flow.
+        'sample': {
+            '()': 'apps.discourse.log.SamplingFilter',
+            'rate': DISCOURSE_LOG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        # Hands records to a background thread; redacts payloads and signatures.
+        'discourse_async': {
+            'class': 'apps.discourse.log.AsyncQueueHandler',
+            'target': 'logging.StreamHandler',
+            'formatter': 'simple',
+            'filters': ['sample'],
+        },
     },
     'formatters': {
         'simple': {
@@ -51,11 +81,9 @@ LOGGING = {
             'propagate': True,
         },
         'apps.discourse': {
-            'handlers': ['console'],
+            'handlers': ['discourse_async'],
             'level': 'DEBUG',
             'propagate': False,
         },
     },
 }
-
-
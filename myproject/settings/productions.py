@@ -29,3 +29,34 @@ SECURE_HSTS_SECONDS = 3600          # Enables HTTP Strict Transport Security
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'apps.discourse.log.SamplingFilter',
+            'rate': DISCOURSE_LOG_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'discourse_async': {
+            'class': 'apps.discourse.log.AsyncQueueHandler',
+            'target': 'logging.StreamHandler',
+            'formatter': 'simple',
+            'filters': ['sample'],
+        },
+    },
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s'
+        },
+    },
+    'loggers': {
+        'apps.discourse': {
+            'handlers': ['discourse_async'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
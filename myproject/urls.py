@@ -14,12 +14,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from django.http import HttpResponse
 #from django.contrib.auth import views as auth_views
 #from django.contrib.auth.views import LoginView
 from apps.discourse.views import CustomLoginView  # Import your custom login view
+from apps.discourse.staticfiles import serve_static
 from .views import home
 
 
@@ -41,4 +45,9 @@ urlpatterns = [
     # Optionally, if you need the SSO endpoints at the root level, you can include them directly
     # path('', include('apps.discourse.urls')),
     path('', home, name='home'),
+
+    # Fingerprinted, precompressed assets with far-future caching
+    # (apps/discourse/staticfiles.py), for deployments without a web server or
+    # CDN in front of STATIC_URL.
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static, name='static'),
 ]